@@ -1,95 +1,159 @@
-from pathlib import Path
+"""Harvest of the GE1/1 GLB efficiency from the DQMIO files of every run.
+
+Each file is read by a worker of a process pool, which returns a compact
+record of NumPy arrays per run; the records are merged into ``out.json`` at
+the end.
+"""
+from __future__ import annotations
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
 from dataclasses import dataclass
 import json
-import uproot
-import sqlite3
+import os
+from pathlib import Path
+from typing import Optional
 import numpy as np
+import tqdm
+import uproot
+
+DEFAULT_DATA_DIR = Path('/store/user/jwheo/DQMGUI_data/Run2022/')
+STATION = 1
+REGIONS = ['M', 'P']
+LAYERS = [1, 2]
+NUM_CHAMBERS = 36
+# the Muon primary dataset before this run is not used
+FIRST_MUON_RUN = 355681
+
+# one row per (region, layer), in the order of REGIONS and LAYERS
+RECORD_DTYPE = np.dtype([
+    ('label', 'U16'),
+    ('denominator', np.float64, (NUM_CHAMBERS, )),
+    ('numerator', np.float64, (NUM_CHAMBERS, )),
+    ('efficiency', np.float64, (NUM_CHAMBERS, )),
+    ('inactive', np.float64, (NUM_CHAMBERS, )),
+])
 
 
 @dataclass
-class DQMInfo:
-    region: int
-    station: int
-    layer: int
+class RunRecord:
     run: int
-    eff: np.ndarray
-    num: np.ndarray
-    denom: np.ndarray
-    status: np.ndarray
-
-
-data_dir = Path('/store/user/jwheo/DQMGUI_data/Run2022/')
-
-station = 1
-regions = ['M', 'P']
-layers = [1, 2]
-data = {}
-for path in data_dir.glob('**/*.root'):
-    trigger = path.parts[-3]
-    if trigger == 'DoubleMuon': continue
-    run_number = int(path.stem.split('_')[2][1:])
-    if run_number < 355681 and trigger == "Muon": continue
-    if run_number in data.keys(): print('err')
-    print(trigger, run_number)
-    data[f'{run_number}'] = {}
-    root_file = uproot.open(path)
-    try:
-        # sta_eff_dir = root_file[f'DQMData/Run {run_number}/GEM/Run summary/Efficiency/muonSTA']
-        glb_eff_dir = root_file[f'DQMData/Run {run_number}/GEM/Run summary/Efficiency/muonSTA']
-
-    except Exception as errs:
-        try:
-            # sta_eff_dir = root_file[f'DQMData/Run {run_number}/GEM/Run summary/Efficiency/type1']
-            glb_eff_dir = root_file[f'DQMData/Run {run_number}/GEM/Run summary/Efficiency/type2']
-            # report_summary_map = root_file[f'DQMData/Run {run_number}/GEM/Run summary/EventInfo/{var}']
-
-        except Exception as err:
-            print(err)
-    try:
-        report_summary_map = root_file[f'DQMData/Run {run_number}/GEM/Run summary/EventInfo/reportSummaryMap']
-        event_info_dir = root_file[f'DQMData/Run {run_number}/GEM/Run summary/EventInfo']
-    except Exception as errs:
-        pass
-
-    for region in regions:
-        for layer in layers:
-            gem_label = f'GE{station}1-{region}-L{layer}'
-            try:
-                data[f'{run_number}'][gem_label] = {
-                    # 'STA': {
-                    #     'denominator': sta_eff_dir[f'chamber_ieta_{gem_label}'].values().sum(axis=1).tolist(),
-                    #     'numerator': sta_eff_dir[f'chamber_ieta_match_{gem_label}'].values().sum(axis=1).tolist(),
-                    #     'efficiency': sta_eff_dir[f'eff_chamber_{gem_label}'].values().tolist(),
-                    #  },
-                    'GLB': {
-                        'denominator': glb_eff_dir[f'chamber_ieta_{gem_label}'].values().sum(axis=1).tolist(),
-                        'numerator': glb_eff_dir[f'chamber_ieta_match_{gem_label}'].values().sum(axis=1).tolist(),
-                        'efficiency': glb_eff_dir[f'eff_chamber_{gem_label}'].values().tolist(),
-                     }
-                }
-
-            except Exception as err:
-                data[f'{run_number}'][gem_label] = {
-                        # 'STA': {
-                        #     'denominator': sta_eff_dir[f'Efficiency/detector_{gem_label}'].values().sum(axis=1).tolist(),
-                        #     'numerator': sta_eff_dir[f'Efficiency/detector_{gem_label}_matched'].values().sum(axis=1).tolist(),
-                        #     'efficiency': sta_eff_dir[f'Efficiency/eff_detector_{gem_label}'].values().sum(axis=1).tolist(),
-                        # },
-                        'GLB': {
-                            'denominator': glb_eff_dir[f'Efficiency/detector_{gem_label}'].values().sum(axis=1).tolist(),
-                            'numerator': glb_eff_dir[f'Efficiency/detector_{gem_label}_matched'].values().sum(axis=1).tolist(),
-                            'efficiency': glb_eff_dir[f'Efficiency/eff_detector_{gem_label}'].values().sum(axis=1).tolist(),
-                        }
-                }
+    trigger: str
+    path: Path
+    glb: np.ndarray # RECORD_DTYPE
+
+
+def parse_path(path: Path) -> tuple[str, int]:
+    """
+    :path: e.g. '.../Muon/<era>/DQM_V0001_R000357442__Muon__Run2022C-PromptReco-v1__DQMIO.root'
+    :returns: the primary dataset and the run number
+    """
+    return path.parts[-3], int(path.stem.split('_')[2][1:])
+
+
+def is_selected(trigger: str, run: int) -> bool:
+    if trigger == 'DoubleMuon':
+        return False
+    return not (trigger == 'Muon' and run < FIRST_MUON_RUN)
+
+
+def to_chamber_array(values: np.ndarray) -> np.ndarray:
+    """
+    :raises ValueError: if ``values`` has not one entry per chamber
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape != (NUM_CHAMBERS, ):
+        raise ValueError(f'expected {NUM_CHAMBERS} chambers, got the shape {values.shape}')
+    return values
 
+
+def harvest(path: Path) -> RunRecord:
+    trigger, run = parse_path(path)
+    summary = f'DQMData/Run {run}/GEM/Run summary'
+    with uproot.open(path) as root_file:
+        # 'muonSTA' is the GLB efficiency in recent releases, 'type2' in older ones
+        if f'{summary}/Efficiency/muonSTA' in root_file:
+            glb_eff_dir = root_file[f'{summary}/Efficiency/muonSTA']
+        else:
+            glb_eff_dir = root_file[f'{summary}/Efficiency/type2']
+        event_info_dir = root_file.get(f'{summary}/EventInfo')
+
+        glb = np.zeros(len(REGIONS) * len(LAYERS), dtype=RECORD_DTYPE)
+        for row, (region, layer) in enumerate((region, layer) for region in REGIONS for layer in LAYERS):
+            gem_label = f'GE{STATION}1-{region}-L{layer}'
+            glb['label'][row] = gem_label
+            if f'chamber_ieta_{gem_label}' in glb_eff_dir:
+                glb['denominator'][row] = to_chamber_array(glb_eff_dir[f'chamber_ieta_{gem_label}'].values().sum(axis=1))
+                glb['numerator'][row] = to_chamber_array(glb_eff_dir[f'chamber_ieta_match_{gem_label}'].values().sum(axis=1))
+                glb['efficiency'][row] = to_chamber_array(glb_eff_dir[f'eff_chamber_{gem_label}'].values())
+            else:
+                glb['denominator'][row] = to_chamber_array(glb_eff_dir[f'Efficiency/detector_{gem_label}'].values().sum(axis=1))
+                glb['numerator'][row] = to_chamber_array(glb_eff_dir[f'Efficiency/detector_{gem_label}_matched'].values().sum(axis=1))
+                glb['efficiency'][row] = to_chamber_array(glb_eff_dir[f'Efficiency/eff_detector_{gem_label}'].values().sum(axis=1))
+
+            inactive_name = f'inactive_frac_chamber_{gem_label}'
+            if event_info_dir is not None and inactive_name in event_info_dir:
+                glb['inactive'][row] = to_chamber_array(event_info_dir[inactive_name].values())
+            else:
+                glb['inactive'][row] = -1
+    return RunRecord(run, trigger, path, glb)
+
+
+def to_json(record: RunRecord) -> dict:
+    return {
+        gem_label: {
+            'GLB': {
+                'denominator': row['denominator'].tolist(),
+                'numerator': row['numerator'].tolist(),
+                'efficiency': row['efficiency'].tolist(),
+                'inactive': row['inactive'].tolist(),
+            }
+        } for gem_label, row in zip(record.glb['label'].tolist(), record.glb)
+    }
+
+
+def harvest_all(data_dir: Path, jobs: Optional[int] = None) -> list[RunRecord]:
+    """
+    :jobs: number of worker processes, the number of CPUs if None
+    :returns: the records sorted by run
+    """
+    path_list = [path for path in sorted(data_dir.glob('**/*.root')) if is_selected(*parse_path(path))]
+
+    records = []
+    failures = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        future_to_path = {executor.submit(harvest, path): path for path in path_list}
+        for future in (pbar := tqdm.tqdm(as_completed(future_to_path), total=len(future_to_path))):
+            path = future_to_path[future]
+            pbar.set_description(f'Run {parse_path(path)[1]}')
             try:
-                data[f'{run_number}'][gem_label]['STA']['inactive'] = event_info_dir[f'inactive_frac_chamber_{gem_label}'].values().tolist()
-                data[f'{run_number}'][gem_label]['GLB']['inactive'] = event_info_dir[f'inactive_frac_chamber_{gem_label}'].values().tolist()
+                records.append(future.result())
+            except Exception as error:
+                failures.append((path, error))
+
+    if len(failures) > 0:
+        print(f'{len(failures)} failures:')
+        for path, error in failures:
+            print(f'- {path}: {error!r}')
+    return sorted(records, key=lambda each: each.run)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--data-dir', type=Path, default=DEFAULT_DATA_DIR, help='directory of the DQMIO files')
+    parser.add_argument('-o', '--output-path', type=Path, default=Path('out.json'), help='output JSON file')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of files read concurrently')
+    args = parser.parse_args()
+
+    data = {}
+    for record in harvest_all(args.data_dir, args.jobs):
+        if f'{record.run}' in data:
+            print(f'run {record.run} found twice, keeping {record.path}')
+        data[f'{record.run}'] = to_json(record)
+
+    with open(args.output_path, 'w') as outfile:
+        json.dump(data, outfile, indent=2)
 
-            except Exception as err:
-                data[f'{run_number}'][gem_label]['STA']['inactive'] = [-1 for _ in range(36)]
-                data[f'{run_number}'][gem_label]['GLB']['inactive'] = [-1 for _ in range(36)]
 
-file_path = 'out.json'
-with open(file_path, 'w') as outfile:
-    json.dump(data, outfile, indent=2)
+if __name__ == '__main__':
+    main()
@@ -8,19 +8,25 @@ oms_connection = sqlite3.connect(oms_db)
 oms_connection.row_factory = sqlite3.Row
 oms = oms_connection.cursor()
 
+# components_in is a bitmask, with the bit of each subsystem in the components table
 query = """
+WITH required AS (
+    SELECT
+        SUM(1 << bit) AS mask
+    FROM
+        components
+    WHERE
+        name IN ('GEM', 'CSC', 'DQM', 'DAQ')
+)
 SELECT
     run_number
 FROM
-    runs
+    runs, required
 WHERE
     end_time IS NOT NULL
     AND tier0_transfer = 1
-    AND GEM = 1
-    AND CSC = 1
-    AND DQM = 1
-    AND DAQ = 1
     AND duration > ?
+    AND components_in & required.mask = required.mask
 """
 
 min_duration = int(sys.argv[-1])
@@ -2,6 +2,9 @@ from pathlib import Path
 import json
 import sqlite3
 import numpy as np
+from hvjoin import integrate_step
+from hvjoin import load_hv_samples
+from hvjoin import load_runs
 
 
 def print_schema(connection):
@@ -18,63 +21,35 @@ def print_row(row):
 
 
 oms_connection = sqlite3.connect('/store/scratch/dqm/OMS/runs_352322_358185.sql')
-oms_connection.row_factory = sqlite3.Row
-oms = oms_connection.cursor()
 
 hv_db = '/store/scratch/dqm/P5GEMOfflineMonitor/P5_GEM_HV_monitor_UTC_start_2022-04-25_16-07-57_end_2022-08-25_15-22-38.sql'
 hv_connection = sqlite3.connect(hv_db)
-hv_connection.row_factory = sqlite3.Row
-hv_cursor = hv_connection.cursor()
 
+data_dir = Path('/store/user/jwheo/DQMGUI_data/Run2022/')
+run_numbers = sorted({int(path.stem.split('_')[2][1:]) for path in data_dir.glob('**/*.root')})
 
-run_query = """
-SELECT
-    run_number,
-    start_time,
-    end_time
-FROM
-    runs
-WHERE
-    run_number = ?
-"""
+runs = load_runs(oms_connection, run_numbers)
+samples = load_hv_samples(hv_connection, station=1)
+# each HV value holds until the next change, also across the run start
+stats = integrate_step(runs, samples)
 
-hv_query = """
-SELECT
-    chamber, hv
-FROM
-    hv
-WHERE
-    time >= ?
-    AND time <= ?
-    AND region = ?
-    AND station = ?
-"""
-# AND chamber = ?
+missing = sorted(set(run_numbers) - set(runs.run.tolist()))
+if len(missing) > 0:
+    print(f'{len(missing)} runs without start or end time in OMS:', missing)
 
-data_dir = Path('/store/user/jwheo/DQMGUI_data/Run2022/')
 data = {}
-for path in data_dir.glob('**/*.root'):
-    run_number = int(path.stem.split('_')[2][1:])
-    print(run_number)
-    if run_number not in data.keys():
-        run_row = oms.execute(run_query, (run_number, )).fetchone()
-        data[run_number] = {}
-        for region in [-1, 1]:
-            hv_query_parameters = (
-                    run_row['start_time'],
-                    run_row['end_time'],
-                    region,  # region
-                    1,  # station
-                    # chamber,  # chamber
-                )
-            hv_row_list = hv_cursor.execute(hv_query, hv_query_parameters).fetchall()
-            chamber_list = np.array([row['chamber'] for row in hv_row_list])
-            hv_list = np.array([row['hv'] for row in hv_row_list])
-            hvs = [np.mean(hv_list[chamber_list == i]) if sum(chamber_list == i) != 0 else -1 for i in range(1, 37)]
-            print(hvs)
-            data[run_number][f'{region}'] = hvs
+for run_idx, run_number in enumerate(runs.run.tolist()):
+    data[run_number] = {}
+    for region in [-1, 1]:
+        hvs = []
+        for chamber in range(1, 37):
+            # mean of the two layers
+            means = [stats.mean[run_idx, samples.group_index(region, layer, chamber)]
+                     for layer in [1, 2] if (region, layer, chamber) in samples.groups]
+            means = [each for each in means if not np.isnan(each)]
+            hvs.append(float(np.mean(means)) if len(means) > 0 else -1)
+        data[run_number][f'{region}'] = hvs
 
 file_path = 'hv_by_run.json'
 with open(file_path, 'w') as outfile:
     json.dump(data, outfile, indent=2)
-
@@ -0,0 +1,179 @@
+"""Join of the OMS run intervals with the HV samples of ``convert-hv-root-to-sql.py``.
+
+The runs and the samples are loaded once. As DCS stores a value only when it
+changes, ``integrate_step`` treats each group, a chamber layer, as a step
+function holding every value until the next sample, so that a run without
+any change still gets the value set before its start. The statistics of
+every (run, group) pair are reduced at once with binary searches, cumulative
+integrals and ``reduceat``. Both databases store UTC times as seconds since
+the epoch: the start and end of the runs from OMS and the CHANGE_DATE of the
+samples from DCS.
+
+    >>> runs = load_runs(oms_connection, [357442, 357479])
+    >>> samples = load_hv_samples(hv_connection, station=1)
+    >>> stats = integrate_step(runs, samples, nominal=600)
+    >>> stats.mean[runs.index(357442), samples.group_index(region=1, layer=1, chamber=3)]
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+import sqlite3
+from typing import Optional, Sequence, Union
+import numpy as np
+
+# offset of the groups in the sort key (group, time), above any time in seconds
+_GROUP_STRIDE = 1 << 34
+
+
+@dataclass
+class RunIntervals:
+    """
+    :start: seconds since the epoch, sorted
+    :end: seconds since the epoch, inclusive
+    """
+    run: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+
+    def index(self, run: int) -> int:
+        return int(np.flatnonzero(self.run == run)[0])
+
+
+@dataclass
+class HVSamples:
+    """
+    :groups: (region, layer, chamber) of each group, sorted
+    :group: index in ``groups`` of each sample
+    """
+    groups: list[tuple[int, int, int]]
+    group: np.ndarray
+    time: np.ndarray
+    value: np.ndarray
+
+    def group_index(self, region: int, layer: int, chamber: int) -> int:
+        return self.groups.index((region, layer, chamber))
+
+
+@dataclass
+class StepStats:
+    """
+    arrays of shape (number of runs, number of groups)
+
+    :duration: seconds of the run covered by the step function, shorter than
+        the run if it starts before the first sample of the group
+    :mean: mean weighted by the time each value holds
+    :min, max: of the values holding during the run
+    :time_at_nominal: seconds with a value of at least ``nominal``
+    :count: samples recorded during the run
+
+    The statistics are NaN when the run is not covered at all.
+    """
+    duration: np.ndarray
+    mean: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+    time_at_nominal: np.ndarray
+    count: np.ndarray
+
+
+def load_runs(connection: sqlite3.Connection, runs: Optional[Sequence[int]] = None) -> RunIntervals:
+    """
+    :connection: database of ``oms/convert-oms-json-to-sql.py``
+    :runs: runs to load, all the complete runs if None. Runs without an
+        end_time are skipped.
+    """
+    rows = connection.execute('SELECT run_number, start_time, end_time FROM runs '
+                              'WHERE start_time IS NOT NULL AND end_time IS NOT NULL ORDER BY start_time').fetchall()
+    table = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    if runs is not None:
+        table = table[np.isin(table[:, 0], np.asarray(runs, dtype=np.int64))]
+    return RunIntervals(table[:, 0], table[:, 1], table[:, 2])
+
+
+def load_hv_samples(connection: sqlite3.Connection, station: int = 1) -> HVSamples:
+    """
+    :connection: database of ``hv/convert-hv-root-to-sql.py``
+    :returns: the samples of ``station`` grouped by (region, layer, chamber)
+    """
+    rows = connection.execute('SELECT region, layer, chamber, time, hv FROM hv WHERE station = ?',
+                              (station, )).fetchall()
+    table = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    keys = table[:, :3].astype(np.int64)
+    groups, group = np.unique(keys, axis=0, return_inverse=True)
+    return HVSamples(groups=[tuple(each) for each in groups.tolist()],
+                     group=group.reshape(-1),
+                     time=table[:, 3].astype(np.int64),
+                     value=table[:, 4])
+
+
+def integrate_step(runs: RunIntervals,
+                   samples: HVSamples,
+                   nominal: Union[float, np.ndarray] = np.inf,
+) -> StepStats:
+    """
+    duration-weighted statistics of the step function of each group over each
+    run, carrying forward the last value before the run start
+
+    :nominal: threshold of the time at nominal, for all groups or per group
+    """
+    num_runs, num_groups = len(runs.run), len(samples.groups)
+
+    # samples sorted by (group, time)
+    key = samples.group.astype(np.int64) * _GROUP_STRIDE + samples.time
+    order = np.argsort(key, kind='stable')
+    key, time, value, group = key[order], samples.time[order], samples.value[order], samples.group[order]
+    at_nominal = (value >= np.broadcast_to(nominal, (num_groups, ))[group]).astype(np.float64)
+
+    # integrals from the first sample of the group to each sample. A value
+    # holds until the next sample of the same group.
+    hold = np.diff(time).astype(np.float64)
+    hold[group[1:] != group[:-1]] = 0
+    integral = np.concatenate([[0.0], np.cumsum(value[:-1] * hold)])
+    nominal_integral = np.concatenate([[0.0], np.cumsum(at_nominal[:-1] * hold)])
+
+    # every (run, group) pair, group-major so that the pairs follow the order
+    # of the samples and the reduceat below stays linear
+    pair_group = np.repeat(np.arange(num_groups, dtype=np.int64), num_runs)
+    start = np.tile(runs.start, num_groups)
+    end = np.tile(runs.end, num_groups)
+    group_first = np.searchsorted(key, pair_group * _GROUP_STRIDE, side='left')
+    start_key = pair_group * _GROUP_STRIDE + start
+    end_key = pair_group * _GROUP_STRIDE + end
+
+    # sample holding at the run start, else the first sample of the run
+    first = np.searchsorted(key, start_key, side='right') - 1
+    carried = first >= group_first
+    first = np.where(carried, first, np.searchsorted(key, start_key, side='left'))
+    # sample holding at the run end
+    last = np.searchsorted(key, end_key, side='right') - 1
+    covered = (last >= group_first) & (last >= first)
+    count = np.searchsorted(key, end_key, side='right') - np.searchsorted(key, start_key, side='left')
+
+    duration = np.full(num_runs * num_groups, np.nan)
+    mean = np.full(num_runs * num_groups, np.nan)
+    min_arr = np.full(num_runs * num_groups, np.nan)
+    max_arr = np.full(num_runs * num_groups, np.nan)
+    time_at_nominal = np.full(num_runs * num_groups, np.nan)
+    if np.any(covered):
+        first, last = first[covered], last[covered]
+        start, end = start[covered], end[covered]
+        low = np.where(carried[covered], start, time[first])
+
+        def step_integral(cumulative: np.ndarray, values: np.ndarray) -> np.ndarray:
+            return cumulative[last] - cumulative[first] - values[first] * (low - time[first]) + values[last] * (end - time[last])
+
+        duration[covered] = end - low
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean[covered] = np.where(end > low, step_integral(integral, value) / (end - low), value[last])
+        time_at_nominal[covered] = step_integral(nominal_integral, at_nominal)
+
+        # reduce over [first, last] of each pair, with a sentinel for a pair ending at the last sample
+        padded = np.append(value, np.nan)
+        bounds = np.column_stack([first, last + 1]).reshape(-1)
+        min_arr[covered] = np.minimum.reduceat(padded, bounds)[::2]
+        max_arr[covered] = np.maximum.reduceat(padded, bounds)[::2]
+
+    def to_run_group(arr: np.ndarray) -> np.ndarray:
+        return arr.reshape(num_groups, num_runs).T
+
+    return StepStats(to_run_group(duration), to_run_group(mean), to_run_group(min_arr), to_run_group(max_arr),
+                     to_run_group(time_at_nominal), to_run_group(count))
@@ -0,0 +1,24 @@
+"""Fixtures shared by the tests of the scripts."""
+from __future__ import annotations
+import importlib.util
+from pathlib import Path
+import sys
+from types import ModuleType
+from typing import Callable
+import pytest
+
+
+@pytest.fixture
+def load_script(monkeypatch) -> Callable[[Path], ModuleType]:
+    """
+    :returns: a function importing a script with a hyphenated name, e.g.
+        ``dqm/download-dqmio.py``, with its directory on ``sys.path`` for its
+        helper modules
+    """
+    def load(path: Path) -> ModuleType:
+        monkeypatch.syspath_prepend(str(path.parent))
+        spec = importlib.util.spec_from_file_location(path.stem.replace('-', '_'), path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
@@ -4,7 +4,7 @@
 TODO
 - [ ] certificiate with password
 - [ ] lint
-- [ ] multiprocessing
+- [x] multiprocessing
 - [ ] is it vulnerable to send client secret through env var?
 """
 from __future__ import annotations
@@ -13,51 +13,37 @@ from pathlib import Path
 from typing import Protocol, Optional
 import re
 import urllib.parse
+import urllib.error
+import urllib.request
+import shutil
 import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 from bs4 import BeautifulSoup
 import tqdm
 from gemdqm.auth import open_url
-from gemdqm.oms import load_oms_api
+from eras import get_era_resolver
+from eras import query_era
 
 
 CMSWEB_NETLOC = 'https://cmsweb.cern.ch/'
 PASSWORD_PROMPT_TIMEOUT = 10 # sec
 GEM_DQM_CERN_CERTIFICATE = "GEM_DQM_CERN_CERTIFICATE"
+MANIFEST_NAME = 'manifest.json'
+DEFAULT_MAX_CONNECTIONS = 4
+DEFAULT_LISTING_TTL = 3600 # sec
+DOWNLOAD_CHUNK_SIZE = 1 << 20 # bytes kept in memory while downloading
+ROOT_FILE_MAGIC = b'root'
 
+# bounds the number of simultaneous connections to cmsweb, shared by the
+# link finders and the downloads of all the threads
+_CONNECTION_SLOTS = threading.BoundedSemaphore(DEFAULT_MAX_CONNECTIONS)
 
-_ERA_TO_RUN_RANGE_LIST: list[tuple[str, int, int]] = []
-
-def _query_era(run: int) -> str:
-    omsapi = load_oms_api()
-    query = omsapi.query('eras')
-    filters = [
-        {
-            'attribute_name': 'start_run',
-            "value": run,
-            "operator": "LE"
-        },
-        {
-            "attribute_name": "end_run",
-            "value": run,
-            "operator": "GE"
-        }
-    ]
-    query.filters(filters)
-    data = query.data().json()
-    era: str = data['data'][0]['id']
-    start_run: int = data['data'][0]['attributes']['start_run']
-    end_run: int = data['data'][0]['attributes']['end_run']
-
-    _ERA_TO_RUN_RANGE_LIST.append((era, start_run, end_run))
-    return era
-
-
-def query_era(run: int) -> str:
-    for cached_era, start_run, end_run in _ERA_TO_RUN_RANGE_LIST:
-        if run >= start_run and run <= end_run:
-            return cached_era
-    else:
-        return _query_era(run)
 
 ###############################################################################
 # DQM
@@ -67,16 +53,100 @@ class LinkFinderCallable(Protocol):
     def __call__(self, run: int, dataset: str) -> str:
         ...
 
-def _find_file_url(url: str, pattern: re.Pattern) -> str:
-    response = open_url(url)
-    soup = BeautifulSoup(response, features="html.parser")
-    for a_tag in soup.find_all('a'):
-        href = a_tag.attrs['href']
-        last = href.split('/')[-1]
-        if re.match(pattern, last):
+def set_max_connections(max_connections: int) -> None:
+    global _CONNECTION_SLOTS
+    _CONNECTION_SLOTS = threading.BoundedSemaphore(max_connections)
+
+
+class ListingCache:
+    """filename -> href of the directory listings of cmsweb
+
+    Each directory is fetched and parsed once, so the runs sharing a directory
+    cost a single request. With ``path``, the listings are also stored in a
+    JSON file and reused by the next processes for ``ttl`` seconds.
+    """
+
+    def __init__(self, path: Optional[Path] = None, ttl: float = DEFAULT_LISTING_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.url_locks: dict[str, threading.Lock] = defaultdict(threading.Lock)
+        # url -> (fetch time, filename -> href)
+        self.listings: dict[str, tuple[float, dict[str, str]]] = {}
+        # urls fetched by this process, as opposed to loaded from ``path``
+        self.fetched_urls: set[str] = set()
+        if path is not None and path.is_file():
+            with open(path) as json_file:
+                now = time.time()
+                for url, (fetch_time, listing) in json.load(json_file).items():
+                    if now - fetch_time < ttl:
+                        self.listings[url] = (fetch_time, listing)
+
+    @staticmethod
+    def fetch(url: str) -> dict[str, str]:
+        with _CONNECTION_SLOTS:
+            response = open_url(url)
+            soup = BeautifulSoup(response, features="html.parser")
+        listing: dict[str, str] = {}
+        for a_tag in soup.find_all('a'):
+            href = a_tag.attrs['href']
+            listing.setdefault(href.split('/')[-1], href)
+        return listing
+
+    def get(self, url: str, refresh: bool = False) -> dict[str, str]:
+        """
+        :refresh: fetch the listing again even if it is cached
+        """
+        with self.lock:
+            url_lock = self.url_locks[url]
+        # the threads asking for the same directory wait for a single request
+        with url_lock:
+            with self.lock:
+                entry = self.listings.get(url)
+            if refresh or entry is None:
+                entry = (time.time(), self.fetch(url))
+                with self.lock:
+                    self.listings[url] = entry
+                    self.fetched_urls.add(url)
+                self.save()
+            return entry[1]
+
+    def save(self) -> None:
+        """
+        ``listings`` is only modified under ``lock``, which is held while it is dumped
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            tmp_path = self.path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as json_file:
+                json.dump(self.listings, json_file)
+            os.replace(tmp_path, self.path)
+
+
+_LISTING_CACHE = ListingCache()
+
+
+def set_listing_cache(listing_cache: ListingCache) -> None:
+    global _LISTING_CACHE
+    _LISTING_CACHE = listing_cache
+
+
+def _match_listing(listing: dict[str, str], pattern: re.Pattern) -> Optional[str]:
+    for filename, href in listing.items():
+        if re.match(pattern, filename):
             return urllib.parse.urljoin(CMSWEB_NETLOC, href)
-    else:
+    return None
+
+
+def _find_file_url(url: str, pattern: re.Pattern) -> str:
+    file_url = _match_listing(_LISTING_CACHE.get(url), pattern)
+    # a listing loaded from the disk may predate the file
+    if file_url is None and url not in _LISTING_CACHE.fetched_urls:
+        file_url = _match_listing(_LISTING_CACHE.get(url, refresh=True), pattern)
+    if file_url is None:
         raise RuntimeError(f"failed to find a filename matched with '{pattern}' from '{url}'") # TODO raise proper error
+    return file_url
 
 
 def find_offline_dqm_file_link(dataset: str, run: int) -> str:
@@ -109,11 +179,86 @@ def find_online_dqm_file_link(run: int, dataset: str) -> str:
     return _find_file_url(url=url, pattern=pattern)
 
 
+def check_root_file(path: Path) -> None:
+    """
+    :raises RuntimeError: if ``path`` does not start with the ROOT magic number
+        or, when uproot is available, cannot be opened by uproot. Opening reads
+        the header, the streamer info and the list of keys at the end of the file.
+    """
+    with open(path, 'rb') as root_file:
+        magic = root_file.read(len(ROOT_FILE_MAGIC))
+    if magic != ROOT_FILE_MAGIC:
+        raise RuntimeError(f"'{path}' is not a ROOT file")
+    try:
+        import uproot
+    except ImportError:
+        return
+    try:
+        with uproot.open(path) as root_file:
+            root_file.keys()
+    except Exception as error:
+        raise RuntimeError(f"'{path}' is corrupted: {error}") from error
+
+
+def _content_length(response) -> Optional[int]:
+    size = response.headers.get('Content-Length')
+    return int(size) if size is not None else None
+
+
+def open_range(url: str, offset: int):
+    """
+    requests ``url`` from the byte ``offset`` with a ``Range`` header
+
+    ``gemdqm.auth.open_url`` is only known to take URL strings. The header is
+    passed in a ``urllib.request.Request``, which an opener built on urllib
+    accepts; if ``open_url`` rejects it, the whole file is requested instead.
+    The range is trusted only if the server answers 206 with a
+    ``Content-Range`` starting at ``offset``, so a header dropped on the way
+    restarts the download instead of appending the file to itself.
+
+    :returns: the response, the offset of its first byte and the size of the
+        file, None if unknown. The response is None if ``offset`` is not
+        before the end of the file, whose size is then returned as the offset.
+    """
+    if offset == 0:
+        response = open_url(url)
+        return response, 0, _content_length(response)
+    request = urllib.request.Request(url, headers={'Range': f'bytes={offset}-'})
+    try:
+        response = open_url(request)
+    except urllib.error.HTTPError as error:
+        match = re.fullmatch(r'bytes \*/(\d+)', error.headers.get('Content-Range', ''))
+        if error.code != 416 or match is None:
+            raise
+        return None, int(match.group(1)), int(match.group(1))
+    except (TypeError, AttributeError, ValueError):
+        response = open_url(url)
+        return response, 0, _content_length(response)
+
+    match = re.fullmatch(r'bytes (\d+)-\d+/(\d+)', response.headers.get('Content-Range', ''))
+    if response.status == 206 and match is not None and int(match.group(1)) == offset:
+        return response, offset, int(match.group(2))
+    elif response.status == 206:
+        response.close()
+        response = open_url(url)
+    # the server ignored the range
+    return response, 0, _content_length(response)
+
+
 def download_root_file(url: str,
                        filename: Optional[str] = None,
                        output_dir: Optional[Path] = None,
 ) -> Path:
-    """docstring TODO"""
+    """
+    The file is streamed in chunks of ``DOWNLOAD_CHUNK_SIZE`` bytes to
+    ``<filename>.part``, which is renamed to ``filename`` once its size and
+    content have been checked. A ``.part`` file left by an interrupted download
+    is resumed with an HTTP range request. A file already downloaded is
+    compared with the remote one by a range request from its end, answered
+    without any content when the sizes match, so each file costs one request.
+
+    :returns: path of the downloaded file
+    """
     filename = filename or url.split('/')[-1] # FIXME urllib.parse
     output_dir = output_dir or Path.cwd()
     if not output_dir.exists():
@@ -121,13 +266,84 @@ def download_root_file(url: str,
         print(f"created directory '{output_dir}'")
     output_path = output_dir / filename
     assert output_path.suffix == '.root', output_path
-    response = open_url(url)
-    data = response.read()
-    with open(output_path, 'wb') as root_file:
-        root_file.write(data)
+    part_path = output_path.with_name(output_path.name + '.part')
+
+    existing = output_path if output_path.is_file() else part_path if part_path.is_file() else None
+    offset = existing.stat().st_size if existing is not None else 0
+    with _CONNECTION_SLOTS:
+        response, start, size = open_range(url, offset)
+        # skip the files already downloaded
+        if existing == output_path and size == offset:
+            if response is not None:
+                response.close()
+            return output_path
+        # a different remote file or a .part file longer than it is downloaded again
+        if start > 0 and (existing == output_path or start != offset):
+            if response is not None:
+                response.close()
+            response, start, size = open_range(url, 0)
+
+        if response is not None:
+            # a connection dropped midway leaves the bytes received in the .part file
+            try:
+                with open(part_path, 'ab' if start > 0 else 'wb') as part_file:
+                    shutil.copyfileobj(response, part_file, DOWNLOAD_CHUNK_SIZE)
+            finally:
+                response.close()
+
+    # the .part file is kept to be resumed if it is truncated, removed if it is corrupted
+    part_size = part_path.stat().st_size
+    if size is not None and part_size != size:
+        raise RuntimeError(f"truncated download of '{url}': {part_size} bytes out of {size}")
+    try:
+        check_root_file(part_path)
+    except RuntimeError:
+        part_path.unlink()
+        raise
+    os.replace(part_path, output_path)
     return output_path
 
 
+class DownloadManifest:
+    """(run, dataset) pairs already downloaded into a directory
+
+    The manifest is rewritten after every download, so that an interrupted
+    download resumes from where it stopped.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed: dict[tuple[int, str], dict] = {}
+        if path.is_file():
+            with open(path) as json_file:
+                for entry in json.load(json_file)['completed']:
+                    self.completed[(entry['run'], entry['dataset'])] = entry
+
+    def is_completed(self, run: int, dataset: str) -> bool:
+        """
+        :returns: True if the file of ``run`` and ``dataset`` is still there with the recorded size
+        """
+        entry = self.completed.get((run, dataset))
+        if entry is None:
+            return False
+        path = self.path.parent / entry['filename']
+        return path.is_file() and path.stat().st_size == entry['size']
+
+    def add(self, run: int, dataset: str, path: Path) -> None:
+        with self.lock:
+            self.completed[(run, dataset)] = {
+                'run': run,
+                'dataset': dataset,
+                'filename': path.name,
+                'size': path.stat().st_size,
+            }
+            tmp_path = self.path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as json_file:
+                json.dump({'completed': list(self.completed.values())}, json_file, indent=4)
+            os.replace(tmp_path, self.path)
+
+
 def interpret_run_expr(expr: str) -> list[int]:
     run_list: list[int] = []
     if re.match(r'\d+-\d', expr):
@@ -142,24 +358,48 @@ def interpret_run_expr(expr: str) -> list[int]:
 
 def download_dqm_files(run_expr_list: list[str],
                        dataset_list: list[str],
-                       output_dir: Path,
-                       link_finder: LinkFinderCallable
+                       output_dir: Optional[Path],
+                       link_finder: LinkFinderCallable,
+                       jobs: int = 1,
+                       max_connections: int = DEFAULT_MAX_CONNECTIONS,
 ) -> None:
     """docstring for download_offline_dqm_files
+
+    :jobs: number of files downloaded concurrently
+    :max_connections: maximum number of simultaneous connections to cmsweb
     """
+    output_dir = output_dir or Path.cwd()
+    if not output_dir.exists():
+        output_dir.mkdir(parents=True)
+        print(f"created directory '{output_dir}'")
+    set_max_connections(max_connections)
+    manifest = DownloadManifest(output_dir / MANIFEST_NAME)
+
     # remove duplicates runs and sort
     run_list = sorted(set(run for expr in run_expr_list for run in interpret_run_expr(expr)))
     args_list = list(itertools.product(run_list, dataset_list))
+    num_pairs = len(args_list)
+    args_list = [(run, dataset) for run, dataset in args_list if not manifest.is_completed(run, dataset)]
+    if len(args_list) < num_pairs:
+        print(f'skipping {num_pairs - len(args_list)} files already downloaded according to {manifest.path}')
+
+    def download(run: int, dataset: str) -> Path:
+        url = link_finder(run=run, dataset=dataset)
+        output_path = download_root_file(url=url, output_dir=output_dir)
+        manifest.add(run, dataset, output_path)
+        return output_path
 
     failures = []
-    for run, dataset in (pbar := tqdm.tqdm(args_list)):
-        pbar.set_description(f'Run {run}, {dataset}')
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        future_to_args = {executor.submit(download, run, dataset): (run, dataset) for run, dataset in args_list}
+        for future in (pbar := tqdm.tqdm(as_completed(future_to_args), total=len(future_to_args))):
+            run, dataset = future_to_args[future]
+            pbar.set_description(f'Run {run}, {dataset}')
 
-        try:
-            url = link_finder(run=run, dataset=dataset)
-            download_root_file(url=url, output_dir=output_dir)
-        except Exception as error:
-            failures.append((run, dataset, error))
+            try:
+                future.result()
+            except Exception as error:
+                failures.append((run, dataset, error))
 
     if len(failures) > 0:
         print(f'{len(failures)} failures:')
@@ -176,6 +416,8 @@ def main():
     offline_parser.add_argument("-r", "--run", type=str, nargs="+", required=True, help="runs")
     offline_parser.add_argument("-d", "--dataset", type=str, nargs="+", required=True,
                                 help="primary datasets like 'StreamExpress', 'SingleMuon', 'DoubleMuon', and 'Muon'.")
+    offline_parser.add_argument('--refresh-eras', action='store_true',
+                                help='fetch the eras table from OMS instead of using the stored one')
     offline_parser.set_defaults(link_finder=find_offline_dqm_file_link)
 
     # Online DQM
@@ -188,15 +430,27 @@ def main():
     # common
     for each in [offline_parser, online_parser]:
         each.add_argument('-o', '--output-dir', type=Path, help='output directory')
+        each.add_argument('-j', '--jobs', type=int, default=1, help='number of files downloaded concurrently')
+        each.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+                          help='maximum number of simultaneous connections to cmsweb')
+        each.add_argument('--listing-cache', type=Path,
+                          help='JSON file caching the directory listings of cmsweb between runs of this script')
+        each.add_argument('--listing-ttl', type=float, default=DEFAULT_LISTING_TTL,
+                          help='seconds after which a listing stored in --listing-cache is fetched again')
 
     # parse
     args = parser.parse_args()
 
     # Run
+    if getattr(args, 'refresh_eras', False):
+        get_era_resolver(refresh=True)
+    set_listing_cache(ListingCache(path=args.listing_cache, ttl=args.listing_ttl))
     download_dqm_files(run_expr_list=args.run,
                        dataset_list=args.dataset,
                        output_dir=args.output_dir,
-                       link_finder=args.link_finder)
+                       link_finder=args.link_finder,
+                       jobs=args.jobs,
+                       max_connections=args.max_connections)
 
 if __name__ == '__main__':
     main()
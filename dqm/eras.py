@@ -0,0 +1,128 @@
+"""Run number -> era resolution shared by the DQM scripts.
+
+The whole ``eras`` table of OMS is fetched once, stored in a JSON file and
+reused until it is older than ``DEFAULT_MAX_AGE``, so resolving a run is a
+bisection in memory instead of an OMS query.
+
+    >>> from eras import query_era
+    >>> query_era(357442)
+    'Run2022C'
+"""
+from __future__ import annotations
+from bisect import bisect_right
+from dataclasses import dataclass
+from dataclasses import asdict
+from itertools import accumulate
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Optional
+from gemdqm.oms import load_oms_api
+from gemdqm.oms import MAX_PER_PAGE
+
+DEFAULT_ERAS_PATH = Path.home() / '.cache' / 'gem-dqm' / 'eras.json'
+DEFAULT_MAX_AGE = 24 * 3600 # sec
+
+
+@dataclass(frozen=True)
+class Era:
+    """
+    :end_run: ``None`` for an era still ongoing
+    """
+    name: str
+    start_run: int
+    end_run: Optional[int]
+
+
+def fetch_eras() -> list[Era]:
+    omsapi = load_oms_api()
+    eras: list[Era] = []
+    page = 1
+    while True:
+        query = omsapi.query('eras')
+        query.paginate(page=page, per_page=MAX_PER_PAGE)
+        data = query.data().json()['data']
+        for each in data:
+            attributes = each['attributes']
+            eras.append(Era(each['id'], attributes['start_run'], attributes['end_run']))
+        if len(data) < MAX_PER_PAGE:
+            break
+        page += 1
+    return eras
+
+
+class EraResolver:
+
+    def __init__(self, eras: list[Era]) -> None:
+        self.eras = sorted((each for each in eras if each.start_run is not None), key=lambda each: each.start_run)
+        self.start_runs = [each.start_run for each in self.eras]
+        # the largest end run of the eras up to each index, to stop the search
+        # through eras overlapping with later ones
+        end_runs = (float('inf') if each.end_run is None else each.end_run for each in self.eras)
+        self.max_end_runs = list(accumulate(end_runs, max))
+
+    def resolve(self, run: int) -> Optional[str]:
+        """
+        :returns: the era with the latest start run containing ``run``, None if there is none
+        """
+        idx = bisect_right(self.start_runs, run) - 1
+        while idx >= 0 and self.max_end_runs[idx] >= run:
+            era = self.eras[idx]
+            if era.end_run is None or run <= era.end_run:
+                return era.name
+            idx -= 1
+        return None
+
+    @classmethod
+    def load(cls, path: Path) -> EraResolver:
+        with open(path) as json_file:
+            return cls([Era(**each) for each in json.load(json_file)])
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as json_file:
+            json.dump([asdict(each) for each in self.eras], json_file, indent=4)
+        os.replace(tmp_path, path)
+
+
+_RESOLVER: Optional[EraResolver] = None
+_RESOLVER_IS_FRESH = False # fetched from OMS by this process
+_LOCK = threading.Lock()
+
+
+def get_era_resolver(path: Path = DEFAULT_ERAS_PATH,
+                     max_age: float = DEFAULT_MAX_AGE,
+                     refresh: bool = False,
+) -> EraResolver:
+    """
+    :path: file storing the eras table
+    :max_age: seconds after which the stored table is fetched again
+    :refresh: fetch the table from OMS, unless this process already did
+    """
+    global _RESOLVER, _RESOLVER_IS_FRESH
+    with _LOCK:
+        if _RESOLVER is None or (refresh and not _RESOLVER_IS_FRESH):
+            if not refresh and path.is_file() and time.time() - path.stat().st_mtime < max_age:
+                _RESOLVER = EraResolver.load(path)
+                _RESOLVER_IS_FRESH = False
+            else:
+                _RESOLVER = EraResolver(fetch_eras())
+                _RESOLVER.save(path)
+                _RESOLVER_IS_FRESH = True
+        return _RESOLVER
+
+
+def query_era(run: int) -> str:
+    """
+    :raises KeyError: if no era contains ``run``, even after fetching the eras again
+    """
+    era = get_era_resolver().resolve(run)
+    # the stored table may predate the era of the run
+    if era is None:
+        era = get_era_resolver(refresh=True).resolve(run)
+    if era is None:
+        raise KeyError(f'no era contains the run {run}')
+    return era
@@ -0,0 +1,232 @@
+"""Offline checks of the listing cache and the resumed downloads of ``download-dqmio.py``.
+
+A local ``http.server`` stands in for cmsweb: it serves the directory
+listings of the online DQM files and the files themselves, with support for
+range requests. ``gemdqm.auth.open_url`` is replaced by ``urlopen``.
+"""
+from __future__ import annotations
+from collections import Counter
+import http.client
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+import re
+import socket
+import threading
+from typing import Optional
+import urllib.request
+import numpy as np
+import pytest
+
+pytest.importorskip('bs4')
+pytest.importorskip('tqdm')
+pytest.importorskip('gemdqm')
+
+DQM_DIR = Path(__file__).resolve().parents[1]
+LISTING_PATH = '/dqm/offline/data/browse/ROOT/OnlineData/original/00035xxxx/0003553xx'
+RUNS = [355361, 355362]
+
+
+def make_root_file(path: Path) -> bytes:
+    try:
+        import uproot
+    except ImportError:
+        path.write_bytes(b'root' + np.arange(1 << 16, dtype=np.int64).tobytes())
+    else:
+        with uproot.recreate(path) as root_file:
+            root_file['hist'] = np.histogram(np.random.default_rng(1).normal(size=1 << 16), bins=1 << 12)
+    return path.read_bytes()
+
+
+class FakeCMSWeb:
+    """
+    :requests: number of requests per path
+    :ranges: Range headers received
+    :body_bytes: bytes of files sent
+    :ignore_range: answer every request with the whole file
+    :drop_after: close the connection after sending this number of bytes of a file
+    """
+
+    def __init__(self, files: dict[str, bytes]) -> None:
+        self.files = files
+        self.requests: Counter[str] = Counter()
+        self.ranges: list[str] = []
+        self.body_bytes = 0
+        self.ignore_range = False
+        self.drop_after: Optional[int] = None
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def handler_class(self):
+        cmsweb = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def send_body(self,
+                          status: int,
+                          body: bytes,
+                          headers: dict[str, str],
+                          drop_after: Optional[int] = None,
+            ) -> None:
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if drop_after is None:
+                    self.wfile.write(body)
+                    return
+                # the full Content-Length is announced, then the connection is lost
+                self.wfile.write(body[:drop_after])
+                self.wfile.flush()
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+
+            def do_GET(self) -> None:
+                path = self.path.rstrip('/')
+                with cmsweb.lock:
+                    cmsweb.requests[path] += 1
+                if path == LISTING_PATH:
+                    links = ''.join(f'<a href="{LISTING_PATH}/{name}">{name}</a>' for name in cmsweb.files)
+                    self.send_body(200, f'<html><body>{links}</body></html>'.encode(), {'Content-Type': 'text/html'})
+                    return
+                name = path.split('/')[-1]
+                if not path.startswith(LISTING_PATH) or name not in cmsweb.files:
+                    self.send_body(404, b'', {})
+                    return
+
+                content = cmsweb.files[name]
+                match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+                if match is None or cmsweb.ignore_range:
+                    status, start, headers = 200, 0, {}
+                else:
+                    cmsweb.ranges.append(self.headers['Range'])
+                    start = int(match.group(1))
+                    if start >= len(content):
+                        self.send_body(416, b'', {'Content-Range': f'bytes */{len(content)}'})
+                        return
+                    status, headers = 206, {'Content-Range': f'bytes {start}-{len(content) - 1}/{len(content)}'}
+                body = content[start:]
+                with cmsweb.lock:
+                    cmsweb.body_bytes += len(body) if cmsweb.drop_after is None else min(len(body), cmsweb.drop_after)
+                self.send_body(status, body, headers, cmsweb.drop_after)
+
+        return Handler
+
+    def __enter__(self) -> FakeCMSWeb:
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def download_dqmio(load_script, monkeypatch):
+    module = load_script(DQM_DIR / 'download-dqmio.py')
+    monkeypatch.setattr(module, 'open_url', urllib.request.urlopen)
+    return module
+
+
+@pytest.fixture
+def cmsweb(tmp_path, download_dqmio, monkeypatch):
+    source_dir = tmp_path / 'source'
+    source_dir.mkdir()
+    files = {f'DQM_V0001_GEM_R{run:0>9}.root': make_root_file(source_dir / f'{run}.root') for run in RUNS}
+    with FakeCMSWeb(files) as fake:
+        monkeypatch.setattr(download_dqmio, 'CMSWEB_NETLOC', fake.url)
+        yield fake
+
+
+def test_listing_fetched_once_per_directory(tmp_path, download_dqmio, cmsweb):
+    cache_path = tmp_path / 'listings.json'
+    download_dqmio.set_listing_cache(download_dqmio.ListingCache(path=cache_path))
+    urls = [download_dqmio.find_online_dqm_file_link(run=run, dataset='GEM') for run in RUNS]
+    assert urls == [f'{cmsweb.url}{LISTING_PATH[1:]}/DQM_V0001_GEM_R{run:0>9}.root' for run in RUNS]
+    assert cmsweb.requests[LISTING_PATH] == 1
+
+    # the next process reuses the listing stored on disk
+    download_dqmio.set_listing_cache(download_dqmio.ListingCache(path=cache_path))
+    download_dqmio.find_online_dqm_file_link(run=RUNS[0], dataset='GEM')
+    assert cmsweb.requests[LISTING_PATH] == 1
+
+    # a file missing from the stored listing fetches it again, once
+    with pytest.raises(RuntimeError):
+        download_dqmio.find_online_dqm_file_link(run=355399, dataset='GEM')
+    assert cmsweb.requests[LISTING_PATH] == 2
+
+
+def test_listing_expired(tmp_path, download_dqmio, cmsweb):
+    cache_path = tmp_path / 'listings.json'
+    download_dqmio.set_listing_cache(download_dqmio.ListingCache(path=cache_path))
+    download_dqmio.find_online_dqm_file_link(run=RUNS[0], dataset='GEM')
+    download_dqmio.set_listing_cache(download_dqmio.ListingCache(path=cache_path, ttl=0))
+    download_dqmio.find_online_dqm_file_link(run=RUNS[0], dataset='GEM')
+    assert cmsweb.requests[LISTING_PATH] == 2
+
+
+def test_resume_and_skip(tmp_path, download_dqmio, cmsweb):
+    name, content = next(iter(cmsweb.files.items()))
+    url = f'{cmsweb.url}{LISTING_PATH[1:]}/{name}'
+    output_dir = tmp_path / 'output'
+    output_dir.mkdir()
+    half = len(content) // 2
+    (output_dir / f'{name}.part').write_bytes(content[:half])
+
+    output_path = download_dqmio.download_root_file(url, output_dir=output_dir)
+    assert output_path.read_bytes() == content
+    assert not (output_dir / f'{name}.part').exists()
+    assert cmsweb.ranges == [f'bytes={half}-']
+    assert cmsweb.body_bytes == len(content) - half
+
+    # a file already downloaded costs one request without any content
+    assert download_dqmio.download_root_file(url, output_dir=output_dir) == output_path
+    assert cmsweb.requests[f'{LISTING_PATH}/{name}'] == 2
+    assert cmsweb.body_bytes == len(content) - half
+
+
+def test_resume_range_ignored(tmp_path, download_dqmio, cmsweb):
+    name, content = next(iter(cmsweb.files.items()))
+    url = f'{cmsweb.url}{LISTING_PATH[1:]}/{name}'
+    (tmp_path / f'{name}.part').write_bytes(content[:len(content) // 2])
+    cmsweb.ignore_range = True
+
+    output_path = download_dqmio.download_root_file(url, output_dir=tmp_path)
+    assert output_path.read_bytes() == content
+    assert cmsweb.requests[f'{LISTING_PATH}/{name}'] == 1
+
+
+def test_part_longer_than_remote_restarts(tmp_path, download_dqmio, cmsweb):
+    name, content = next(iter(cmsweb.files.items()))
+    url = f'{cmsweb.url}{LISTING_PATH[1:]}/{name}'
+    (tmp_path / f'{name}.part').write_bytes(content + b'garbage')
+
+    output_path = download_dqmio.download_root_file(url, output_dir=tmp_path)
+    assert output_path.read_bytes() == content
+    assert cmsweb.ranges == [f'bytes={len(content) + len(b"garbage")}-']
+
+
+def test_dropped_connection_resumed(tmp_path, download_dqmio, cmsweb):
+    name, content = next(iter(cmsweb.files.items()))
+    url = f'{cmsweb.url}{LISTING_PATH[1:]}/{name}'
+    part_path = tmp_path / f'{name}.part'
+    cmsweb.drop_after = len(content) // 3
+
+    with pytest.raises((http.client.IncompleteRead, RuntimeError)):
+        download_dqmio.download_root_file(url, output_dir=tmp_path)
+    assert part_path.read_bytes() == content[:cmsweb.drop_after]
+    assert not (tmp_path / name).exists()
+
+    received = cmsweb.drop_after
+    cmsweb.drop_after = None
+    output_path = download_dqmio.download_root_file(url, output_dir=tmp_path)
+    assert output_path.read_bytes() == content
+    assert not part_path.exists()
+    assert cmsweb.ranges == [f'bytes={received}-']
+    assert cmsweb.body_bytes == len(content)
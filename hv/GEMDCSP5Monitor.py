@@ -7,11 +7,29 @@ import time
 from datetime import datetime
 from datetime import timedelta
 from operator import itemgetter
-from array import array
+import numpy as np
 import argparse
 from argparse import RawTextHelpFormatter
 from sys import exit
 import getpass
+from concurrent.futures import ThreadPoolExecutor
+from dcs_fetch import DEFAULT_ARRAYSIZE
+from dcs_fetch import DPIDWindow
+from dcs_fetch import fetch_windows
+from dcs_fetch import stream_windows
+from dcs_cache import DCSCache
+from dcs_ingest import rows_to_records
+from dcs_ingest import local_epoch_seconds
+from dcs_ingest import to_date_strings
+from dcs_mapping import load_or_build_index
+from dcs_output import OUTPUT_FORMATS
+from dcs_output import SUFFIXES
+from dcs_output import open_writer
+from dcs_output import parse_chamber_name
+from dcs_output import write_records
+from caen_status import STATUS_BOARDS
+from caen_status import binary_strings
+from caen_status import meaning_strings
 
 
 """
@@ -107,8 +125,26 @@ parser.add_argument("--chamberList", "-c", type=str,
        metavar="chamberList")
 parser.add_argument("--verbose", "--v", help="Enables print outputs.")
 parser.add_argument("--save", "--s", help="Save .png plots.")
+parser.add_argument("--workers", "-j", type=int, default=1,
+       help="number of chambers extracted concurrently, each over its own session of a cx_Oracle.SessionPool.\nThe ROOT file is still written by the main thread only, in the order of the chamber list. (default: 1)",
+       metavar="workers")
+parser.add_argument("--cache", type=str,
+       help="path to a local SQLite cache of the DCS rows. The rows already cached are not requested again from the database,\nso repeating a window that grows with time only fetches the new rows.",
+       metavar="cache")
+parser.add_argument("--output-format", type=str, choices=OUTPUT_FORMATS,
+       help="also write the imon, vmon, smon, ison and temp series of every channel in a long-format table\n(region, station, layer, chamber, channel, observable, time, value) next to the ROOT file.\nparquet and arrow require pyarrow.",
+       metavar="outputFormat")
+parser.add_argument("--stream", action="store_true",
+       help="streaming mode for long windows: the rows are sorted by the database and written to the --output-format file\none chunk at a time, keeping only one chunk in memory. The ROOT file is not produced,\nso --output-format is required.")
+parser.add_argument("--chunk-size", type=int, default=DEFAULT_ARRAYSIZE,
+       help="number of rows per chunk in --stream mode (default: %(default)s)",
+       metavar="chunkSize")
 
 args = parser.parse_args()
+if args.stream and args.output_format is None:
+    parser.error("--stream writes only the --output-format file, no ROOT file: --output-format is needed")
+if args.stream and args.cache is not None:
+    parser.error("--stream reads the rows directly from the database: it cannot be used with --cache")
 
 ROOT.gROOT.SetBatch(True)
 
@@ -127,6 +163,49 @@ dbName = os.getenv("GEM_P5_DB_NAME_OFFLINE_MONITOR") or getpass.getpass(prompt='
 dbAccount = os.getenv("GEM_P5_DB_ACCOUNT_OFFLINE_MONITOR") or getpass.getpass(prompt='GEM P5 DB Account')
 
 
+def dateWindowToCall(OneChannelInfo, mapIdx, startDate, endDate):
+   #OneChannelInfo[mapIdx] is made by [DP, ALIASSHORT, SINCE, BOOL for the since to use, DPID]
+   #look which is the first date to call and which is the last date to call, not to call two times a selection on date
+   #if a date is taken from a SINCE, the milliseconds are removed since the query is done in format YYYY-MM-DD HH24:MI:SS
+   sinceThisMap = OneChannelInfo[mapIdx][2]
+   firstDateToCall = startDate
+   if sinceThisMap > startDate:
+      if OneChannelInfo[mapIdx][3]: #check that the SINCE is marked with True to use it
+         firstDateToCall = sinceThisMap.replace(microsecond=0)
+
+   lastDateToCall = endDate
+   if mapIdx != (len( OneChannelInfo )-1): #the since has also to be used to stop retrieving data for an ID, but only if the SINCE is not the last one
+      sinceNextMap = OneChannelInfo[mapIdx+1][2]
+      if sinceNextMap < endDate:
+         if OneChannelInfo[mapIdx+1][3]: #check that the SINCE is marked with True to use it
+            lastDateToCall = sinceNextMap.replace(microsecond=0)
+
+   return firstDateToCall, lastDateToCall
+
+
+def fillHistogram(histogram, values):
+   #same as calling histogram.Fill(value) for each value, with a single call
+   if len(values) > 0:
+      histogram.FillN(len(values), values, np.ones(len(values)))
+
+
+def openSessionPool(connectString, workers):
+   #connectString is in the format user/password@dsn
+   account, dsn = connectString.split("@", 1)
+   user, password = account.split("/", 1)
+   #one session for each worker plus one for the main thread
+   return cx_Oracle.SessionPool(user=user, password=password, dsn=dsn, min=1, max=workers+1, increment=1, threaded=True)
+
+
+def fetchWindowsWithPool(pool, fetchWindows, tableData, columnsData, windowList):
+   #executed by the worker threads: each one uses its own session of the pool
+   connection = pool.acquire()
+   try:
+      return fetchWindows(connection.cursor(), tableData, columnsData, windowList)
+   finally:
+      pool.release(connection)
+
+
 def main():
    #Reminder: in the DB the DeltaV between pins are saved, not the V from ground
    #-------------KIND OF MONITOR FLAG----------------------------------------
@@ -217,7 +296,20 @@ def main():
    dirStringSave = dir_path+"/OutputFiles/P5_GEM_"+monitorFlag+"_monitor_UTC_start_"+start+"_end_"+end+"/"
 
    fileName = dir_path+"/OutputFiles/P5_GEM_"+monitorFlag+"_monitor_UTC_start_"+start+"_end_"+end+".root"
-   f1=ROOT.TFile(fileName,"RECREATE")
+
+   #-------------OUTPUT COLUMNAR FILE--------------------------------------------
+   seriesWriter = None
+   if args.output_format is not None:
+      if sliceTestFlag == 1:
+         exit( "ERROR: --output-format needs chamber names as GE+1/1/01, not available for the slice test" )
+      seriesFileName = fileName[:-len(".root")] + SUFFIXES[args.output_format]
+      seriesWriter = open_writer( args.output_format, seriesFileName )
+      if args.stream:
+         print( "--stream: no ROOT file is written, the series are written to "+seriesFileName )
+
+   #in streaming mode only the columnar file is written
+   if not args.stream:
+      f1=ROOT.TFile(fileName,"RECREATE")
 
    #-------------DATES OF MAPPING CHANGE-----------------------------------------
    mappingChangeDate = []
@@ -411,119 +503,50 @@ def main():
    #verboseprint ( "allMappingList", allMappingList )
 
    #------------DATABASE CONNECT------------------------------------------------
-   db = cx_Oracle.connect( dbAccount+dbName )
+   if args.workers > 1:
+      pool = openSessionPool( dbAccount+dbName, args.workers )
+      db = pool.acquire()
+   else:
+      db = cx_Oracle.connect( dbAccount+dbName )
    cur = db.cursor()
 
    #-------------CHOOSE THE NEEDED MAPPING LINES FOR EACH REQUESTED CHAMBER----
+   #part of alias in map that can be used to identify the channel, for each map
+   channelNamesPerMap = []
+   for allMapIdx in range(len(allMappingList)):
+      if monitorFlag == "HV":
+         if sliceTestFlag == 0:
+            channelNameAsInMap = ["G3Bot", "G3Top", "G2Bot", "G2Top", "G1Bot", "G1Top", "Drift"]
+         if sliceTestFlag == 1:
+            channelNameAsInMap = ["G3bot", "G3top", "G2bot", "G2top", "G1bot", "G1top", "Drift"]
+      if monitorFlag == "LV":
+         if sliceTestFlag == 0:
+            channelNameAsInMap = ["L1", "L2"]
+         if sliceTestFlag == 1:
+            if allMapIdx == 0:
+               channelNameAsInMap = ["TOP_VFAT", "TOP_OH2V", "TOP_OH4V", "BOT_VFAT", "BOT_OH2V", "BOT_OH4V"]
+            if allMapIdx == 1:
+               channelNameAsInMap = ["L1_VFAT", "L1_OH2V", "L1_OH4V", "L2_VFAT", "L2_OH2V", "L2_OH4V"]
+      channelNamesPerMap.append( channelNameAsInMap )
+
+   #the DPs of each chamber, their SINCE (table CMS_GEM_PVSS_COND.ALIASES) and their ID (table CMS_GEM_PVSS_COND.DP_NAME2ID)
+   #do not depend on the monitored period: they are resolved once for all the existing chambers and stored
+   #in mappingIndexFileName, which is rebuilt only when the mapping or the existing chambers change
+   mappingIndexFileName = dir_path+"/OutputFiles/P5_GEM_"+monitorFlag+"_sliceTest"+str(sliceTestFlag)+"_mapping_index.json"
+   mappingIndex = load_or_build_index( mappingIndexFileName, cur, allMappingList, ExistingChambers, channelNamesPerMap, dbName )
+
    AllChosenChamberAllDPsWanted = []
-   #charge a DP only if the mapBoolean corresponding is True
    for chIdx in range(len(chamberList)): #loop on chosen chambers (name of chamber as that in the ChosenChambers file)
-      OneChamberAllDPs = []
-      for allMapIdx in range(len(allMappingList)): #loop on all maps
-         OneMapAllDPs = []
-         for oneMapIdx in range(len(allMappingList[allMapIdx])): #loop on One Map
-            #take one line of the mapping
-            oneMapLine = allMappingList[allMapIdx][oneMapIdx]
-            #now I have to look for a specific channel
-            if monitorFlag == "HV":
-               if sliceTestFlag == 0:
-                  channelNameAsInMap = ["G3Bot", "G3Top", "G2Bot", "G2Top", "G1Bot", "G1Top", "Drift"] #part of alias in map that can be used to identify the channel
-               if sliceTestFlag == 1:
-                  channelNameAsInMap = ["G3bot", "G3top", "G2bot", "G2top", "G1bot", "G1top", "Drift"]
-            if monitorFlag == "LV":
-               if sliceTestFlag == 0:
-                  channelNameAsInMap = ["L1", "L2"]
-               if sliceTestFlag == 1:
-                  if allMapIdx == 0:
-                     channelNameAsInMap = ["TOP_VFAT", "TOP_OH2V", "TOP_OH4V", "BOT_VFAT", "BOT_OH2V", "BOT_OH4V"]
-                  if allMapIdx == 1:
-                     channelNameAsInMap = ["L1_VFAT", "L1_OH2V", "L1_OH4V", "L2_VFAT", "L2_OH2V", "L2_OH4V"]
-
-            #now that there are channelName I look for a specific channel
-            for channelNameIdx in range(len(channelNameAsInMap)):
-               if (oneMapLine.find(channelNameAsInMap[channelNameIdx]) != -1):
-                  #the order of chambers in Existing chambers can be different from that in chamberList
-                  chamberMatch = False
-                  for existChamberIdx in range(len(ExistingChambers)):
-                     listAlterNamesOneChamber = ExistingChambers[existChamberIdx]
-                     for alterNamesIdx in range(len(listAlterNamesOneChamber)):
-                        if chamberList[chIdx] == listAlterNamesOneChamber[alterNamesIdx]:
-                           chamberMatch = True
-                           indexInExistingChambers = existChamberIdx
-                  #now I know that the chamber I am looking to is the right one
-                  #I look for a match between names of the chamber I am looking to and the line of the mapping
-                  for alterNameThisChamberIdx in range(len(ExistingChambers[indexInExistingChambers])):
-                     alterName = ExistingChambers[indexInExistingChambers][alterNameThisChamberIdx]
-                     if (oneMapLine.find( alterName ) != -1 ):
-                        #save this DP (for this map) for this channel
-                        column2Idx = oneMapLine.index(":",15)
-                        OneChannelOneDP = oneMapLine[:column2Idx]
-                        OneChannelMapAlias = oneMapLine[column2Idx+1:]
-                        OneChannelOneShortAlias = alterName
-                        verboseprint( "PairDPAlias", OneChannelOneDP, OneChannelOneShortAlias )
-
-                        #I have to look in the DB which is the SINCE associated to this ALIAS and DPE_NAME in table CMS_GEM_PVSS_COND.ALIASES
-                        #REMEMBER: there is a dot at the end of DPE_NAME in ALIASES table
-                        query = "select SINCE, DPE_NAME, ALIAS from CMS_GEM_PVSS_COND.ALIASES where DPE_NAME='"+str(OneChannelOneDP)+".' and ALIAS='"+str(OneChannelMapAlias)+"'"
-                        cur.execute(query)
-                        curALIAS = cur
-                        boolNoSinceSeen = True
-                        for result in curALIAS:
-                           boolNoSinceSeen = False
-                           OneChannelOneSince = result[0]
-                        #in case there is nothing in curAlias
-                        if boolNoSinceSeen:
-                           OneChannelOneSince = datetime( 1970, 0o1, 0o1, 00, 00, 0o1 ) #date used for since if there is nothing
-                           #if I have more than one map I add one second to the dummyDate
-                           #if ( allMapIdx > 0 ):
-                           #   secondsToAdd = allMapIdx + 1
-                           #   OneChannelOneSince = datetime( 1970, 01, 01, 00, 00, secondsToAdd ) #date used for since if there is nothing
-
-                        DPAliasSinceOneChannel = []
-                        DPAliasSinceOneChannel.append(OneChannelOneDP)
-                        DPAliasSinceOneChannel.append(OneChannelOneShortAlias)
-                        DPAliasSinceOneChannel.append(OneChannelOneSince)
-
-                        OneMapAllDPs.append(DPAliasSinceOneChannel)
-                        #verboseprint("OneMapAllDPs", OneMapAllDPs)
-         OneChamberAllDPs.append(OneMapAllDPs)
-         #verboseprint("OneChamberAllDPs", OneChamberAllDPs)
-      #now OneChamberAllDPs is ready. I have to reorder the elements since I need a product given by a channel loop and then a map loop
-      #instead I have a map loop and then a channel loop
-      #I'd need this
-      #[chamber]
-      #[[channel1][channel2]]
-      #[[[map1],[map2]][[map1],[map2]]]
-      #[[[DP, SHORTALIAS, SINCE],[DP, SHORTALIAS, SINCE]][[DP, SHORTALIAS, SINCE],[DP, SHORTALIAS, SINCE]]]
-      #[[[1],[2]][[3],[4]]]
-
-      #INSTEAD I HAVE
-      #[[[1],[3]][[2],[4]]]
-
-      #verboseprint("OneChamberAllDPs", OneChamberAllDPs)
-
-      #REORDER
-      #verboseprint ("OneChamberAllDPs[0]", OneChamberAllDPs[0])
-      #verboseprint ("OneChamberAllDPs[0]", type(OneChamberAllDPs[0]))
-      #verboseprint ("OneChamberAllDPs[0]", len(OneChamberAllDPs[0]))
-      howManyChannelsInAMap = len(OneChamberAllDPs[0]) #number of channels seen in a map for this chamber
+      #[[[DP, SHORTALIAS, SINCE, DPID],[DP, SHORTALIAS, SINCE, DPID]][[DP, SHORTALIAS, SINCE, DPID],[DP, SHORTALIAS, SINCE, DPID]]]
+      #[[    MAP 1                    ,     MAP2                    ][    MAP1                     ,      MAP2                   ]]
+      #the maps of each channel are already sorted by SINCE
+      OneChamberIndex = mappingIndex[chamberList[chIdx]]
       OneChamberAllDPsWanted = []
-      for channelIdx in range(howManyChannelsInAMap):
-         fixedChannelList = []
-         for mapIdx in range(len(OneChamberAllDPs)):
-            takenTriplet = OneChamberAllDPs[mapIdx][channelIdx]
-            fixedChannelList.append(takenTriplet)
-         OneChamberAllDPsWanted.append(fixedChannelList)
+      for channelIdx in range(len(OneChamberIndex)):
+         OneChamberAllDPsWanted.append( [ element[:3] for element in OneChamberIndex[channelIdx] ] )
 
       #verboseprint("OneChamberAllDPsWanted", OneChamberAllDPsWanted)
 
-      #sort in case SINCE are stored not in the cronological order
-      for channelIdx in range(len(OneChamberAllDPsWanted)):
-         OneChannelAllMapsList = OneChamberAllDPsWanted[channelIdx]
-         OneChannelAllMapsListSorted = sorted(OneChannelAllMapsList, key=lambda element: element[2]) #element[2] is SINCE
-         OneChamberAllDPsWanted[channelIdx] = OneChannelAllMapsListSorted
-      #verboseprint("OneChamberAllDPsWanted", OneChamberAllDPsWanted)
-
    #------------SEE WHICH SINCE ARE TO USE-----------------------------------------------------------------------------
    #table CMS_GEM_PVSS_COND.ALIASES contains SINCE, DPE_NAME, ALIAS
    #table CMS_GEM_PVSS_COND.DP_NAME2ID contains DPNAME and ID
@@ -587,27 +610,19 @@ def main():
       verboseprint("OneChamberAllDPsWanted with true or false", OneChamberAllDPsWanted)
 
       #--------------------------FIND IDs------------------------------------------------------------------------
-      #DPE_NAME has a dot at the end of channellXXX, DPNAME has not a dot
+      #the IDs come from the mapping index
 
       verboseprint("-------------------------------------------------------------------------------------------------------------------------")
       verboseprint("                    "+chamberList[chIdx]+" :CALLED DPs AND THEIR IDs")
       for channelIdx in range(len(OneChamberAllDPsWanted)):
-         oneChannelIDs=[]
          for mapIdx in range(len(OneChamberAllDPsWanted[channelIdx])):
             thisMapDP = OneChamberAllDPsWanted[channelIdx][mapIdx][0]
             thisMapAlias = OneChamberAllDPsWanted[channelIdx][mapIdx][1]
-            query = "select ID, DPNAME from CMS_GEM_PVSS_COND.DP_NAME2ID where DPNAME='"+thisMapDP+"'"
-            cur.execute(query)
-            curID = cur
-            for result in curID:
-               dpID   = result[0]
-               dpNAME = result[1]
-
-            verboseprint( "chamber:", chamberList[chIdx], "channel", channelNameAsInMap[channelIdx], "ID", dpID, "DPNAME", dpNAME, "ALIAS", thisMapAlias )
+            dpID = OneChamberIndex[channelIdx][mapIdx][3]
+
+            verboseprint( "chamber:", chamberList[chIdx], "channel", channelNamesPerMap[-1][channelIdx], "ID", dpID, "DPNAME", thisMapDP, "ALIAS", thisMapAlias )
             #add to the four elements of OneChamberAllDPsWanted[channelIdx][mapIdx] also the ID
-            fourElements = OneChamberAllDPsWanted[channelIdx][mapIdx]
-            fourElements.append( dpID )
-            OneChamberAllDPsWanted[channelIdx][mapIdx] = fourElements
+            OneChamberAllDPsWanted[channelIdx][mapIdx].append( dpID )
             #now OneChamberAllDPsWanted[channelIdx][mapIdx] is made by a list
             #[DP, ALIASSHORT, SINCE, BOOL for the since to use, DPID]
 
@@ -664,11 +679,85 @@ def main():
 
    if monitorFlag == "HV":
       tableData = "CMS_GEM_PVSS_COND.FWCAENCHANNELA1515"
+      columnsData = ["CHANGE_DATE", "ACTUAL_IMON", "ACTUAL_VMON", "ACTUAL_STATUS", "ACTUAL_ISON", "ACTUAL_TEMP", "ACTUAL_IMONREAL"]
    if monitorFlag == "LV":
       tableData = "CMS_GEM_PVSS_COND.FWCAENCHANNEL"
+      columnsData = ["CHANGE_DATE", "ACTUAL_IMON", "ACTUAL_VMON", "ACTUAL_STATUS", "ACTUAL_ISON", "ACTUAL_TEMP"]
+
+   #put a counter to identify which channel I am looking to
+   #IF I CALL A CHAMBER I AM OBLIGED TO LOOK ALL THE SEVEN CHANNELS
+   if monitorFlag == "HV":
+      if sliceTestFlag == 0:
+         channelName = ["G3Bot", "G3Top", "G2Bot", "G2Top", "G1Bot", "G1Top", "Drift"]
+      if sliceTestFlag == 1:
+         channelName = ["G3Bot", "G3Top", "G2Bot", "G2Top", "G1Bot", "G1Top", "Drift"]
+   if monitorFlag == "LV":
+      if sliceTestFlag == 0:
+         channelName = ["L1", "L2"]
+      if sliceTestFlag == 1:
+         channelName = ["L1_VFAT", "L1_OH2V", "L1_OH4V", "L2_VFAT", "L2_OH2V", "L2_OH4V"]
+
+   #--------------BULK FETCH OF ALL THE WINDOWS-----------------------------------
+   #collect the (DPID, first date, last date) window of every chamber, channel and map
+   #and retrieve them with a few DPID IN (...) queries instead of one query per window
+   windowList = []
+   chamberWindowList = []
+   for chIdx in range(len(chamberList)):
+      chamberWindowList.append([])
+      for channelIdx in range(len(AllChosenChamberAllDPsWanted[chIdx])):
+         OneChannelInfo = AllChosenChamberAllDPsWanted[chIdx][channelIdx]
+         for mapIdx in range(len( OneChannelInfo )):
+            firstDateToCall, lastDateToCall = dateWindowToCall(OneChannelInfo, mapIdx, startDate, endDate)
+            oneWindow = DPIDWindow( (chIdx, channelIdx, mapIdx), OneChannelInfo[mapIdx][4], firstDateToCall, lastDateToCall )
+            windowList.append( oneWindow )
+            chamberWindowList[chIdx].append( oneWindow )
+            verboseprint( "window", chamberList[chIdx], OneChannelInfo[mapIdx], firstDateToCall, lastDateToCall )
+
+   #with a cache only the rows not already stored locally are requested to the database
+   if args.cache is not None:
+      fetchWindows = DCSCache(args.cache).fetch_windows
+   else:
+      fetchWindows = fetch_windows
+
+   #--------------STREAMING EXTRACTION----------------------------------------------
+   #the rows are sorted by the database and consumed one chunk at a time, each chunk going
+   #straight to the columnar file: the memory used does not depend on the length of the window
+   if args.stream:
+      chamberIdList = [ parse_chamber_name( chamberName ) for chamberName in chamberList ]
+      streamedRows = 0
+      for (chIdx, channelIdx, mapIdx), rows in stream_windows(cur, tableData, columnsData, windowList, args.chunk_size):
+         write_records( seriesWriter, chamberIdList[chIdx], channelName[channelIdx], rows_to_records(rows, columnsData) )
+         streamedRows = streamedRows + len(rows)
+      seriesWriter.close()
+      verboseprint( str(streamedRows)+" rows streamed from "+str(len(windowList))+" windows" )
+
+      if args.workers > 1:
+         pool.release(db)
+         pool.close()
+
+      print('\n-------------------------Output--------------------------------')
+      print((seriesFileName+ " has been created."))
+      print("ALL MONITOR TIMES ARE IN UTC, DCS TIMES ARE IN CET")
+      return 0
+
+   #with more than one worker the chambers are extracted concurrently and the main thread,
+   #the only one touching the ROOT file, waits for each chamber in the order of chamberList
+   if args.workers > 1:
+      executor = ThreadPoolExecutor(max_workers=args.workers)
+      chamberFutures = []
+      for chIdx in range(len(chamberList)):
+         chamberFutures.append( executor.submit(fetchWindowsWithPool, pool, fetchWindows, tableData, columnsData, chamberWindowList[chIdx]) )
+   else:
+      allWindowRows = fetchWindows(cur, tableData, columnsData, windowList)
+      verboseprint( str(len(windowList))+" windows retrieved" )
 
    stringWhatRetriveList     = ["imon", "vmon", "smon", "ison", "temp"]
    for chIdx in range(len(chamberList)):
+      if args.workers > 1:
+         allWindowRows = chamberFutures[chIdx].result()
+         chamberFutures[chIdx] = None #release the rows of the previous chambers
+         verboseprint( str(len(chamberWindowList[chIdx]))+" windows retrieved for "+chamberList[chIdx] )
+
       #create the first level of directories: one for each chamber
       chamberNameRootFile = chamberList[chIdx].replace("-", "_M")
       chamberNameRootFile = chamberNameRootFile.replace("+", "_P")
@@ -676,19 +765,6 @@ def main():
       firstDir = f1.mkdir(chamberNameRootFile)
       firstDir.cd()
 
-      #put a counter to identify which channel I am looking to
-      #IF I CALL A CHAMBER I AM OBLIGED TO LOOK ALL THE SEVEN CHANNELS
-      if monitorFlag == "HV":
-         if sliceTestFlag == 0:
-            channelName = ["G3Bot", "G3Top", "G2Bot", "G2Top", "G1Bot", "G1Top", "Drift"]
-         if sliceTestFlag == 1:
-            channelName = ["G3Bot", "G3Top", "G2Bot", "G2Top", "G1Bot", "G1Top", "Drift"]
-      if monitorFlag == "LV":
-         if sliceTestFlag == 0:
-            channelName = ["L1", "L2"]
-         if sliceTestFlag == 1:
-            channelName = ["L1_VFAT", "L1_OH2V", "L1_OH4V", "L2_VFAT", "L2_OH2V", "L2_OH4V"]
-
       #declare one multigraph with all channel
       Imontmultig1 = ROOT.TMultiGraph()
       titleMultig1 = chamberList[chIdx] + "; ;Imon (#mu A)"
@@ -748,203 +824,78 @@ def main():
 
       for channelIdx in range(len(AllChosenChamberAllDPsWanted[chIdx])):
          OneChannelInfo = AllChosenChamberAllDPsWanted[chIdx][channelIdx]
-         imonData = [] #store two Dates and Imon in pair (0th Date in millisecond from the first element stored, 1st Date as wanted by root, 2nd Imon)
-         vmonData = [] #store two Dates and Vmon in pair
-         smonData = [] #store two Dates and Status in pair
-         isonData = [] #store two Dates and Ison in pair
-         tempData = [] #store two Dates and Temp in pair
+         #all the rows of this channel as a NumPy structured array with the fields
+         #time, imon, imon_valid, vmon, vmon_valid, smon, smon_valid, ... (see dcs_ingest.py)
+         channelRecordsList = []
+         channelRecords = rows_to_records([], columnsData)
 
          #look how many SINCE I have in this channel
          howManySince = len(OneChannelInfo)
 
-         contData = 0
          #for each chnnel of a chamber there are more than one ID
          for mapIdx in range(len( OneChannelInfo )):
-            sinceThisMap = OneChannelInfo[mapIdx][2]
             aliasThisMap = OneChannelInfo[mapIdx][1]
-            #look which is the first date to call and which is the last date to call, not to call two times a selection on date
-            firstDateToCall = startDate
-            if sinceThisMap > startDate:
-               if OneChannelInfo[mapIdx][3]: #check that the SINCE is marked with True to use it
-                  firstDateToCall = str(sinceThisMap)
-                  #if I have taken a date from the SINCE, this is not in format YYYY-MM-DD HH24:MI:SS
-                  #remove from the date string the part of milliseconds
-                  #find the last column :
-                  firstDateToCall_lastColumnIdx = firstDateToCall.rfind(":")
-                  firstDateToCall = firstDateToCall[:firstDateToCall_lastColumnIdx+3]
-
-            lastDateToCall = endDate
-            if mapIdx != (len( OneChannelInfo )-1): #the since has also to be used to stop retrieving data for an ID, but only if the SINCE is not the last one
-               sinceNextMap = OneChannelInfo[mapIdx+1][2]
-               if sinceNextMap < endDate:
-                  if OneChannelInfo[mapIdx+1][3]: #check that the SINCE is marked with True to use it
-                     lastDateToCall = str(sinceNextMap)
-                     #if I have taken a date from the SINCE, this is not in format YYYY-MM-DD HH24:MI:SS
-                     #remove from the date string the part of milliseconds
-                     #find the last column :
-                     lastDateToCall_lastColumnIdx = lastDateToCall.rfind(":")
-                     lastDateToCall = lastDateToCall[:lastDateToCall_lastColumnIdx+3]
-
-            if monitorFlag == "HV":
-               queryAll = "select CHANGE_DATE, ACTUAL_IMON, ACTUAL_VMON, ACTUAL_STATUS, ACTUAL_ISON, ACTUAL_TEMP, ACTUAL_IMONREAL from " + tableData + " where DPID = " + str(OneChannelInfo[mapIdx][4]) + " and CHANGE_DATE > to_date( '" + str(firstDateToCall) + "', 'YYYY-MM-DD HH24:MI:SS') and CHANGE_DATE < to_date( '" + str(lastDateToCall) + "', 'YYYY-MM-DD HH24:MI:SS')"
-            if monitorFlag == "LV":
-               queryAll = "select CHANGE_DATE, ACTUAL_IMON, ACTUAL_VMON, ACTUAL_STATUS, ACTUAL_ISON, ACTUAL_TEMP from " + tableData + " where DPID = " + str(OneChannelInfo[mapIdx][4]) + " and CHANGE_DATE > to_date( '" + str(firstDateToCall) + "', 'YYYY-MM-DD HH24:MI:SS') and CHANGE_DATE < to_date( '" + str(lastDateToCall) + "', 'YYYY-MM-DD HH24:MI:SS')"
+            firstDateToCall, lastDateToCall = dateWindowToCall(OneChannelInfo, mapIdx, startDate, endDate)
 
             verboseprint ( "OneChannelInfo", OneChannelInfo )
-            verboseprint( "query", queryAll )
-
-#            if monitorFlag == "HV":
-#               queryAll = "select CHANGE_DATE, ACTUAL_IMON, ACTUAL_VMON, ACTUAL_STATUS, ACTUAL_ISON, ACTUAL_TEMP, ACTUAL_IMONREAL from " + tableData + " where DPID = " + str(OneChannelInfo[mapIdx][4]) + " and CHANGE_DATE > to_date( " + sta_period + ", 'YYYY-MM-DD HH24:MI:SS') and CHANGE_DATE < to_date( " + end_period + ", 'YYYY-MM-DD HH24:MI:SS')"
-#            if monitorFlag == "LV":
-#               queryAll = "select CHANGE_DATE, ACTUAL_IMON, ACTUAL_VMON, ACTUAL_STATUS, ACTUAL_ISON, ACTUAL_TEMP from " + tableData + " where DPID = " + str(OneChannelInfo[mapIdx][4]) + " and CHANGE_DATE > to_date( " + sta_period + ", 'YYYY-MM-DD HH24:MI:SS') and CHANGE_DATE < to_date( " + end_period + ", 'YYYY-MM-DD HH24:MI:SS')"
-
-            #queryAll = "select CHANGE_DATE, ACTUAL_IMON, ACTUAL_VMON, ACTUAL_STATUS, ACTUAL_ISON, ACTUAL_TEMP from CMS_GEM_PVSS_COND.FWCAENCHANNELA1515 where  DPID = 55 and CHANGE_DATE > to_date( '2018-04-01 00:00:00', 'YYYY-MM-DD HH24:MI:SS') and CHANGE_DATE < to_date ( '2018-05-01 00:00:00', 'YYYY-MM-DD HH24:MI:SS')"
-
-            cur.execute(queryAll)
-            curAllData = cur
-            for result in curAllData:
-               #verboseprint (result)
-               dateElem = result[0]
-               imonElem = result[1]
-               vmonElem = result[2]
-               smonElem = result[3]
-               isonElem = result[4] #it can be only 0 or 1
-               tempElem = result[5] #in celcius degrees
-               if monitorFlag == "HV":
-                  imonRealElem = result[6]
-
-               #for the final Tree I need dates in a  string format
-               dateElemString = str(dateElem)
-
-               #take the first Date
-               if contData == 0:
-                  startTs = result[0]
-
-               tot_secondsDate = (dateElem - startTs).total_seconds()
-               #verboseprint("tot_secondsDate:", tot_secondsDate) #('tot_secondsDate:', 16512.532)
-
-               #convert dateElem in a usable format
-               dateElemStr = str(dateElem)  #2017-04-01 00:00:32.439000
-               #verboseprint("dateElemStr", dateElemStr)
-               if (dateElemStr.find(".") != -1): #if dot found
-                  dotIdx = dateElemStr.index(".")
-                  dateNoMicro = dateElemStr[:dotIdx]
-                  micro = dateElemStr[dotIdx+1:]
-               else:                             #if dot not found
-                  dateNoMicro = dateElemStr
-                  micro = "000000"
-
-               da1 = ROOT.TDatime( dateNoMicro )
-               convertedDate = da1.Convert()
-
-               floatMicro = "0." + micro
-               dateElemSQL = convertedDate + float(floatMicro)
-
-               #ATTENTION: I use ACTUAL_IMONREAL only if I have no info from ACTUAL_IMON
-               #ATTENTION2: for smonData I have 4 elements: the last is the date in string
-               if imonElem is not None:       #imon
-                  tripleList = [ tot_secondsDate, dateElemSQL, imonElem ]
-                  imonData.append( tripleList )
-               """else:
-                  if monitorFlag == "HV":
-                     if imonRealElem is not None:
-                        tripleList = [ tot_secondsDate, dateElemSQL, imonRealElem ]
-                        imonData.append( tripleList )"""
-               if vmonElem is not None:       #vmon
-                  tripleList = [ tot_secondsDate, dateElemSQL, vmonElem, mapIdx, dateElemStr ]
-                  vmonData.append( tripleList )
-               if smonElem is not None:       #smon
-                  tripleList = [ tot_secondsDate, dateElemSQL, smonElem, dateElemString ]
-                  if smonElem < 0:
-                     continue
-                  smonData.append( tripleList )
-               if isonElem is not None:       #ison
-                  tripleList = [ tot_secondsDate, dateElemSQL, isonElem ]
-                  isonData.append( tripleList )
-               if tempElem is not None:       #temp
-                  tripleList = [ tot_secondsDate, dateElemSQL, tempElem ]
-                  tempData.append( tripleList )
-
-               contData = contData + 1
-
-            #verboseprint("imonData", imonData)
-            #verboseprint("vmonData", vmonData)
-            #verboseprint("smonData", smonData)
-            #verboseprint("isonData", isonData)
-            #verboseprint("tempData", tempData)
-
-            verboseprint( chamberList[chIdx]+" "+channelName[channelIdx] + " (Alias: " +aliasThisMap+"): Not sorted lists created: WAIT PLEASE!!")
+
+            channelRecordsList.append( rows_to_records(allWindowRows[(chIdx, channelIdx, mapIdx)], columnsData) )
+
+            verboseprint( chamberList[chIdx]+" "+channelName[channelIdx] + " (Alias: " +aliasThisMap+"): Not sorted arrays created: WAIT PLEASE!!")
 
             #----------------SORT DATA-------------------------------------------------------
             #after collecting all data (we are inside the loop over chambers)
             #reorder data by date, the may not be in the correct time order
-            #sort data in each of the seven channels
-
-            imonData = sorted(imonData, key=lambda element: element[0]) #reorder using the internal list of imonData( element[0] is tot_secondsDate )
-            vmonData = sorted(vmonData, key=lambda element: element[0])
-            smonData = sorted(smonData, key=lambda element: element[0])
-            isonData = sorted(isonData, key=lambda element: element[0])
-            tempData = sorted(tempData, key=lambda element: element[0])
-
-            #verboseprint("imonData", imonData)
-            #verboseprint("vmonData", vmonData)
-            #verboseprint("smonData", smonData)
-            #verboseprint("isonData", isonData)
-            #verboseprint("tempData", tempData)
+            #a stable sort of the rows is the same as sorting each observable separately
+            channelRecords = np.concatenate(channelRecordsList)
+            channelRecords = channelRecords[np.argsort(channelRecords["time"], kind="stable")]
 
-            verboseprint("   Lists sorted: WAIT PLEASE!!")
+            verboseprint("   Arrays sorted: WAIT PLEASE!!")
 
             #look for Vmon values greater than 1000V
             fileVolts = open("Over1000Volts.txt","a")
-            chchBool = False
-
-            for vIdx in range(len(vmonData)):
-               if ( vmonData[vIdx][2] >= 1000 ):
-                  stringChamberChannel = chamberList[chIdx]+"\t"+channelName[channelIdx]+"\t"+aliasThisMap+"\n"
-                  stringValues = "Date:"+str(vmonData[vIdx][4])+"\t"+" Vmon:"+str(vmonData[vIdx][2])+"\n"
-                  if ( not chchBool ): #write the stringChamberChannel only one time
-                     fileVolts.write( stringChamberChannel )
-                     chchBool = True
-                  fileVolts.write( stringValues )
+            over1000Records = channelRecords[channelRecords["vmon_valid"] & (channelRecords["vmon"] >= 1000)]
+            if len(over1000Records) > 0: #write the stringChamberChannel only one time
+               fileVolts.write( chamberList[chIdx]+"\t"+channelName[channelIdx]+"\t"+aliasThisMap+"\n" )
+            for dateString, vmonValue in zip(to_date_strings(over1000Records["time"]).tolist(), over1000Records["vmon"].tolist()):
+               fileVolts.write( "Date:"+dateString+"\t"+" Vmon:"+str(vmonValue)+"\n" )
             fileVolts.close()
 
-         #----------------DUMP THE FIRST ELEMENT----------------------------------------------
-
-         #verboseprint("len imonSortList", len(imonSortList))
-         for idxElem in range(len(imonData)):
-            secondAndThird = []
-            secondAndThird.append(imonData[idxElem][1])
-            secondAndThird.append(imonData[idxElem][2])
-            imonData[idxElem] = secondAndThird
-
-         for idxElem in range(len(vmonData)):
-            secondAndThird = []
-            secondAndThird.append(vmonData[idxElem][1])
-            secondAndThird.append(vmonData[idxElem][2])
-            vmonData[idxElem] = secondAndThird
-
-         #smon has: 1 = date for TGraphs, 2 = decaimal status, 3 = date in string format
-         for idxElem in range(len(smonData)):
-            secondAndThird = []
-            secondAndThird.append(smonData[idxElem][1])
-            secondAndThird.append(int(smonData[idxElem][2]))
-            secondAndThird.append(smonData[idxElem][3])
-            smonData[idxElem] = secondAndThird
-
-         for idxElem in range(len(isonData)):
-            secondAndThird = []
-            secondAndThird.append(isonData[idxElem][1])
-            secondAndThird.append(isonData[idxElem][2])
-            isonData[idxElem] = secondAndThird
-
-         for idxElem in range(len(tempData)):
-            secondAndThird = []
-            secondAndThird.append(tempData[idxElem][1])
-            secondAndThird.append(tempData[idxElem][2])
-            tempData[idxElem] = secondAndThird
-
          #END OF LOOP ON MAPS: still inside loop on channels
-         verboseprint("   Sorted lists filled!")
+
+         #----------------SPLIT THE OBSERVABLES-------------------------------------------
+         #dates as wanted by root: seconds since the epoch as given by TDatime::Convert, plus the microseconds
+         channelDates = local_epoch_seconds(channelRecords["time"])
+
+         #ATTENTION: I use ACTUAL_IMONREAL only if I have no info from ACTUAL_IMON
+         #ATTENTION2: a negative status discards also the ison and the temp of the same row
+         negativeStatus = channelRecords["smon_valid"] & (channelRecords["smon"] < 0)
+         imonMask = channelRecords["imon_valid"]
+         vmonMask = channelRecords["vmon_valid"]
+         smonMask = channelRecords["smon_valid"] & ~negativeStatus
+         isonMask = channelRecords["ison_valid"] & ~negativeStatus
+         tempMask = channelRecords["temp_valid"] & ~negativeStatus
+
+         imonData_dates = channelDates[imonMask]
+         vmonData_dates = channelDates[vmonMask]
+         smonData_dates = channelDates[smonMask]
+         isonData_dates = channelDates[isonMask]
+         tempData_dates = channelDates[tempMask]
+
+         imonData_values = channelRecords["imon"][imonMask]
+         vmonData_values = channelRecords["vmon"][vmonMask]
+         smonData_values = np.trunc(channelRecords["smon"][smonMask]) #the status is an integer
+         isonData_values = channelRecords["ison"][isonMask]
+         tempData_values = channelRecords["temp"][tempMask]
+
+         #for the final Tree I need the dates of the status in a string format
+         smonDateStrings = to_date_strings(channelRecords["time"][smonMask])
+
+         #write the series found in the database to the columnar file
+         if seriesWriter is not None:
+            write_records( seriesWriter, parse_chamber_name( chamberList[chIdx] ), channelName[channelIdx], channelRecords )
+
+         verboseprint("   Sorted arrays filled!")
 
          #----------------CREATE HISTOGRAMS----------------------------------------------
          if monitorFlag == "HV":
@@ -1014,21 +965,12 @@ def main():
          Temph1.GetXaxis().SetTitle("Temperature [Celsius degrees]")
          Temph1.GetYaxis().SetTitle("counts")
 
-         #fill histograms: remember thet each row of Data has (Date, Value)
-         for idxPoint in range(len(imonData)):
-            Imonh1.Fill(imonData[idxPoint][1])
-
-         for idxPoint in range(len(vmonData)):
-            Vmonh1.Fill(vmonData[idxPoint][1])
-
-         for idxPoint in range(len(smonData)):
-            Smonh1.Fill(smonData[idxPoint][1])
-
-         for idxPoint in range(len(isonData)):
-            Isonh1.Fill(isonData[idxPoint][1])
-
-         for idxPoint in range(len(tempData)):
-            Temph1.Fill(tempData[idxPoint][1])
+         #fill histograms with all the values at once
+         fillHistogram(Imonh1, imonData_values)
+         fillHistogram(Vmonh1, vmonData_values)
+         fillHistogram(Smonh1, smonData_values)
+         fillHistogram(Isonh1, isonData_values)
+         fillHistogram(Temph1, tempData_values)
 
          #write TH1
          Imonh1.Write()
@@ -1038,44 +980,7 @@ def main():
          Temph1.Write()
 
          #--------------------CREATE TGRAPHS-------------------------------------------
-         #to create the TGraph I have to pass two lists: one with times and the other with values
-         imonData_dates = array ( 'd' )
-         vmonData_dates = array ( 'd' )
-         smonData_dates = array ( 'd' )
-         isonData_dates = array ( 'd' )
-         tempData_dates = array ( 'd' )
-
-         imonData_values = array ( 'd' )
-         vmonData_values = array ( 'd' )
-         smonData_values = array ( 'd' )
-         isonData_values = array ( 'd' )
-         tempData_values = array ( 'd' )
-
-         for imonIdx in range(len(imonData)):
-            imonData_dates.append(imonData[imonIdx][0])
-            imonData_values.append(imonData[imonIdx][1])
-
-         for vmonIdx in range(len(vmonData)):
-            vmonData_dates.append(vmonData[vmonIdx][0])
-            vmonData_values.append(vmonData[vmonIdx][1])
-
-         for smonIdx in range(len(smonData)):
-            smonData_dates.append(smonData[smonIdx][0])
-            smonData_values.append(smonData[smonIdx][1])
-
-         for isonIdx in range(len(isonData)):
-            isonData_dates.append(isonData[isonIdx][0])
-            isonData_values.append(isonData[isonIdx][1])
-
-         for tempIdx in range(len(tempData)):
-            tempData_dates.append(tempData[tempIdx][0])
-            tempData_values.append(tempData[tempIdx][1])
-
-
-
-
-
-
+         #to create the TGraph I have to pass two arrays: one with times and the other with values
          #in case there is nothing the TGraph gives error: put a dummy value
          dummyNumber = -999999999
          if monitorFlag == "HV":
@@ -1086,7 +991,8 @@ def main():
          dummyPair = [0, dummyNumber]
          dummyThree = [0, dummyStatus, dummyDate]
          #Last Value
-         if ( len(vmonData)==0 and sliceTestFlag == 0 and monitorFlag == "HV"  ):
+         foundLast = False
+         if ( len(vmonData_values)==0 and sliceTestFlag == 0 and monitorFlag == "HV"  ):
             #queryLastValue = "select VALUE_NUMBER from CMS_GEM_PVSS_COND.FWCAENCHANNELA1515_LV where DPID = " + str(OneChannelInfo[mapIdx][4]) + " and DPE_NAME = 'ACTUAL_VMON'"
             #Do a query back in time
             foundLast = False
@@ -1125,31 +1031,26 @@ def main():
             floatMicro_LAST = "0.000001"
             dateElemSQL_LAST = lastDateConverted + float(floatMicro_LAST)
 
-         if len(imonData)==0:
-            imonData_dates.append(0)
-            imonData_values.append(dummyNumber)
-            imonData.append( dummyPair )
-         if len(vmonData)==0:
+         if len(imonData_values)==0:
+            imonData_dates  = np.array([dummyPair[0]], dtype=np.float64)
+            imonData_values = np.array([dummyPair[1]], dtype=np.float64)
+         if len(vmonData_values)==0:
             if foundLast:
-               vmonData_dates.append(dateElemSQL_LAST)
-               vmonData_values.append(lastSavedVoltage_value)
-               vmonData.append( [dateElemSQL_LAST, lastSavedVoltage_value] )
+               vmonData_dates  = np.array([dateElemSQL_LAST], dtype=np.float64)
+               vmonData_values = np.array([lastSavedVoltage_value], dtype=np.float64)
             else:
-               vmonData_dates.append(0)
-               vmonData_values.append(dummyNumber)
-               vmonData.append( dummyPair )
-         if len(smonData)==0:
-            smonData_dates.append(0)
-            smonData_values.append(dummyStatus)
-            smonData.append( dummyThree )
-         if len(isonData)==0:
-            isonData_dates.append(0)
-            isonData_values.append(dummyNumber)
-            isonData.append( dummyPair )
-         if len(tempData)==0:
-            tempData_dates.append(0)
-            tempData_values.append(dummyNumber)
-            tempData.append( dummyPair )
+               vmonData_dates  = np.array([dummyPair[0]], dtype=np.float64)
+               vmonData_values = np.array([dummyPair[1]], dtype=np.float64)
+         if len(smonData_values)==0:
+            smonData_dates  = np.array([dummyThree[0]], dtype=np.float64)
+            smonData_values = np.array([dummyThree[1]], dtype=np.float64)
+            smonDateStrings = np.array([dummyThree[2]])
+         if len(isonData_values)==0:
+            isonData_dates  = np.array([dummyPair[0]], dtype=np.float64)
+            isonData_values = np.array([dummyPair[1]], dtype=np.float64)
+         if len(tempData_values)==0:
+            tempData_dates  = np.array([dummyPair[0]], dtype=np.float64)
+            tempData_values = np.array([dummyPair[1]], dtype=np.float64)
 
          #find minimum and maximum date between all channels of one chamber
          if ( imonData_dates[0] < minDateImonMultig ):
@@ -1178,32 +1079,32 @@ def main():
             maxDateTempMultig = tempData_dates[-1]+1
 
          #find the maximum and minimum value
-         if ( min( imonData_values ) < minValImonMultig ):
-            minValImonMultig = min( imonData_values )
-         if ( max( imonData_values ) > maxValImonMultig ):
-            maxValImonMultig = max( imonData_values )
-
-         if ( min( vmonData_values ) < minValVmonMultig ):
-            minValVmonMultig = min( vmonData_values )
-         if ( max( vmonData_values ) > maxValVmonMultig ):
-            maxValVmonMultig = max( vmonData_values )
-
-         if ( min( smonData_values ) < minValSmonMultig ):
-            minValSmonMultig = min( smonData_values )
-         if ( max( smonData_values ) > maxValSmonMultig ):
-            maxValSmonMultig = max( smonData_values )
-
-         if ( min( tempData_values ) < minValTempMultig ):
-            minValTempMultig = min( tempData_values )
-         if ( max( tempData_values ) > maxValTempMultig ):
-            maxValTempMultig = max( tempData_values )
+         if ( imonData_values.min() < minValImonMultig ):
+            minValImonMultig = imonData_values.min()
+         if ( imonData_values.max() > maxValImonMultig ):
+            maxValImonMultig = imonData_values.max()
+
+         if ( vmonData_values.min() < minValVmonMultig ):
+            minValVmonMultig = vmonData_values.min()
+         if ( vmonData_values.max() > maxValVmonMultig ):
+            maxValVmonMultig = vmonData_values.max()
+
+         if ( smonData_values.min() < minValSmonMultig ):
+            minValSmonMultig = smonData_values.min()
+         if ( smonData_values.max() > maxValSmonMultig ):
+            maxValSmonMultig = smonData_values.max()
+
+         if ( tempData_values.min() < minValTempMultig ):
+            minValTempMultig = tempData_values.min()
+         if ( tempData_values.max() > maxValTempMultig ):
+            maxValTempMultig = tempData_values.max()
 
          #declare TGraphs
-         Imontg1 = ROOT.TGraph(len(imonData),imonData_dates,imonData_values)
-         Vmontg1 = ROOT.TGraph(len(vmonData),vmonData_dates,vmonData_values)
-         Smontg1 = ROOT.TGraph(len(smonData),smonData_dates,smonData_values)
-         Isontg1 = ROOT.TGraph(len(isonData),isonData_dates,isonData_values)
-         Temptg1 = ROOT.TGraph(len(tempData),tempData_dates,tempData_values)
+         Imontg1 = ROOT.TGraph(len(imonData_values),imonData_dates,imonData_values)
+         Vmontg1 = ROOT.TGraph(len(vmonData_values),vmonData_dates,vmonData_values)
+         Smontg1 = ROOT.TGraph(len(smonData_values),smonData_dates,smonData_values)
+         Isontg1 = ROOT.TGraph(len(isonData_values),isonData_dates,isonData_values)
+         Temptg1 = ROOT.TGraph(len(tempData_values),tempData_dates,tempData_values)
 
          #prepeare one color for each channel
          markColor = 4 #default
@@ -1438,426 +1339,17 @@ def main():
             legendMultiVmon.AddEntry( Imontg1, "Layer 2", "p" )
 
          #----------------------TREE STATUS------------------------------------------------
-         #translate the status in binary and meaning string
-         smonData_binStatus     = []
-         smonData_decimalStatus = []
-         smonData_dateString    = []
-         smonData_meaningString = []
-
-         #---------------------STATUS MEANING FOR HV--------------------------------------
-         if monitorFlag == "HV":
-            #12 bit status for HV board A1515
-            #Bit 0: ON/OFF
-            #Bit 1: RUP
-            #Bit 2: RDW
-            #Bit 3: OVC
-            #Bit 4: OVV
-            #Bit 5: UVV
-            #Bit 6: etx trip
-            #Bit 7: MAX V
-            #Bit 8: EXT disable
-            #Bit 9: Internal Trip
-            #Bit 10: calibration error
-            #Bit 11: unplugged
-
-            nBit = 12
-            for smonIdx in range(len(smonData)):
-               #binary status
-               binStat = bin(int(smonData[smonIdx][1]))[2:] #to take away the 0b in front of the binary number
-               #verboseprint ("binStat:", binStat)
-               lenStat = len(binStat)
-               binStat = str(0) * (nBit - lenStat) + binStat
-               binStat = "0b"+binStat
-               smonData_binStatus.append( binStat )
-
-               #decimal status
-               smonData_decimalStatus.append( smonData[smonIdx][1] )
-
-               #date string
-               smonData_dateString.append( smonData[smonIdx][2] )
-
-               #meaning string
-               extensibleStat = ""
-               if binStat == "0b000000000000": #these are binary numbers
-                  StatusMeaning = "OFF"
-                  #verboseprint(StatusMeaning)
-
-               if binStat == "0b000000000001": #these are binary numbers
-                  StatusMeaning = "ON"
-                  #verboseprint(StatusMeaning)
-
-               cutBinStr = binStat[13:]
-               if cutBinStr == "0": #if I have OFF
-                  extensibleStat = extensibleStat + "OFF" + " "
-               elif cutBinStr == "1": #if I have OFF
-                  extensibleStat = extensibleStat + "ON" + " "
-
-               #bin produces a string (so the operation >> can be only made only on int)
-               #I observe the bin number with bin(shift2)
-               #I shift of one bit to delete the bit 0 from the string
-               shift2 = binStat[:-1]
-
-               #verboseprint("binStat:", binStat, "shift2:", shift2 )
-               if len(shift2) != 13:
-                  print(("ERROR: "+monitorFlag+" error in len of shift2. Len="+str(len(shift2))+"/13"))
-                  print(("binStat:", binStat, "shift2:", shift2))
-                  return 1
-
-               #for the second status cathegory I need the last two bins of shift2
-               #print ( "shift2", shift2, "bin 1 and 2", shift2[11:])
-               if int(shift2[11:]) > 0:
-                  #print (shift2[11:])
-                  cutBinStr = shift2[11:]
-                  if cutBinStr[1] == "1": #if I have RUP
-                     StatusMeaning = "RUP"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-                  if cutBinStr[0] == "1": #if I have RDW
-                     StatusMeaning = "RDW"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               #third status
-               shift3 = binStat[:-3]
-               if len(shift3) != 11:
-                  print(("ERROR: "+monitorFlag+" error in len of shift3. Len="+str(len(shift3))+"/11"))
-                  print(("shift3:", shift3))
-                  return 1
-
-               #print ( "shift3", shift3, "bin 3, 4, 5", shift3[8:])
-               if int(shift3[8:]) > 0:
-                  #print (shift3[8:])
-                  cutBinStr = shift3[8:]
-                  if cutBinStr[2] == "1": #if I have OVC
-                     StatusMeaning = "OVC"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-                  if cutBinStr[1] == "1": #if I have OVV
-                     StatusMeaning = "OVV"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-                  if cutBinStr[0] == "1": #if I have UVV
-                     StatusMeaning = "UVV"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               #fourth status
-               shift4 = binStat[:-6]
-               if len(shift4) != 8:
-                  print(("ERROR: "+monitorFlag+" error in len of shift4. Len="+str(len(shift4))+"/8"))
-                  print(("shift4:", shift4))
-                  return 1
-
-               #print ( "shift4", shift4, "bin 6, 7, 8, 9", shift4[4:])
-               if int(shift4[4:]) > 0:
-                  #print (shift4[4:])
-                  cutBinStr = shift4[4:]
-                  if cutBinStr[3] == "1": #if I have Ext Trip
-                     StatusMeaning = "Ext Trip"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-                  if cutBinStr[2] == "1": #if I have Max V
-                     StatusMeaning = "Max V"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-                  if cutBinStr[1] == "1": #if I have Ext Disable
-                     StatusMeaning = "Ext Disable"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-                  if cutBinStr[0] == "1": #if I have Int Trip
-                     StatusMeaning = "Int Trip"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               #fifth status
-               shift5 = binStat[:-10]
-               if len(shift5) != 4:
-                  print(("ERROR: "+monitorFlag+" error in len of shift5. Len="+str(len(shift5))+"/4"))
-                  print(("shift5:", shift5))
-                  return 1
-
-               #print ( "shift5", shift5, "bin 10", shift5[3:])
-               if int(shift5[3:]) > 0:
-                  #print (shift5[3:])
-                  cutBinStr = shift5[3:]
-                  if cutBinStr[0] == "1": #if I have Calib Error
-                     StatusMeaning = "Calib Error"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               #sixth status
-               shift6 = binStat[:-11]
-               if len(shift6) != 3:
-                  print(("ERROR: "+monitorFlag+" error in len of shift6. Len="+str(len(shift6))+"/3"))
-                  print(("shift6:", shift6))
-                  return 1
-
-               #print ( "shift6", shift6, "bin 11", shift6[2:])
-               if int(shift6[2:]) > 0:
-                  #print (shift6[2:])
-                  cutBinStr = shift6[2:]
-                  if cutBinStr[0] == "1": #if I have Unplugged
-                     StatusMeaning = "Unplugged"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               smonData_meaningString.append( extensibleStat )
-
-            #END OF LOOP OVER smonData
-
-         #---------------------STATUS MEANING FOR LV--------------------------------------------
-         if monitorFlag == "LV":
-            #for LV boards A3016 or A3016HP we have a 16 bit status
-            #LV boards (CAEN A3016 o A3016 HP)
-            #Bit 0: ON/OFF
-            #Bit 1: dont care
-            #Bit 2: dont care
-            #Bit 3: OverCurrent
-            #Bit 4: OverVoltage
-            #Bit 5: UnderVoltage
-            #Bit 6: dont care
-            #Bit 7: Over HVmax
-            #Bit 8: dont care
-            #Bit 9: Internal Trip
-            #Bit 10: Calibration Error
-            #Bit 11: Unplugged
-            #Bit 12: dont care
-            #Bit 13: OverVoltage Protection
-            #Bit 14: Power Fail
-            #Bit 15: Temperature Error
-
-            nBit = 16
-            for smonIdx in range(len(smonData)):
-               #binary status
-               binStat = bin(int(smonData[smonIdx][1]))[2:] #to take away the 0b in front of the binary number
-               #print ("binStat:", binStat)
-               lenStat = len(binStat)
-               binStat = str(0) * (nBit - lenStat) + binStat
-               binStat = "0b"+binStat
-               smonData_binStatus.append( binStat )
-
-               #decimal status
-               smonData_decimalStatus.append( smonData[smonIdx][1] )
-
-               #date string
-               smonData_dateString.append( smonData[smonIdx][2] )
-
-               #meaning string
-               extensibleStat = ""
-               if len(binStat) != (nBit + 2) :
-                  print(("ERROR: "+monitorFlag+" error in len of binStat. Len="+len(binStat)+"/"+str(nBit + 2)))
-                  return 1
-
-               if binStat == "0b0000000000000000": #these are binary numbers
-                  StatusMeaning = "OFF"
-                  #print(StatusMeaning)
-
-               if binStat == "0b0000000000000001": #these are binary numbers
-                  StatusMeaning = "ON"
-                  #print(StatusMeaning)
-
-               cutBinStr = binStat[-1:]
-               if cutBinStr == "0": #if I have OFF
-                  extensibleStat = extensibleStat + "OFF" + " "
-               elif cutBinStr == "1": #if I have OFF
-                  extensibleStat = extensibleStat + "ON" + " "
-
-               #bin produces a string (so the operation >> can be only made only on int)
-               #I observe the bin number with bin(shift2)
-               #I shift of one bit to delete the bit 0 from the string
-               removedBits = 0 - 1 #negative number
-               shift2 = binStat[:removedBits]
-
-               #print("binStat:", binStat, "shift2:", shift2 )
-               if len(shift2) != (nBit + 2) + removedBits:
-                  print(("ERROR: "+monitorFlag+" error in len of shift2. Len="+len(shift2)+"/"+str(nBit + 2 + removedBits )))
-                  return 1
-
-               #I have to remove bit 1 and 2 because they are not interesting
-               #len(shift2)-2    -2 because I want the last two bits
-               #print ( "shift2", shift2, "bin 1 and 2", shift2[len(shift2)-2:])
-
-               #remove bit 1 and 2 : second status cathegory even if it is written mismatch 3: I removed the bits
-               removedBits = removedBits - 2 #negative number
-               shift3 = binStat[:removedBits]
-
-               if len(shift3) != (nBit + 2) + removedBits:
-                  print(("ERROR: "+monitorFlag+" error in len of shift3. Len="+len(shift3)+"/"+str(nBit + 2 + removedBits )))
-                  return 1
-
-               #for the second status cathegory I need the last two bins of shift3
-               #print ( "shift3", shift3, "bit 3 4 5", shift3[len(shift3)-3:])
-               if int(shift3[len(shift3)-3:]) > 0:
-                  #print (shift3[len(shift3)-3:])
-                  cutBinStr = shift3[len(shift3)-3:]
-                  if cutBinStr[2] == "1": #if I have OVC
-                     StatusMeaning = "OVC"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-                  if cutBinStr[1] == "1": #if I have OVV
-                     StatusMeaning = "OVV"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-                  if cutBinStr[0] == "1": #if I have UVV
-                     StatusMeaning = "UVV"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               #remove bit 3 4 5
-               removedBits = removedBits - 3 #negative number
-               shift4 = binStat[:removedBits]
-
-               if len(shift4) != (nBit + 2) + removedBits:
-                  print(("ERROR: "+monitorFlag+" error in len of shift4. Len="+len(shift4)+"/"+str(nBit + 2 + removedBits )))
-                  return 1
-
-               #print ( "shift4", shift4, "bit 6", shift4[len(shift4)-1:])
-
-               #remove bit 6
-               removedBits = removedBits - 1 #negative number
-               shift5 = binStat[:removedBits]
-
-               if len(shift5) != (nBit + 2) + removedBits:
-                  print(("ERROR: "+monitorFlag+" error in len of shift5. Len="+len(shift5)+"/"+str(nBit + 2 + removedBits )))
-                  return 1
-               #for the third status cathegory I need the last four bins of shift5
-               #I dont register the bit 8 beacuse not interesting
-               #print ( "shift5", shift5, "bit 7, 8, 9", shift5[len(shift5)-3:])
-               if int(shift5[len(shift5)-3:]) > 0:
-                  #print (shift5[len(shift5)-3:])
-                  cutBinStr = shift5[len(shift5)-3:]
-                  if cutBinStr[2] == "1": #if I have OHVMax
-                     StatusMeaning = "OHVMax"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-                  if cutBinStr[0] == "1": #if I have INTTRIP
-                     StatusMeaning = "InTrip"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               #remove bit 7 8 9 to do the fourth status cathegory
-               removedBits = removedBits - 3 #negative number
-               shift6 = binStat[:removedBits]
-
-               if len(shift6) != (nBit + 2) + removedBits:
-                  print(("ERROR: "+monitorFlag+" error in len of shift6. Len="+len(shift6)+"/"+str(nBit + 2 + removedBits )))
-                  return 1
-
-               #for the fourth status cathegory I need the last bit of shift6
-               #print ( "shift6", shift6, "bit 10", shift6[len(shift6)-1:])
-               if int(shift6[len(shift6)-1:]) > 0:
-                  #print (shift6[len(shift6)-1:])
-                  cutBinStr = shift6[len(shift6)-1:]
-                  if cutBinStr[0] == "1": #if I have Calib Error
-                     StatusMeaning = "CalibERR"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               #remove bit 10
-               removedBits = removedBits - 1 #negative number
-               shift7 = binStat[:removedBits]
-
-               if len(shift7) != (nBit + 2) + removedBits:
-                  print(("ERROR: "+monitorFlag+" error in len of shift7. Len="+len(shift7)+"/"+str(nBit + 2 + removedBits )))
-                  return 1
-
-               #for the fifth status cathegory I need the last bit of shift7
-               #print ( "shift7", shift7, "bit 11", shift7[len(shift7)-1:])
-               if int(shift7[len(shift7)-1:]) > 0:
-                  #print (shift7[len(shift7)-1:])
-                  cutBinStr = shift7[len(shift7)-1:]
-                  if cutBinStr[0] == "1": #if I have Unplugged
-                     StatusMeaning = "Unplugged"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               #remove bit 11
-               removedBits = removedBits - 1 #negative number
-               shift8 = binStat[:removedBits]
-
-               if len(shift8) != (nBit + 2) + removedBits:
-                  print(("ERROR: "+monitorFlag+" error in len of shift8. Len="+len(shift8)+"/"+str(nBit + 2 + removedBits )))
-                  return 1
-
-               #print ( "shift8", shift8, "bit 12", shift8[len(shift8)-1:])   #bit 12 not interesting
-
-               #remove bit 12 to do the sixth status cathegory
-               removedBits = removedBits - 1 #negative number
-               shift9 = binStat[:removedBits]
-
-               if len(shift9) != (nBit + 2) + removedBits:
-                  print(("ERROR: "+monitorFlag+" error in len of shift9. Len="+len(shift9)+"/"+str(nBit + 2 + removedBits )))
-                  return 1
-
-               #for the sixth status cathegory I need the last bit of shift9
-               #print ( "shift9", shift9, "bit 13", shift9[len(shift9)-1:])
-               if int(shift9[len(shift9)-1:]) > 0:
-                  #print (shift9[len(shift9)-1:])
-                  cutBinStr = shift9[len(shift9)-1:]
-                  if cutBinStr[0] == "1": #if I have OVVPROT
-                     StatusMeaning = "OVVPROT"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               #remove bit 13 to do the seventh status cathegory
-               removedBits = removedBits - 1 #negative number
-               shift10 = binStat[:removedBits]
-
-               if len(shift10) != (nBit + 2) + removedBits:
-                  print(("ERROR: "+monitorFlag+" error in len of shift10. Len="+len(shift10)+"/"+str(nBit + 2 + removedBits )))
-                  return 1
-
-               #for the seventh status cathegory I need the last bit of shift10
-               #print ( "shift10", shift10, "bit 14", shift10[len(shift10)-1:])
-               if int(shift10[len(shift10)-1:]) > 0:
-                  #print (shift10[len(shift10)-1:])
-                  cutBinStr = shift10[len(shift10)-1:]
-                  if cutBinStr[0] == "1": #if I have POWFAIL
-                     StatusMeaning = "POWFAIL"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               #remove bit 14 to do the eight status cathegory
-               removedBits = removedBits - 1 #negative number
-               shift11 = binStat[:removedBits]
-
-               if len(shift11) != (nBit + 2) + removedBits:
-                  print(("ERROR: "+monitorFlag+" error in len of shift11. Len="+len(shift11)+"/"+str(nBit + 2 + removedBits )))
-                  return 1
-
-               #for the eight status cathegory I need the last bit of shift11
-               #print ( "shift11", shift11, "bit 15", shift11[len(shift11)-1:])
-               if int(shift11[len(shift11)-1:]) > 0:
-                  #print (shift11[len(shift11)-1:])
-                  cutBinStr = shift11[len(shift11)-1:]
-                  if cutBinStr[0] == "1": #if I have TEMPERR
-                     StatusMeaning = "TEMPERR"
-                     extensibleStat = extensibleStat + StatusMeaning + " "
-                     #print(StatusMeaning)
-
-               smonData_meaningString.append( extensibleStat )
-
-            #END OF LOOP OVER smonData
-
-
-         #------------------CHECK SIZE OF VECTORS FOR TREE-------------------------------------
-         #check lenght of vectors
-         if len(smonData) != len(smonData_binStatus):
-            print(("ERROR: "+monitorFlag+" len(smonData) different from len(smonData_binStatus)"))
-            print(("len(smonData):", len(smonData), "len(smonData_binStatus):", len(smonData_binStatus)))
-            return 1
-         if len(smonData_binStatus) != len(smonData_decimalStatus):
-            print(("ERROR: "+monitorFlag+" len(smonData_binStatus) different from len(smonData_binStatus)"))
-            print(("len(smonData_binStatus):", len(smonData_binStatus), "len(smonData_decimalStatus):", len(smonData_decimalStatus)))
-            return 1
-         if len(smonData_decimalStatus) != len(smonData_dateString):
-            print(("ERROR: "+monitorFlag+" len(smonData_decimalStatus) different from len(smonData_dateString)"))
-            print(("len(smonData_decimalStatus):", len(smonData_decimalStatus), "len(smonData_dateString):", len(smonData_dateString)))
-            return 1
-         if len(smonData_dateString) != len(smonData_meaningString):
-            print(("ERROR: "+monitorFlag+" len(smonData_dateString) different from len(smonData_meaningString)"))
-            print(("len(smonData_dateString):", len(smonData_dateString), "len(smonData_meaningString):", len(smonData_meaningString)))
+         #translate the status in binary and meaning string with the lookup tables of caen_status.py
+         #12 bit status for HV board A1515, 16 bit status for LV boards A3016 or A3016HP
+         statusBoard = STATUS_BOARDS[monitorFlag]
+         try:
+            smonData_binStatus     = binary_strings(smonData_values, statusBoard).tolist()
+            smonData_meaningString = meaning_strings(smonData_values, statusBoard).tolist()
+         except ValueError as statusError:
+            print(("ERROR: "+monitorFlag+" "+str(statusError)))
             return 1
+         smonData_decimalStatus = smonData_values.astype(np.int64).tolist()
+         smonData_dateString    = smonDateStrings.tolist()
 
 
          #---------------------TREE DECLARATION------------------------------------------------
@@ -1873,7 +1365,7 @@ def main():
          StatusTree.Branch( 'BinaryStat',  smonRootBinStat     )
          StatusTree.Branch( 'MeaningStat', smonRootMeaningStat )
 
-         for smonIdx in range(len( smonData )):
+         for smonIdx in range(len( smonData_decimalStatus )):
             smonRootTimesDate.push_back(   smonData_dateString[smonIdx]    )
             smonRootDecimalStat.push_back( str(smonData_decimalStatus[smonIdx]) )
             smonRootBinStat.push_back(     smonData_binStatus[smonIdx]     )
@@ -2036,9 +1528,18 @@ def main():
    #end of loop over chambers
    #at column 3 we are inside the main
    f1.Close()
+   if seriesWriter is not None:
+      seriesWriter.close()
+
+   if args.workers > 1:
+      executor.shutdown()
+      pool.release(db)
+      pool.close()
 
    print('\n-------------------------Output--------------------------------')
    print((fileName+ " has been created."))
+   if seriesWriter is not None:
+      print((seriesFileName+ " has been created."))
    verboseprint("It is organised in directories: to change directory use DIRNAME->cd()")
    verboseprint('To draw a TH1 or a TGraph: OBJNAME->Draw()')
    verboseprint('To scan the TTree use for example:\nHV_StatusTree2_2_Top_G3Bot->Scan("","","colsize=26")')
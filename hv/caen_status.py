@@ -0,0 +1,145 @@
+"""Decoding of the ACTUAL_STATUS words of the CAEN boards powering the GEM chambers.
+
+The status is a bit field: 12 bits for the HV boards A1515 and 16 bits for the
+LV boards A3016 (or A3016HP). Every function takes a NumPy array of status
+words, so that years of status history are decoded with a few bitwise
+operations and table lookups instead of one string manipulation per row.
+
+    >>> import numpy as np
+    >>> from caen_status import A1515, bit_columns, meaning_strings
+    >>> status = np.array([0, 1, 3, 9])
+    >>> bit_columns(status, A1515)['OVC']
+    array([False, False, False,  True])
+    >>> meaning_strings(status, A1515).tolist()
+    ['OFF ', 'ON ', 'ON RUP ', 'ON OVC ']
+
+The binary and meaning strings are the ones stored in the status trees of
+``GEMDCSP5Monitor.py``.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from functools import lru_cache
+import sys
+import numpy as np
+
+
+@dataclass(frozen=True)
+class StatusBoard:
+    """
+    :num_bits: length of the status word
+    :flags: (bit, meaning) of the bits worth reporting, in ascending bit order.
+        Bit 0 is always ON/OFF.
+    """
+    name: str
+    num_bits: int
+    flags: tuple[tuple[int, str], ...]
+
+
+# HV board A1515
+A1515 = StatusBoard('A1515', 12, (
+    (1, 'RUP'),
+    (2, 'RDW'),
+    (3, 'OVC'),
+    (4, 'OVV'),
+    (5, 'UVV'),
+    (6, 'Ext Trip'),
+    (7, 'Max V'),
+    (8, 'Ext Disable'),
+    (9, 'Int Trip'),
+    (10, 'Calib Error'),
+    (11, 'Unplugged'),
+))
+
+# LV board A3016 or A3016HP. Bits 1, 2, 6, 8 and 12 are not interesting.
+A3016 = StatusBoard('A3016', 16, (
+    (3, 'OVC'),
+    (4, 'OVV'),
+    (5, 'UVV'),
+    (7, 'OHVMax'),
+    (9, 'InTrip'),
+    (10, 'CalibERR'),
+    (11, 'Unplugged'),
+    (13, 'OVVPROT'),
+    (14, 'POWFAIL'),
+    (15, 'TEMPERR'),
+))
+
+# monitorFlag of GEMDCSP5Monitor.py -> board
+STATUS_BOARDS = {
+    'HV': A1515,
+    'LV': A3016,
+}
+
+
+def to_status_words(status: np.ndarray, board: StatusBoard) -> np.ndarray:
+    """
+    :status: status words, possibly stored as float
+    :returns: the status words as int64
+    :raises ValueError: if a status word does not fit in ``board.num_bits`` bits
+    """
+    words = np.asarray(status).astype(np.int64)
+    if len(words) > 0 and (words.min() < 0 or words.max() >= (1 << board.num_bits)):
+        bad = words[(words < 0) | (words >= (1 << board.num_bits))][0]
+        raise ValueError(f'status {bad} is not a {board.num_bits}-bit status of the {board.name} board')
+    return words
+
+
+def bit_columns(status: np.ndarray, board: StatusBoard) -> dict[str, np.ndarray]:
+    """
+    :returns: a boolean array for 'ON' and for each meaning of ``board.flags``
+    """
+    words = to_status_words(status, board)
+    columns = {'ON': (words & 1) != 0}
+    for bit, meaning in board.flags:
+        columns[meaning] = (words & (1 << bit)) != 0
+    return columns
+
+
+@lru_cache(maxsize=None)
+def _lookup_tables(board: StatusBoard) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :returns: for every possible status word, the binary string, the meaning
+        string (both as object arrays of interned strings) and the index of the
+        meaning in the sorted distinct meanings, which are returned last
+    """
+    codes = np.arange(1 << board.num_bits, dtype=np.int64)
+
+    # '0b' followed by the bits, the most significant first
+    shifts = np.arange(board.num_bits - 1, -1, -1)
+    digits = ((codes[:, None] >> shifts) & 1).astype('U1')
+    binary = np.char.add('0b', np.ascontiguousarray(digits).view(f'U{board.num_bits}')[:, 0])
+
+    meaning = np.where(codes & 1, 'ON ', 'OFF ').astype(object)
+    for bit, name in board.flags:
+        meaning = np.where((codes >> bit) & 1, meaning + (name + ' '), meaning)
+
+    categories, category_index = np.unique(meaning.astype(str), return_inverse=True)
+
+    intern = np.vectorize(sys.intern, otypes=[object])
+    return intern(binary.astype(object)), intern(meaning), category_index.reshape(-1), categories
+
+
+def binary_strings(status: np.ndarray, board: StatusBoard) -> np.ndarray:
+    """
+    :returns: e.g. '0b000000000001' for the status 1 of an A1515
+    """
+    return _lookup_tables(board)[0][to_status_words(status, board)]
+
+
+def meaning_strings(status: np.ndarray, board: StatusBoard) -> np.ndarray:
+    """
+    :returns: 'OFF ' or 'ON ' followed by the meaning of every bit set, each
+        followed by a space. e.g. 'ON RUP ' for the status 3 of an A1515
+    """
+    return _lookup_tables(board)[1][to_status_words(status, board)]
+
+
+def meaning_categories(status: np.ndarray, board: StatusBoard) -> tuple[np.ndarray, np.ndarray]:
+    """
+    compact form of ``meaning_strings`` for long histories
+
+    :returns: the sorted distinct meaning strings of ``board`` and, for each
+        status word, the index of its meaning in them
+    """
+    _, _, category_index, categories = _lookup_tables(board)
+    return categories, category_index[to_status_words(status, board)]
@@ -1,11 +1,49 @@
-import datetime
-from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import itertools
+import re
 import sqlite3
+import sys
 from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
 import argparse
-import ROOT
 import numpy as np
 import pandas as pd
+from dcs_ingest import wall_clock_seconds
+from root_readers import BACKENDS
+from root_readers import RootReader
+from root_readers import open_reader
+# the statistics by run are shared with the analyses
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'analysis'))
+from hvjoin import HVSamples
+from hvjoin import RunIntervals
+from hvjoin import integrate_step
+from hvjoin import load_runs
+
+# observable in the object names of GEMDCSP5Monitor.py -> observable of the series table,
+# as in the columnar output of GEMDCSP5Monitor.py
+OBSERVABLES = {
+    'Imon': 'imon',
+    'Vmon': 'vmon',
+    'Status': 'smon',
+    'Ison': 'ison',
+    'Temp': 'temp',
+}
+# e.g. 'HV_VmonChamberGE_P1_1_01_G3Bot_UTC_time' or 'LV_ImonChamberGE_M1_2_18_L1_TH1'
+OBJECT_NAME_PATTERN = r'^(?P<monitor>HV|LV)_(?P<observable>{observables})Chamber{chamber}_(?P<channel>.+)_(?P<kind>UTC_time|TH1)$'
+# columns of the tables written by run, in the order of the rows inserted
+TABLE_COLUMNS = {
+    'chambers': {'chamber_id': 'INTEGER', 'name': 'TEXT',
+                 'region': 'INTEGER', 'station': 'INTEGER', 'layer': 'INTEGER', 'chamber': 'INTEGER'},
+    'series': {'chamber_id': 'INTEGER', 'channel': 'TEXT', 'observable': 'TEXT', 'time': 'REAL', 'value': 'REAL'},
+    'histograms': {'chamber_id': 'INTEGER', 'channel': 'TEXT', 'observable': 'TEXT',
+                   'low_edge': 'REAL', 'high_edge': 'REAL', 'content': 'REAL'},
+    'hv': {'region': 'INTEGER', 'station': 'INTEGER', 'layer': 'INTEGER', 'chamber': 'INTEGER',
+           'time': 'INTEGER', 'hv': 'REAL'},
+}
 
 @dataclass
 class GEMChamberId:
@@ -26,71 +64,293 @@ def parse_chamber_name(chamber_name: str) -> GEMChamberId:
     chamber = int(chamber)
     return GEMChamberId(region, station, layer, chamber)
 
-def to_numpy(arr, dtype) -> np.ndarray:
+@dataclass
+class ChamberData:
     """
-
-    :arr: cppyy.LowLevelView
+    :monitor: 'HV' or 'LV', None if the directory has no channel object
+    :series: (channel, observable, time, value) of each TGraph, with the
+        CHANGE_DATE of DCS as ``time`` in seconds since the epoch
+    :histograms: (channel, observable, bin edges, bin contents) of each TH1
     """
-    shape = (len(arr), )
-    arr.reshape(shape)
-    return np.array(arr, dtype=dtype)
+    name: str
+    chamber_id: GEMChamberId
+    monitor: Optional[str] = None
+    series: list[tuple[str, str, np.ndarray, np.ndarray]] = field(default_factory=list)
+    histograms: list[tuple[str, str, np.ndarray, np.ndarray]] = field(default_factory=list)
 
-fromtimestamp = np.vectorize(datetime.datetime.fromtimestamp)
+def process_chamber(reader: RootReader, chamber_name: str, verbose: bool) -> ChamberData:
+    """
+    reads every channel graph and histogram of a chamber directory. The
+    multigraphs, canvases and status trees are skipped.
 
-def process_chamber(root_file, chamber_name: str, verbose: bool):
-    graph = root_file.Get(f'{chamber_name}/HV_VmonChamber{chamber_name}_Drift_UTC_time')
-    size = graph.GetN()
-    timestamp_arr = to_numpy(graph.GetX(), dtype=int) # unix timestamp
-    hv_arr = to_numpy(graph.GetY(), dtype=np.float64) # high voltage
-    timestamp_arr = fromtimestamp(timestamp_arr)
+    ``GEMDCSP5Monitor.py`` converts the CHANGE_DATE of DCS to the X values
+    with ``TDatime.Convert``, which reads it as a local time. The X values are
+    converted back to the CHANGE_DATE with the local time zone of this host,
+    which must be the one of the monitor host, e.g. with TZ=Europe/Zurich.
+    """
+    pattern = re.compile(OBJECT_NAME_PATTERN.format(observables='|'.join(OBSERVABLES),
+                                                    chamber=re.escape(chamber_name)))
+    data = ChamberData(chamber_name, parse_chamber_name(chamber_name))
+    for name, class_name in reader.list_objects(chamber_name).items():
+        match = pattern.match(name)
+        if match is None:
+            continue
+        data.monitor = match['monitor']
+        key = (match['channel'], OBSERVABLES[match['observable']])
+        if match['kind'] == 'UTC_time' and class_name.startswith('TGraph'):
+            time_arr, value_arr = reader.read_graph(f'{chamber_name}/{name}')
+            data.series.append(key + (wall_clock_seconds(time_arr), value_arr))
+        elif match['kind'] == 'TH1' and class_name.startswith('TH1'):
+            data.histograms.append(key + reader.read_histogram(f'{chamber_name}/{name}'))
 
     if verbose:
-        print(f'{chamber_name}: {timestamp_arr[0]} - {timestamp_arr[-1]} ({size} records)')
-
-    chamber_id = parse_chamber_name(chamber_name)
-    region_arr = np.full(size, chamber_id.region, dtype=int)
-    station_arr = np.full(size, chamber_id.station, dtype=int)
-    layer_arr = np.full(size, chamber_id.layer, dtype=int)
-    chamber_arr = np.full(size, chamber_id.chamber, dtype=int)
-
-    # NOTE
-    data = {
-        'region': region_arr,
-        'station': station_arr,
-        'layer': layer_arr,
-        'chamber': chamber_arr,
-        'time': timestamp_arr,
+        num_points = sum(len(time_arr) for _, _, time_arr, _ in data.series)
+        print(f'{chamber_name}: {len(data.series)} graphs ({num_points} points), {len(data.histograms)} histograms')
+    return data
+
+# reader of each worker process, as the open files can not be pickled
+_WORKER_READER: Optional[RootReader] = None
+
+def _init_worker(backend: str, input_path: Path) -> None:
+    global _WORKER_READER
+    _WORKER_READER = open_reader(backend, input_path)
+
+def _process_chamber_in_worker(chamber_name: str, verbose: bool) -> ChamberData:
+    assert _WORKER_READER is not None
+    return process_chamber(_WORKER_READER, chamber_name, verbose)
+
+def to_series_frame(chamber_idx: int, data: ChamberData) -> Optional[pd.DataFrame]:
+    """
+    :returns: the rows of the long table ``series`` of a chamber, None if it has no graph
+    """
+    if len(data.series) == 0:
+        return None
+    sizes = [len(time_arr) for _, _, time_arr, _ in data.series]
+    def repeat(values: list) -> pd.Categorical:
+        return pd.Categorical(np.repeat(np.array(values, dtype=object), sizes))
+    return pd.DataFrame({
+        'chamber_id': np.full(sum(sizes), chamber_idx, dtype=np.int16),
+        'channel': repeat([channel for channel, _, _, _ in data.series]),
+        'observable': repeat([observable for _, observable, _, _ in data.series]),
+        'time': np.concatenate([time_arr for _, _, time_arr, _ in data.series]),
+        'value': np.concatenate([value_arr for _, _, _, value_arr in data.series]),
+    })
+
+def to_histogram_frame(chamber_idx: int, data: ChamberData) -> Optional[pd.DataFrame]:
+    """
+    :returns: one row per bin of the histograms of a chamber, None if it has no histogram
+    """
+    if len(data.histograms) == 0:
+        return None
+    frames = [pd.DataFrame({
+        'chamber_id': np.full(len(contents), chamber_idx, dtype=np.int16),
+        'channel': channel,
+        'observable': observable,
+        'low_edge': edges[:-1],
+        'high_edge': edges[1:],
+        'content': contents,
+    }) for channel, observable, edges, contents in data.histograms]
+    return pd.concat(frames, ignore_index=True)
+
+def map_bounded(executor: Executor, fn: Callable, *iterables: Iterable, max_pending: int) -> Iterator:
+    """
+    ``executor.map`` submitting at most ``max_pending`` tasks ahead of the
+    result being consumed, so that the finished results do not pile up
+    """
+    pending: deque[Future] = deque()
+    for args in zip(*iterables):
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+def insert_rows(connection: sqlite3.Connection, table: str, rows: Iterable[tuple]) -> None:
+    """
+    appends ``rows``, in the order of ``TABLE_COLUMNS[table]``, to ``table``.
+    Unlike ``DataFrame.to_sql``, it does not commit, so that the whole
+    conversion is a single transaction.
+    """
+    columns = TABLE_COLUMNS[table]
+    connection.executemany(f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                           rows)
+
+def insert_frame(connection: sqlite3.Connection, table: str, frame: pd.DataFrame) -> None:
+    # itertuples gives Python scalars, which sqlite3 binds unlike the NumPy ones
+    insert_rows(connection, table, frame[list(TABLE_COLUMNS[table])].itertuples(index=False, name=None))
+
+def write_hv(connection: sqlite3.Connection,
+             chamber_id: GEMChamberId,
+             time_arr: np.ndarray,
+             hv_arr: np.ndarray,
+) -> pd.DataFrame:
+    """
+    appends the drift Vmon of a chamber to the table ``hv``
+
+    :returns: the rows written
+    """
+    # the identity of the chamber repeated over its rows, as small integers
+    def repeat(value: int) -> np.ndarray:
+        return np.full(len(time_arr), value, dtype=np.int8)
+
+    data = pd.DataFrame({
+        'region': repeat(chamber_id.region),
+        'station': repeat(chamber_id.station),
+        'layer': repeat(chamber_id.layer),
+        'chamber': repeat(chamber_id.chamber),
+        'time': time_arr,
         'hv': hv_arr,
-    }
+    })
+    insert_frame(connection, 'hv', data)
     return data
 
+def write_hv_by_run(connection: sqlite3.Connection, runs_db: Path) -> None:
+    """
+    materialises the table ``hv_by_run`` with the statistics of the drift Vmon
+    of every chamber in every run of ``runs_db`` within the HV history, as
+    computed by ``integrate_step`` of ``analysis/hvjoin.py``. The table
+    ``hv`` is read back in a single pass along its index, one chamber at a
+    time.
+    """
+    since, until = connection.execute('SELECT MIN(time), MAX(time) FROM hv').fetchone()
+    runs_connection = sqlite3.connect(runs_db)
+    runs = load_runs(runs_connection)
+    runs_connection.close()
+    overlap = (runs.start <= until) & (runs.end >= since)
+    runs = RunIntervals(runs.run[overlap], runs.start[overlap], runs.end[overlap])
+
+    connection.execute('CREATE TABLE hv_by_run (run_number INTEGER, region INTEGER, station INTEGER, layer INTEGER,'
+                       ' chamber INTEGER, count INTEGER, mean REAL, min REAL, max REAL,'
+                       ' PRIMARY KEY (run_number, region, station, layer, chamber))')
+    cursor = connection.execute('SELECT region, station, layer, chamber, time, hv FROM hv'
+                                ' ORDER BY region, station, layer, chamber, time')
+    for key, group in itertools.groupby(cursor, key=lambda row: row[:4]):
+        table = np.array([row[4:] for row in group], dtype=np.float64).reshape(-1, 2)
+        region, _, layer, chamber = key
+        samples = HVSamples(groups=[(region, layer, chamber)],
+                            group=np.zeros(len(table), dtype=np.int64),
+                            time=table[:, 0].astype(np.int64),
+                            value=table[:, 1])
+        stats = integrate_step(runs, samples)
+        # NaN is stored as NULL
+        rows = zip(runs.run.tolist(), stats.count[:, 0].tolist(), stats.mean[:, 0].tolist(),
+                   stats.min[:, 0].tolist(), stats.max[:, 0].tolist())
+        connection.executemany('INSERT INTO hv_by_run VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               ((run, ) + key + (num, *(None if np.isnan(x) else x for x in stats))
+                                for run, num, *stats in rows))
+
+
+def write_tables(connection: sqlite3.Connection,
+                 chamber_list: Iterable[ChamberData],
+                 csv_path: Optional[Path],
+                 runs_db: Optional[Path],
+) -> None:
+    """
+    writes the tables of ``run``, replacing those already in the database,
+    from the chambers of ``chamber_list``, and the drift Vmon to ``csv_path``
+    if not None
+    """
+    for table in [*TABLE_COLUMNS, 'hv_by_run']:
+        connection.execute(f'DROP TABLE IF EXISTS {table}')
+    for table, columns in TABLE_COLUMNS.items():
+        connection.execute(f'CREATE TABLE {table} ({", ".join(f"{name} {kind}" for name, kind in columns.items())})')
+
+    # written chamber by chamber, in the order of the file. With PyROOT, the
+    # arrays are views of the graphs, which are written before the file is closed.
+    chamber_rows = []
+    num_hv_rows = 0
+    for chamber_idx, data in enumerate(chamber_list):
+        chamber_id = data.chamber_id
+        chamber_rows.append((chamber_idx, data.name, chamber_id.region, chamber_id.station, chamber_id.layer, chamber_id.chamber))
+        for table, frame in [('series', to_series_frame(chamber_idx, data)),
+                             ('histograms', to_histogram_frame(chamber_idx, data))]:
+            if frame is not None:
+                insert_frame(connection, table, frame)
+        for channel, observable, time_arr, hv_arr in data.series:
+            if (data.monitor, channel, observable) == ('HV', 'Drift', 'vmon'):
+                hv_frame = write_hv(connection, chamber_id, time_arr.astype(np.int64), hv_arr)
+                if csv_path is not None:
+                    hv_frame.index += num_hv_rows
+                    hv_frame.to_csv(csv_path, mode='w' if num_hv_rows == 0 else 'a', header=(num_hv_rows == 0))
+                num_hv_rows += len(hv_frame)
+    insert_rows(connection, 'chambers', chamber_rows)
+
+    connection.execute('CREATE INDEX hv_chamber_time ON hv (region, station, layer, chamber, time)')
+    if num_hv_rows > 0 and runs_db is not None:
+        write_hv_by_run(connection, runs_db)
+    connection.execute('CREATE INDEX series_chamber ON series (chamber_id, channel, observable, time)')
+
 
 def run(input_path: Path,
         output_dir: Path,
         to_csv: bool,
-        verbose: bool
+        verbose: bool,
+        backend: str = 'uproot',
+        jobs: int = 1,
+        runs_db: Optional[Path] = None,
+        overwrite: bool = False,
 ) -> None:
     """
+    writes the tables
+
+    - ``chambers``: chamber_id, name, region, station, layer, chamber
+    - ``series``: chamber_id, channel, observable, time, value with every
+      point of every channel graph, ``time`` being the CHANGE_DATE in seconds
+      since the epoch, as in the columnar output of ``GEMDCSP5Monitor.py``
+    - ``histograms``: chamber_id, channel, observable, low_edge, high_edge,
+      content with every bin of every channel histogram
+    - ``hv``: the drift Vmon of the HV monitor with ``time`` as in ``series``
+      truncated to seconds, indexed by (region, station, layer, chamber, time)
+    - ``hv_by_run``: with ``runs_db``, the number of samples, the time-weighted
+      mean, the min and the max of the drift Vmon of each chamber in each run
+
+    The chambers are written one by one, and with ``jobs`` processes at most
+    ``2 * jobs`` chambers are read ahead, so that the memory used does not
+    grow with the number of chambers.
+
+    The tables are written in a single transaction: a failed conversion
+    leaves an existing database as it was and removes a new one.
+
+    :overwrite: replace the tables of an existing database
+    :raises FileExistsError: if the database exists and not ``overwrite``
     """
     if not input_path.is_file():
         raise FileNotFoundError(input_path)
     output_dir = output_dir or input_path.parent
 
-    root_file = ROOT.TFile(str(input_path)) # type: ignore
-    key_list = [key.GetName() for key in root_file.GetListOfKeys()]
-    data = [process_chamber(root_file, key, verbose) for key in key_list]
-    data = {key: np.concatenate([each[key] for each in data]) for key in data[0].keys()}
-    data = pd.DataFrame(data)
-
     sql_path = output_dir / input_path.with_suffix('.sql').name
-    connection = sqlite3.connect(sql_path)
-    data.to_sql(name='hv', con=connection)
-    connection.commit()
-    connection.close()
+    if sql_path.exists() and not overwrite:
+        raise FileExistsError(f"'{sql_path}' already exists, overwrite its tables with --overwrite")
+    csv_path = output_dir / input_path.with_suffix('.csv').name
+
+    reader = open_reader(backend, input_path)
+    chamber_names = reader.chamber_names()
+
+    if jobs > 1:
+        reader.close()
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(backend, input_path))
+        chamber_list = map_bounded(executor, _process_chamber_in_worker, chamber_names, [verbose] * len(chamber_names),
+                                   max_pending=2 * jobs)
+    else:
+        chamber_list = (process_chamber(reader, chamber_name, verbose) for chamber_name in chamber_names)
 
-    if to_csv:
-        csv_path = output_dir / input_path.with_suffix('.csv').name
-        data.to_csv(csv_path)
+    created = not sql_path.exists()
+    connection = sqlite3.connect(sql_path, isolation_level=None)
+    try:
+        with connection:
+            connection.execute('BEGIN')
+            write_tables(connection, chamber_list, csv_path if to_csv else None, runs_db)
+    except BaseException:
+        connection.close()
+        if created:
+            sql_path.unlink()
+        raise
+    finally:
+        connection.close()
+        if jobs > 1:
+            executor.shutdown(cancel_futures=True)
+        else:
+            reader.close()
 
 
 def main():
@@ -99,12 +359,23 @@ def main():
     parser.add_argument("-o", "--output-dir", type=Path, help="output directory")
     parser.add_argument("--to-csv", action="store_true", default=False, help="to csv")
     parser.add_argument("-v", "--verbose", action="store_true", default=False, help="verbose")
+    parser.add_argument("--backend", choices=BACKENDS, default='uproot',
+                        help="library reading the root file. uproot does not need a ROOT installation")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of processes reading the chamber directories")
+    parser.add_argument("--runs-db", type=Path,
+                        help="runs database of oms/convert-oms-json-to-sql.py, to precompute the hv_by_run table")
+    parser.add_argument("--overwrite", action="store_true", default=False,
+                        help="replace the tables of an existing output .sql file instead of refusing it")
     args = parser.parse_args()
 
     run(input_path=args.input_path,
         output_dir=args.output_dir,
         to_csv=args.to_csv,
-        verbose=args.verbose)
+        verbose=args.verbose,
+        backend=args.backend,
+        jobs=args.jobs,
+        runs_db=args.runs_db,
+        overwrite=args.overwrite)
 
 
 if __name__ == "__main__":
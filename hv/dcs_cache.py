@@ -0,0 +1,168 @@
+"""Local SQLite cache of the DCS time series retrieved by ``GEMDCSP5Monitor.py``.
+
+Every row fetched from the condition database is stored keyed by its UPDATEID,
+together with the closed time intervals already retrieved for each DPID. A
+window is then served from the cache and only the parts of it that have never
+been fetched are requested from the database, so a daily refresh of a long
+window only transfers the rows of the last day.
+"""
+from __future__ import annotations
+from datetime import datetime
+from datetime import timedelta
+from pathlib import Path
+import sqlite3
+from typing import Hashable, Sequence
+from dcs_fetch import DPIDWindow
+from dcs_fetch import fetch_windows
+
+# rows younger than this may not have been archived yet, so the time range
+# after ``now - SETTLE_TIME`` is always fetched again. Also covers the offset
+# between the local time and the CET times of the DCS.
+SETTLE_TIME = timedelta(hours=3)
+
+Interval = tuple[datetime, datetime]
+
+
+def to_text(date: datetime) -> str:
+    # fixed width so that the text comparison is the chronological one
+    return date.isoformat(sep=' ', timespec='microseconds')
+
+
+def subtract_intervals(since: datetime,
+                       until: datetime,
+                       covered: Sequence[Interval],
+) -> list[Interval]:
+    """
+    :covered: sorted and disjoint closed intervals
+    :returns: closed intervals of ``[since, until]`` not in ``covered``
+    """
+    gaps: list[Interval] = []
+    cursor = since
+    for start, stop in covered:
+        if stop < cursor:
+            continue
+        if start > until:
+            break
+        if start > cursor:
+            gaps.append((cursor, start))
+        cursor = max(cursor, stop)
+    if cursor < until:
+        gaps.append((cursor, until))
+    return gaps
+
+
+def merge_intervals(intervals: Sequence[Interval]) -> list[Interval]:
+    merged: list[Interval] = []
+    for start, stop in sorted(intervals):
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+class DCSCache:
+    """drop-in replacement of ``dcs_fetch.fetch_windows`` backed by a local file
+
+    Each call opens its own connection, so a cache can be shared by the worker
+    threads of ``GEMDCSP5Monitor.py``.
+    """
+
+    def __init__(self, path: Path, settle_time: timedelta = SETTLE_TIME) -> None:
+        self.path = Path(path)
+        self.settle_time = settle_time
+
+    def connect(self, table: str, columns: Sequence[str]) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=600)
+        connection.execute('PRAGMA journal_mode=WAL')
+        name = self.table_name(table)
+        connection.execute(f'CREATE TABLE IF NOT EXISTS {name} '
+                           f'(UPDATEID INTEGER PRIMARY KEY, DPID INTEGER NOT NULL, {", ".join(columns)})')
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {name}_dpid_date ON {name} (DPID, CHANGE_DATE)')
+        connection.execute('CREATE TABLE IF NOT EXISTS coverage '
+                           '(data_table TEXT NOT NULL, DPID INTEGER NOT NULL, since TEXT NOT NULL, until TEXT NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS coverage_dpid ON coverage (data_table, DPID)')
+        return connection
+
+    @staticmethod
+    def table_name(table: str) -> str:
+        """'CMS_GEM_PVSS_COND.FWCAENCHANNELA1515' -> 'FWCAENCHANNELA1515'"""
+        return table.split('.')[-1]
+
+    def read_coverage(self, connection: sqlite3.Connection, table: str, dpid: int) -> list[Interval]:
+        rows = connection.execute('SELECT since, until FROM coverage WHERE data_table = ? AND DPID = ?',
+                                  (self.table_name(table), dpid)).fetchall()
+        return merge_intervals([(datetime.fromisoformat(since), datetime.fromisoformat(until))
+                                for since, until in rows])
+
+    def write_coverage(self,
+                       connection: sqlite3.Connection,
+                       table: str,
+                       dpid: int,
+                       intervals: Sequence[Interval],
+    ) -> None:
+        name = self.table_name(table)
+        merged = merge_intervals(list(self.read_coverage(connection, table, dpid)) + list(intervals))
+        connection.execute('DELETE FROM coverage WHERE data_table = ? AND DPID = ?', (name, dpid))
+        connection.executemany('INSERT INTO coverage VALUES (?, ?, ?, ?)',
+                               [(name, dpid, to_text(since), to_text(until)) for since, until in merged])
+
+    def fetch_windows(self,
+                      cursor,
+                      table: str,
+                      columns: Sequence[str],
+                      windows: Sequence[DPIDWindow],
+    ) -> dict[Hashable, list[tuple]]:
+        """
+        same as ``dcs_fetch.fetch_windows`` but only the parts of the windows
+        missing in the cache are requested through ``cursor``
+
+        :columns: must contain 'CHANGE_DATE'
+        """
+        date_idx = list(columns).index('CHANGE_DATE')
+        name = self.table_name(table)
+        horizon = (datetime.now() - self.settle_time).replace(microsecond=0)
+
+        connection = self.connect(table, columns)
+        try:
+            # find what is missing
+            gap_windows: list[DPIDWindow] = []
+            for window in windows:
+                if window.dpid is None:
+                    continue
+                covered = self.read_coverage(connection, table, window.dpid)
+                for since, until in subtract_intervals(window.since, window.until, covered):
+                    gap_windows.append(DPIDWindow((window.dpid, since, until), window.dpid, since, until))
+            # the same gap can be requested by several windows
+            gap_windows = list({each.key: each for each in gap_windows}.values())
+
+            # fetch it and store it
+            if len(gap_windows) > 0:
+                gap_rows = fetch_windows(cursor, table, ['UPDATEID'] + list(columns), gap_windows, inclusive=True)
+                placeholders = ', '.join('?' for _ in range(len(columns) + 2))
+                with connection:
+                    for (dpid, since, until), rows in gap_rows.items():
+                        rows = [(row[0], dpid) + tuple(to_text(value) if idx == date_idx else value
+                                                       for idx, value in enumerate(row[1:]))
+                                for row in rows]
+                        connection.executemany(f'INSERT OR IGNORE INTO {name} VALUES ({placeholders})', rows)
+                        if since < horizon:
+                            self.write_coverage(connection, table, dpid, [(since, min(until, horizon))])
+
+            # serve every window from the cache
+            selection = ', '.join(columns)
+            query = (f'SELECT {selection} FROM {name}'
+                     ' WHERE DPID = ? AND CHANGE_DATE > ? AND CHANGE_DATE < ? ORDER BY CHANGE_DATE')
+            rows_by_key: dict[Hashable, list[tuple]] = {}
+            for window in windows:
+                if window.dpid is None:
+                    rows_by_key[window.key] = []
+                    continue
+                rows = connection.execute(query, (window.dpid, to_text(window.since), to_text(window.until)))
+                rows_by_key[window.key] = [
+                    row[:date_idx] + (datetime.fromisoformat(row[date_idx]), ) + row[date_idx + 1:]
+                    for row in rows
+                ]
+        finally:
+            connection.close()
+        return rows_by_key
@@ -0,0 +1,139 @@
+"""Batched retrieval of DCS time series from the GEM PVSS condition database.
+
+``GEMDCSP5Monitor.py`` needs the rows of one data point (DPID) inside one time
+window for every chamber, channel and mapping period. Instead of sending one
+query per window, the windows are collected up front, the ones sharing the same
+time range are grouped and retrieved with ``DPID IN (...)`` queries using bind
+variables, and the rows are demultiplexed back to the windows that asked for them.
+
+``stream_windows`` sends the same queries sorted on the server and yields the
+rows one chunk at a time, for windows too long to be held in memory.
+"""
+from __future__ import annotations
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Hashable, Iterator, Optional, Sequence
+
+# Oracle rejects IN lists with more than 1000 expressions (ORA-01795)
+MAX_IN_LIST_SIZE = 1000
+# number of rows transferred per round trip
+DEFAULT_ARRAYSIZE = 10000
+
+
+@dataclass(frozen=True)
+class DPIDWindow:
+    """rows of ``dpid`` with ``since < CHANGE_DATE < until``
+
+    :key: identifies the window in the result of ``fetch_windows``
+    :dpid: data point ID. ``None`` if the data point could not be resolved.
+    """
+    key: Hashable
+    dpid: Optional[int]
+    since: datetime
+    until: datetime
+
+
+def build_query(table: str,
+                columns: Sequence[str],
+                num_dpids: int,
+                inclusive: bool = False,
+                ordered: bool = False,
+) -> str:
+    """
+    :returns: a query selecting ``DPID`` followed by ``columns`` for
+        ``num_dpids`` data points bound as ``:dpid0``, ``:dpid1``, ... within
+        the window bound as ``:since`` and ``:until``
+    :inclusive: include rows changed exactly at ``since`` or ``until``
+    :ordered: sort the rows by DPID and CHANGE_DATE on the server
+    """
+    placeholders = ', '.join(f':dpid{idx}' for idx in range(num_dpids))
+    lower, upper = ('>=', '<=') if inclusive else ('>', '<')
+    query = (f"select DPID, {', '.join(columns)} from {table}"
+             f" where DPID in ({placeholders})"
+             f" and CHANGE_DATE {lower} :since and CHANGE_DATE {upper} :until")
+    if ordered:
+        query += ' order by DPID, CHANGE_DATE'
+    return query
+
+
+def _group_windows(windows: Sequence[DPIDWindow]) -> dict[tuple[datetime, datetime], dict[int, list[Hashable]]]:
+    """
+    :returns: (since, until) -> dpid -> window keys
+    """
+    groups: dict[tuple[datetime, datetime], dict[int, list[Hashable]]] = defaultdict(lambda: defaultdict(list))
+    for window in windows:
+        if window.dpid is None:
+            continue
+        groups[(window.since, window.until)][window.dpid].append(window.key)
+    return groups
+
+
+def fetch_windows(cursor,
+                  table: str,
+                  columns: Sequence[str],
+                  windows: Sequence[DPIDWindow],
+                  arraysize: int = DEFAULT_ARRAYSIZE,
+                  batch_size: int = MAX_IN_LIST_SIZE,
+                  inclusive: bool = False,
+) -> dict[Hashable, list[tuple]]:
+    """
+    :cursor: cx_Oracle cursor
+    :table: e.g. 'CMS_GEM_PVSS_COND.FWCAENCHANNELA1515'
+    :columns: columns to select for each row
+    :windows: windows to retrieve. Several windows may share the same DPID.
+    :inclusive: see ``build_query``
+    :returns: rows (without the leading DPID) for each window key, in the order
+        returned by the database
+    """
+    rows_by_key: dict[Hashable, list[tuple]] = {window.key: [] for window in windows}
+
+    cursor.arraysize = arraysize
+    for (since, until), dpid_to_keys in _group_windows(windows).items():
+        dpid_list = sorted(dpid_to_keys)
+        for start in range(0, len(dpid_list), batch_size):
+            batch = dpid_list[start:start + batch_size]
+            parameters = {f'dpid{idx}': dpid for idx, dpid in enumerate(batch)}
+            parameters['since'] = since
+            parameters['until'] = until
+            cursor.execute(build_query(table, columns, len(batch), inclusive), parameters)
+            while rows := cursor.fetchmany():
+                for row in rows:
+                    for key in dpid_to_keys[row[0]]:
+                        rows_by_key[key].append(row[1:])
+    return rows_by_key
+
+
+def stream_windows(cursor,
+                   table: str,
+                   columns: Sequence[str],
+                   windows: Sequence[DPIDWindow],
+                   chunk_size: int = DEFAULT_ARRAYSIZE,
+                   batch_size: int = MAX_IN_LIST_SIZE,
+) -> Iterator[tuple[Hashable, list[tuple]]]:
+    """
+    same queries as ``fetch_windows``, but sorted on the server and consumed
+    ``chunk_size`` rows at a time, so that only one chunk is resident
+
+    :yields: (window key, rows without the leading DPID). The rows of a window
+        may be split in several consecutive chunks, in chronological order.
+        Windows without rows or without DPID are not yielded.
+    """
+    cursor.arraysize = chunk_size
+    for (since, until), dpid_to_keys in _group_windows(windows).items():
+        dpid_list = sorted(dpid_to_keys)
+        for start in range(0, len(dpid_list), batch_size):
+            batch = dpid_list[start:start + batch_size]
+            parameters = {f'dpid{idx}': dpid for idx, dpid in enumerate(batch)}
+            parameters['since'] = since
+            parameters['until'] = until
+            cursor.execute(build_query(table, columns, len(batch), ordered=True), parameters)
+            while rows := cursor.fetchmany():
+                # the rows of a DPID are contiguous
+                begin = 0
+                for end in range(1, len(rows) + 1):
+                    if end == len(rows) or rows[end][0] != rows[begin][0]:
+                        chunk = [row[1:] for row in rows[begin:end]]
+                        for key in dpid_to_keys[rows[begin][0]]:
+                            yield key, chunk
+                        begin = end
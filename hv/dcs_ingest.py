@@ -0,0 +1,107 @@
+"""Conversion of DCS rows into NumPy structured arrays.
+
+``GEMDCSP5Monitor.py`` used to parse every row in Python: ``str`` of the
+timestamp, ``ROOT.TDatime`` and a list per observable. Here the rows of a
+window are converted at once into a structured array with a ``datetime64[us]``
+timestamp, one float64 column per value and one boolean column telling whether
+the value was not NULL, and the timestamps are converted in bulk.
+"""
+from __future__ import annotations
+import time
+from typing import Sequence
+import numpy as np
+
+# CHANGE_DATE -> time, ACTUAL_IMON -> imon, ...
+FIELD_NAMES = {
+    'CHANGE_DATE': 'time',
+    'ACTUAL_IMON': 'imon',
+    'ACTUAL_VMON': 'vmon',
+    'ACTUAL_STATUS': 'smon',
+    'ACTUAL_ISON': 'ison',
+    'ACTUAL_TEMP': 'temp',
+    'ACTUAL_IMONREAL': 'imonreal',
+}
+
+
+def make_dtype(columns: Sequence[str]) -> np.dtype:
+    """
+    :columns: database columns, starting with 'CHANGE_DATE'
+    :returns: ``time`` followed by ``<name>`` and ``<name>_valid`` for each value
+    """
+    fields = [('time', 'datetime64[us]')]
+    for column in columns[1:]:
+        name = FIELD_NAMES[column]
+        fields += [(name, np.float64), (f'{name}_valid', np.bool_)]
+    return np.dtype(fields)
+
+
+def rows_to_records(rows: Sequence[tuple], columns: Sequence[str]) -> np.ndarray:
+    """
+    :rows: rows as returned by the cursor, in the order of ``columns``
+    :columns: database columns, starting with 'CHANGE_DATE'
+    :returns: structured array with the dtype of ``make_dtype``. NULL values
+        are stored as NaN with ``<name>_valid`` set to False.
+    """
+    records = np.empty(len(rows), dtype=make_dtype(columns))
+    if len(rows) == 0:
+        return records
+    table = np.array(rows, dtype=object).reshape(len(rows), len(columns))
+    records['time'] = table[:, 0].astype('datetime64[us]')
+    for idx, column in enumerate(columns[1:], start=1):
+        name = FIELD_NAMES[column]
+        valid = table[:, idx] != None # noqa: E711 elementwise comparison
+        records[f'{name}_valid'] = valid
+        records[name] = np.where(valid, table[:, idx], np.nan).astype(np.float64)
+    return records
+
+
+def _local_offset(naive_second: int) -> int:
+    """
+    :returns: offset to subtract from a wall-clock time expressed in seconds
+        since the epoch to get the actual unix time, as ``mktime`` does
+    """
+    struct = time.gmtime(naive_second)
+    return naive_second - int(time.mktime(struct[:8] + (-1, )))
+
+
+def local_epoch_seconds(times: np.ndarray) -> np.ndarray:
+    """
+    vectorised equivalent of ``TDatime(str(date)).Convert() + microseconds``,
+    i.e. the unix time of wall-clock times of the local time zone
+
+    The offset to UTC is computed once per wall-clock hour seen in ``times``.
+
+    :times: datetime64 array
+    :returns: float64 array of seconds since the epoch
+    """
+    naive = times.astype('datetime64[s]')
+    micro = (times - naive).astype('timedelta64[us]').astype(np.int64)
+    naive = naive.astype(np.int64)
+    hours, inverse = np.unique(naive // 3600, return_inverse=True)
+    offsets = np.array([_local_offset(int(hour) * 3600) for hour in hours], dtype=np.int64)
+    return (naive - offsets[inverse]) + micro / 1e6
+
+
+def wall_clock_seconds(seconds: np.ndarray) -> np.ndarray:
+    """
+    inverse of ``local_epoch_seconds``: the wall-clock times of the local time
+    zone at unix times, in seconds since the epoch as if they were UTC
+
+    The offset to UTC is computed once per hour seen in ``seconds``.
+
+    :seconds: float64 array, e.g. the X values of the graphs of ``GEMDCSP5Monitor.py``
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    hours, inverse = np.unique(np.floor_divide(seconds, 3600).astype(np.int64), return_inverse=True)
+    offsets = np.array([time.localtime(int(hour) * 3600).tm_gmtoff for hour in hours], dtype=np.float64)
+    return seconds + offsets[inverse.reshape(-1)]
+
+
+def to_date_strings(times: np.ndarray) -> np.ndarray:
+    """
+    vectorised ``str(datetime)``: 'YYYY-MM-DD HH:MM:SS.ffffff', without the
+    fraction when it is zero
+    """
+    strings = np.char.replace(np.datetime_as_string(times, unit='us'), 'T', ' ')
+    whole = (times - times.astype('datetime64[s]')) == np.timedelta64(0, 'us')
+    return np.where(whole, strings.astype('U19'), strings)
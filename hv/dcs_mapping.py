@@ -0,0 +1,193 @@
+"""Index resolving the chambers of the HV/LV mapping files to their data points.
+
+``GEMDCSP5Monitor.py`` needs, for each chamber and channel, the data point
+(DP) used in each mapping period together with the SINCE of its alias and its
+DPID. The index is compiled once from the mapping lines and the names of the
+existing chambers, the SINCEs and DPIDs are resolved with a few bulk queries to
+``ALIASES`` and ``DP_NAME2ID``, and the result is stored in a JSON file that is
+rebuilt only when the mapping changes.
+"""
+from __future__ import annotations
+from datetime import datetime
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional, Sequence
+from dcs_fetch import MAX_IN_LIST_SIZE
+
+ALIASES_TABLE = 'CMS_GEM_PVSS_COND.ALIASES'
+DP_NAME2ID_TABLE = 'CMS_GEM_PVSS_COND.DP_NAME2ID'
+# SINCE used when an alias is missing in ALIASES
+NO_SINCE = datetime(1970, 1, 1, 0, 0, 1)
+
+# chamber alias -> channel -> map -> [DP, ALIASSHORT, SINCE, DPID]
+MappingIndex = dict[str, list[list[list]]]
+
+
+def index_key(mapping_lists: Sequence[Sequence[str]],
+              existing_chambers: Sequence[Sequence[str]],
+              channel_names_per_map: Sequence[Sequence[str]],
+              db_name: str,
+) -> str:
+    """
+    :returns: a digest of everything the index is built from
+    """
+    content = json.dumps([mapping_lists, existing_chambers, channel_names_per_map, db_name])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def split_mapping_line(line: str) -> tuple[str, str]:
+    """
+    'cms_gem_dcs_1:CAEN/GEM_CAEN_HV_01/board00/channel000:GE-1/1/08_HV_G3Bot:'
+    -> ('cms_gem_dcs_1:CAEN/GEM_CAEN_HV_01/board00/channel000', 'GE-1/1/08_HV_G3Bot:')
+
+    :line: line of the mapping file with the front DP string prepended
+    """
+    column_idx = line.index(':', 15)
+    return line[:column_idx], line[column_idx + 1:]
+
+
+def match_mapping(mapping_lists: Sequence[Sequence[str]],
+                  existing_chambers: Sequence[Sequence[str]],
+                  channel_names_per_map: Sequence[Sequence[str]],
+) -> list[list[list[tuple[str, str, str]]]]:
+    """
+    :mapping_lists: lines of each map
+    :existing_chambers: alternative names of each existing chamber
+    :channel_names_per_map: part of the alias identifying each channel, for each map
+    :returns: (DP, alias in the map, ALIASSHORT) of the matched lines, for each
+        existing chamber and map, in the order of the mapping file
+    """
+    matched = []
+    for alter_names in existing_chambers:
+        one_chamber = []
+        for lines, channel_names in zip(mapping_lists, channel_names_per_map):
+            one_map = []
+            for line in lines:
+                for channel_name in channel_names:
+                    if channel_name not in line:
+                        continue
+                    for alter_name in alter_names:
+                        if alter_name in line:
+                            dp, map_alias = split_mapping_line(line)
+                            one_map.append((dp, map_alias, alter_name))
+            one_chamber.append(one_map)
+        matched.append(one_chamber)
+    return matched
+
+
+def _select_in(cursor, query: str, values: Sequence[str]) -> list[tuple]:
+    """
+    :query: query with a '{}' placeholder for the bind variables of the IN list
+    """
+    rows = []
+    for start in range(0, len(values), MAX_IN_LIST_SIZE):
+        batch = values[start:start + MAX_IN_LIST_SIZE]
+        placeholders = ', '.join(f':name{idx}' for idx in range(len(batch)))
+        cursor.execute(query.format(placeholders),
+                       {f'name{idx}': value for idx, value in enumerate(batch)})
+        rows += cursor.fetchall()
+    return rows
+
+
+def resolve_since(cursor, pairs: set[tuple[str, str]]) -> dict[tuple[str, str], datetime]:
+    """
+    :pairs: (DP, alias in the map)
+    :returns: the SINCE of each pair. The last row returned wins, as in the
+        query per line this replaces.
+    """
+    # REMEMBER: there is a dot at the end of DPE_NAME in ALIASES table
+    dpe_names = sorted({dp + '.' for dp, _ in pairs})
+    rows = _select_in(cursor, f'select SINCE, DPE_NAME, ALIAS from {ALIASES_TABLE} where DPE_NAME in ({{}})',
+                      dpe_names)
+    since = {}
+    for row_since, dpe_name, alias in rows:
+        since[(dpe_name[:-1], alias)] = row_since
+    return {pair: since.get(pair, NO_SINCE) for pair in pairs}
+
+
+def resolve_dpid(cursor, dps: set[str]) -> dict[str, Optional[int]]:
+    """
+    :returns: the ID of each DP, ``None`` if it is not in DP_NAME2ID
+    """
+    rows = _select_in(cursor, f'select ID, DPNAME from {DP_NAME2ID_TABLE} where DPNAME in ({{}})', sorted(dps))
+    dpid = {}
+    for row_id, dp_name in rows:
+        dpid[dp_name] = int(row_id)
+    return {dp: dpid.get(dp) for dp in dps}
+
+
+def build_index(cursor,
+                mapping_lists: Sequence[Sequence[str]],
+                existing_chambers: Sequence[Sequence[str]],
+                channel_names_per_map: Sequence[Sequence[str]],
+) -> MappingIndex:
+    """
+    :returns: for every alternative name of every existing chamber, the
+        [DP, ALIASSHORT, SINCE, DPID] of each map of each channel, with the maps
+        sorted by SINCE
+    """
+    matched = match_mapping(mapping_lists, existing_chambers, channel_names_per_map)
+    pairs = {(dp, map_alias) for chamber in matched for one_map in chamber for dp, map_alias, _ in one_map}
+    since = resolve_since(cursor, pairs)
+    dpid = resolve_dpid(cursor, {dp for dp, _ in pairs})
+
+    index: MappingIndex = {}
+    for alter_names, chamber in zip(existing_chambers, matched):
+        # map -> channel to channel -> map. The number of channels is the one of the first map
+        channels = []
+        for channel_idx in range(len(chamber[0])):
+            maps = [[dp, short_alias, since[(dp, map_alias)], dpid[dp]]
+                    for dp, map_alias, short_alias in (one_map[channel_idx] for one_map in chamber)]
+            # sort in case SINCE are stored not in the chronological order
+            channels.append(sorted(maps, key=lambda element: element[2]))
+        for alter_name in alter_names:
+            index[alter_name] = channels
+    return index
+
+
+def load_index(path: Path, key: str) -> Optional[MappingIndex]:
+    """
+    :returns: the index stored in ``path`` if it was built for ``key``
+    """
+    path = Path(path)
+    if not path.is_file():
+        return None
+    with open(path) as json_file:
+        data = json.load(json_file)
+    if data.get('key') != key:
+        return None
+    return {alias: [[[dp, short_alias, datetime.fromisoformat(since), dpid]
+                     for dp, short_alias, since, dpid in channel]
+                    for channel in channels]
+            for alias, channels in data['index'].items()}
+
+
+def save_index(path: Path, key: str, index: MappingIndex) -> None:
+    data = {
+        'key': key,
+        'index': {alias: [[[dp, short_alias, since.isoformat(), dpid]
+                           for dp, short_alias, since, dpid in channel]
+                          for channel in channels]
+                  for alias, channels in index.items()},
+    }
+    with open(path, 'w') as json_file:
+        json.dump(data, json_file)
+
+
+def load_or_build_index(path: Path,
+                        cursor,
+                        mapping_lists: Sequence[Sequence[str]],
+                        existing_chambers: Sequence[Sequence[str]],
+                        channel_names_per_map: Sequence[Sequence[str]],
+                        db_name: str,
+) -> MappingIndex:
+    """
+    :path: JSON file storing the index, rebuilt if the mapping has changed
+    """
+    key = index_key(mapping_lists, existing_chambers, channel_names_per_map, db_name)
+    index = load_index(path, key)
+    if index is None:
+        index = build_index(cursor, mapping_lists, existing_chambers, channel_names_per_map)
+        save_index(path, key, index)
+    return index
@@ -0,0 +1,229 @@
+"""Columnar output of the DCS time series extracted by ``GEMDCSP5Monitor.py``.
+
+Every series (one observable of one channel of one chamber) is appended to a
+single long-format table with the columns
+
+    region, station, layer, chamber, channel, observable, time, value
+
+where ``observable`` is one of 'imon', 'vmon', 'smon', 'ison' and 'temp' and
+``time`` is the CHANGE_DATE of the row, in UTC. Only the rows actually found in
+the database are written, without the dummy points of the ROOT graphs.
+
+``pyarrow`` is required only by the 'parquet' and 'arrow' formats.
+"""
+from __future__ import annotations
+from abc import ABC
+from abc import abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+import sqlite3
+from typing import Protocol
+import numpy as np
+
+OUTPUT_FORMATS = ('parquet', 'arrow', 'sqlite')
+SUFFIXES = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'sqlite': '.sqlite',
+}
+# rows buffered before a row group (parquet) or a record batch (arrow) is written
+DEFAULT_BATCH_SIZE = 1 << 20
+
+
+@dataclass(frozen=True)
+class GEMChamberId:
+    region: int
+    station: int
+    layer: int
+    chamber: int
+
+
+def parse_chamber_name(chamber_name: str) -> GEMChamberId:
+    """same as ``parse_chamber_name`` of ``convert-hv-root-to-sql.py``
+
+    :chamber_name: str. e.g. 'GE+1/1/01' or 'GE_P1_1_01'
+    """
+    chamber_name = chamber_name.replace('-', '_M').replace('+', '_P').replace('/', '_')
+    _, (region, station), layer, chamber = chamber_name.split('_')
+    region = 1 if region == 'P' else -1
+    return GEMChamberId(region, int(station), int(layer), int(chamber))
+
+
+class SeriesWriter(Protocol):
+
+    def write(self,
+              chamber: GEMChamberId,
+              channel: str,
+              observable: str,
+              times: np.ndarray,
+              values: np.ndarray
+    ) -> None:
+        """
+        :times: datetime64 array of CHANGE_DATE
+        :values: float array with the same length as ``times``
+        """
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class _ArrowSeriesWriter(ABC):
+    """buffers the series and writes them in batches of ``batch_size`` rows"""
+
+    def __init__(self, path: Path, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        import pyarrow as pa
+        self.pa = pa
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.schema = pa.schema([
+            ('region', pa.int8()),
+            ('station', pa.int8()),
+            ('layer', pa.int8()),
+            ('chamber', pa.int8()),
+            ('channel', pa.string()),
+            ('observable', pa.string()),
+            ('time', pa.timestamp('us', tz='UTC')),
+            ('value', pa.float64()),
+        ])
+        self.buffer: list = []
+        self.buffer_size = 0
+        self.writer = self.open()
+
+    @abstractmethod
+    def open(self):
+        """
+        :returns: the writer of the file, with a ``close`` method
+        """
+        ...
+
+    @abstractmethod
+    def write_table(self, table) -> None:
+        """
+        :table: ``pyarrow.Table`` with ``schema``
+        """
+        ...
+
+    def write(self,
+              chamber: GEMChamberId,
+              channel: str,
+              observable: str,
+              times: np.ndarray,
+              values: np.ndarray
+    ) -> None:
+        size = len(times)
+        if size == 0:
+            return
+        pa = self.pa
+        columns = [
+            pa.array(np.full(size, chamber.region, dtype=np.int8)),
+            pa.array(np.full(size, chamber.station, dtype=np.int8)),
+            pa.array(np.full(size, chamber.layer, dtype=np.int8)),
+            pa.array(np.full(size, chamber.chamber, dtype=np.int8)),
+            pa.array([channel] * size, type=pa.string()),
+            pa.array([observable] * size, type=pa.string()),
+            pa.array(times.astype('datetime64[us]'), type=self.schema.field('time').type),
+            pa.array(np.asarray(values, dtype=np.float64)),
+        ]
+        self.buffer.append(pa.Table.from_arrays(columns, schema=self.schema))
+        self.buffer_size += size
+        if self.buffer_size >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer_size == 0:
+            return
+        self.write_table(self.pa.concat_tables(self.buffer).combine_chunks())
+        self.buffer = []
+        self.buffer_size = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+
+class ParquetSeriesWriter(_ArrowSeriesWriter):
+    """one row group per batch"""
+
+    def open(self):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.path, self.schema)
+
+    def write_table(self, table) -> None:
+        self.writer.write_table(table, row_group_size=self.batch_size)
+
+
+class ArrowSeriesWriter(_ArrowSeriesWriter):
+    """Arrow IPC file, one record batch per batch"""
+
+    def open(self):
+        import pyarrow.ipc
+        return pyarrow.ipc.new_file(self.path, self.schema)
+
+    def write_table(self, table) -> None:
+        self.writer.write_table(table, max_chunksize=self.batch_size)
+
+
+class SQLiteSeriesWriter:
+    """table ``dcs`` with ``time`` stored as seconds since the epoch"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('DROP TABLE IF EXISTS dcs')
+        self.connection.execute(
+            'CREATE TABLE dcs (region INTEGER, station INTEGER, layer INTEGER, chamber INTEGER,'
+            ' channel TEXT, observable TEXT, time REAL, value REAL)')
+
+    def write(self,
+              chamber: GEMChamberId,
+              channel: str,
+              observable: str,
+              times: np.ndarray,
+              values: np.ndarray
+    ) -> None:
+        seconds = times.astype('datetime64[us]').astype(np.int64) / 1e6
+        key = (chamber.region, chamber.station, chamber.layer, chamber.chamber, channel, observable)
+        rows = (key + (time, value) for time, value in zip(seconds.tolist(), np.asarray(values, dtype=float).tolist()))
+        self.connection.executemany('INSERT INTO dcs VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def close(self) -> None:
+        self.connection.execute('CREATE INDEX dcs_series ON dcs '
+                                '(region, station, layer, chamber, channel, observable, time)')
+        self.connection.commit()
+        self.connection.close()
+
+
+def write_records(writer: SeriesWriter,
+                  chamber: GEMChamberId,
+                  channel: str,
+                  records: np.ndarray
+) -> None:
+    """
+    writes the series of a structured array of ``dcs_ingest.rows_to_records``
+    with the selection of the ROOT graphs: NULL values are skipped and a
+    negative status discards also the ison and the temp of the same row
+    """
+    negative_status = records['smon_valid'] & (records['smon'] < 0)
+    for observable in ('imon', 'vmon', 'smon', 'ison', 'temp'):
+        mask = records[f'{observable}_valid']
+        if observable in ('smon', 'ison', 'temp'):
+            mask = mask & ~negative_status
+        values = records[observable][mask]
+        if observable == 'smon':
+            values = np.trunc(values) # the status is an integer
+        writer.write(chamber, channel, observable, records['time'][mask], values)
+
+
+def open_writer(output_format: str, path: Path) -> SeriesWriter:
+    """
+    :output_format: one of ``OUTPUT_FORMATS``
+    """
+    if output_format == 'parquet':
+        return ParquetSeriesWriter(path)
+    elif output_format == 'arrow':
+        return ArrowSeriesWriter(path)
+    elif output_format == 'sqlite':
+        return SQLiteSeriesWriter(path)
+    else:
+        raise ValueError(f'unknown output format: {output_format}')
@@ -0,0 +1,127 @@
+"""Readers of the ROOT files written by ``GEMDCSP5Monitor.py``.
+
+The file has one directory per chamber holding TGraphs and TH1Fs.
+``convert-hv-root-to-sql.py`` only needs their arrays, which uproot reads
+without PyROOT; PyROOT is kept as an alternative backend and imported only
+when selected.
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Protocol
+import numpy as np
+
+BACKENDS = ('uproot', 'pyroot')
+
+
+class RootReader(Protocol):
+
+    def chamber_names(self) -> list[str]:
+        """
+        :returns: the names of the top-level directories, e.g. 'GE_P1_1_01'
+        """
+        ...
+
+    def list_objects(self, directory: str) -> dict[str, str]:
+        """
+        :returns: name -> class name of the objects in ``directory``
+        """
+        ...
+
+    def read_graph(self, path: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :path: e.g. 'GE_P1_1_01/HV_VmonChamberGE_P1_1_01_Drift_UTC_time'
+        :returns: the X and Y arrays of the TGraph as float64
+        """
+        ...
+
+    def read_histogram(self, path: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :returns: the bin edges and the bin contents of a TH1, without the
+            underflow and overflow bins
+        """
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class UprootReader:
+
+    def __init__(self, path: Path) -> None:
+        import uproot
+        self.file = uproot.open(path)
+
+    def chamber_names(self) -> list[str]:
+        return self.file.keys(recursive=False, cycle=False)
+
+    def list_objects(self, directory: str) -> dict[str, str]:
+        return self.file[directory].classnames(recursive=False, cycle=False)
+
+    def read_graph(self, path: str) -> tuple[np.ndarray, np.ndarray]:
+        graph = self.file[path]
+        return np.asarray(graph.member('fX'), dtype=np.float64), np.asarray(graph.member('fY'), dtype=np.float64)
+
+    def read_histogram(self, path: str) -> tuple[np.ndarray, np.ndarray]:
+        contents, edges = self.file[path].to_numpy(flow=False)
+        return edges, contents
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class PyROOTReader:
+
+    def __init__(self, path: Path) -> None:
+        import ROOT
+        self.file = ROOT.TFile(str(path))
+        if self.file.IsZombie():
+            raise OSError(f'failed to open {path}')
+
+    def chamber_names(self) -> list[str]:
+        return [key.GetName() for key in self.file.GetListOfKeys()]
+
+    def list_objects(self, directory: str) -> dict[str, str]:
+        return {key.GetName(): key.GetClassName() for key in self.file.Get(directory).GetListOfKeys()}
+
+    @staticmethod
+    def to_numpy(arr, size: int) -> np.ndarray:
+        """
+        zero-copy view of a buffer of doubles, valid while the file is open
+
+        :arr: cppyy.LowLevelView, e.g. TGraph::GetX()
+        """
+        if size == 0:
+            return np.empty(0, dtype=np.float64)
+        arr.reshape((size, ))
+        return np.frombuffer(arr, dtype=np.float64, count=size)
+
+    def read_graph(self, path: str) -> tuple[np.ndarray, np.ndarray]:
+        graph = self.file.Get(path)
+        if not graph:
+            raise KeyError(path)
+        size = graph.GetN()
+        return self.to_numpy(graph.GetX(), size), self.to_numpy(graph.GetY(), size)
+
+    def read_histogram(self, path: str) -> tuple[np.ndarray, np.ndarray]:
+        hist = self.file.Get(path)
+        if not hist:
+            raise KeyError(path)
+        num_bins = hist.GetNbinsX()
+        edges = np.array([hist.GetBinLowEdge(idx) for idx in range(1, num_bins + 2)], dtype=np.float64)
+        contents = np.array([hist.GetBinContent(idx) for idx in range(1, num_bins + 1)], dtype=np.float64)
+        return edges, contents
+
+    def close(self) -> None:
+        self.file.Close()
+
+
+def open_reader(backend: str, path: Path) -> RootReader:
+    """
+    :backend: one of ``BACKENDS``
+    """
+    if backend == 'uproot':
+        return UprootReader(path)
+    elif backend == 'pyroot':
+        return PyROOTReader(path)
+    else:
+        raise ValueError(f'unknown backend: {backend}')
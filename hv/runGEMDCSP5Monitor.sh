@@ -4,8 +4,11 @@ export GEM_PRODUCTION_DB_NAME=
 
 run_2022a_start_run="2022-05-25_16:07:57"
 now=$(date +%Y-%m-%d_%H:%M:%S)
+# rows fetched by the previous runs are read from here, only the new ones are requested from the database
+cache="OutputFiles/dcs-cache.sqlite"
 
 echo "start: ${run_2022a_start_run}"
 echo "end: ${now}"
 
-python3 GEMDCSP5Monitor.py ${run_2022a_start_run} ${now} HV 0
+mkdir -p OutputFiles
+python3 GEMDCSP5Monitor.py ${run_2022a_start_run} ${now} HV 0 --cache ${cache}
@@ -1,10 +1,14 @@
-import json
-import sqlite3
-import datetime
-from functools import partial
+import csv
 from pathlib import Path
+from typing import Optional
 import argparse
-import pandas as pd
+from runsdb import DEFAULT_BATCH_SIZE
+from runsdb import batched
+from runsdb import connect
+from runsdb import create_indexes
+from runsdb import insert_runs
+from runsdb import iter_json_array
+from runsdb import table_columns
 
 DEFAULT_CSV_COLUMNS = [
     'run_number',
@@ -17,50 +21,45 @@ DEFAULT_CSV_COLUMNS = [
     'tier0_transfer',
 ]
 
-def transform_row(row, component_set: set[str]):
-    for each in row.pop('components'):
-        row[each] = 1
-    for each in row.pop('components_out'):
-        row[each] = 0
-
-    for each in component_set:
-        if each not in row:
-            row[each] = -1 # missing
-    for key in ['start_time', 'end_time', 'last_update']:
-        if row[key] is not None:
-            # strptime don't preserve timezone... 
-            row[key] = datetime.datetime.strptime(row[key], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc)
-    return row
-
 def run(input_path: Path,
-        output_path: Path,
+        output_path: Optional[Path],
         table: str,
         if_exists: str,
         cols_to_csv: list[str],
         dump_schema: bool,
+        batch_size: int = DEFAULT_BATCH_SIZE,
 ) -> None:
-    with open(input_path, 'r') as json_file:
-        data = json.load(json_file)
-    data = [each['attributes'] for each in data['data']]
-
-    component_set = {each for row in data for each in row['components'] + row['components_out']}
-
-    row_transform_func = partial(transform_row, component_set=component_set)
-    data = map(row_transform_func, data)
-    data = pd.DataFrame(data)
+    output_path = output_path or input_path.with_suffix('.sql')
+    # transactions are opened explicitly so that the whole conversion is one
+    connection = connect(output_path)
+    with connection:
+        connection.execute('BEGIN')
+        if len(table_columns(connection, table)) > 0:
+            if if_exists == 'fail':
+                raise ValueError(f"Table '{table}' already exists.")
+            elif if_exists == 'replace':
+                connection.execute(f'DROP TABLE "{table}"')
+
+        with open(input_path, 'r') as json_file:
+            runs = iter_json_array(json_file, 'data')
+            for batch in batched(runs, batch_size):
+                insert_runs(connection, table, [each['attributes'] for each in batch], upsert=(if_exists == 'upsert'))
+        create_indexes(connection, table)
 
     if dump_schema:
-        schema = pd.io.sql.get_schema(data, table) # type: ignore
+        schema, = connection.execute('SELECT sql FROM sqlite_master WHERE type = "table" AND name = ?',
+                                     (table, )).fetchone()
         print(schema)
 
-    output_path = output_path or input_path.with_suffix('.sql')
-    connection = sqlite3.connect(output_path)
-    data.to_sql(name=table, con=connection, if_exists=if_exists)
-    connection.commit()
-    connection.close()
-
     if len(cols_to_csv) > 0:
-        data[cols_to_csv].to_csv(output_path.with_suffix('.csv'))
+        # the components are columns of the view, the other attributes of the table
+        columns = ', '.join(f'"{each}"' for each in cols_to_csv)
+        cursor = connection.execute(f'SELECT {columns} FROM "{table}" JOIN "{table}_components" USING (run_number)')
+        with open(output_path.with_suffix('.csv'), 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(cols_to_csv)
+            writer.writerows(cursor)
+    connection.close()
 
 def main():
     """TODO: Docstring for main.
@@ -71,15 +70,18 @@ def main():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("input_path", type=Path, help="Help text")
-    parser.add_argument("--output-path", "--output-path", default=None,
+    parser.add_argument("--output-path", "--output-path", type=Path, default=None,
                         help="a path to output file")
     parser.add_argument("-t", "--table", default="runs", type=str, help="table name")
     parser.add_argument("--if-exists", type=str, default='fail',
-                        choices=('fail', 'replace', 'append'),
-                        help="How to behave if the table already exists.")
+                        choices=('fail', 'replace', 'append', 'upsert'),
+                        help=("How to behave if the table already exists. "
+                              "'upsert' updates the runs already stored and inserts the new ones."))
     parser.add_argument("--cols-to-csv", type=str, nargs='?',
                         default=DEFAULT_CSV_COLUMNS,
                         help="convert selected columns into csv")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="runs inserted at once")
     parser.add_argument("-s", "--dump-schema", action="store_true", default=False, help="dump schema")
     args = parser.parse_args()
 
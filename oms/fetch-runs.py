@@ -2,39 +2,147 @@
 import json
 from typing import Optional
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import time
+import requests
 from gemdqm.oms import load_oms_api
 from gemdqm.oms import MAX_PER_PAGE
+from runsdb import connect
+from runsdb import get_sync_state
+from runsdb import upsert_runs
 
 ERA_RUN2022A_START_RUN = 352322
+DEFAULT_SHARD_SIZE = 1000 # runs
+NUM_RETRIES = 4
+RETRY_BACKOFF = 2 # sec, doubled after each failure
+# 429 Too Many Requests and the server errors
+RETRIED_STATUS_CODES = frozenset([429] + list(range(500, 600)))
+
+
+def is_transient(error: requests.RequestException) -> bool:
+    """
+    :returns: True for a connection error, a timeout, a 429 or a 5xx answer,
+        False for an error that a retry would repeat, e.g. a 4xx answer to a bad query
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.HTTPError) and response is not None \
+        and response.status_code in RETRIED_STATUS_CODES
+
+
+def fetch_page(oms_api,
+               filters: list[dict],
+               page: int,
+               per_page: int = MAX_PER_PAGE,
+               ascending: bool = True,
+) -> list[dict]:
+    """
+    :returns: the runs of one page, sorted by run number. A request failing
+        with a transient error is retried ``NUM_RETRIES`` times with an
+        exponential backoff.
+    :raises requests.RequestException: at once for an error that is not transient
+    :raises RuntimeError: if the last retry fails
+    """
+    error: Optional[Exception] = None
+    for attempt in range(NUM_RETRIES + 1):
+        if attempt > 0:
+            delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+            print(f'{error}, retrying in {delay} sec')
+            time.sleep(delay)
+        try:
+            query = oms_api.query("runs")
+            query.filters(filters)
+            query.sort("run_number", asc=ascending)
+            query.paginate(page=page, per_page=per_page)
+            response = query.data()
+            response.raise_for_status()
+            return response.json()['data']
+        except requests.RequestException as err:
+            if not is_transient(err):
+                raise
+            error = err
+    raise RuntimeError(f'failed to fetch the page {page} of runs after {NUM_RETRIES + 1} attempts: {error}') from error
+
+
+def fetch_runs(oms_api, filters: list[dict], per_page: int = MAX_PER_PAGE) -> list[dict]:
+    """
+    :filters: OMS filters, combined with AND
+    :returns: every run matching ``filters``, sorted by run number, following
+        the pages until a short one
+    """
+    data = []
+    page = 1
+    while True:
+        page_data = fetch_page(oms_api, filters, page, per_page)
+        data += page_data
+        if len(page_data) < per_page:
+            break
+        page += 1
+    return data
+
+
+def fetch_latest_run(oms_api) -> int:
+    return fetch_page(oms_api, [], page=1, per_page=1, ascending=False)[0]['attributes']['run_number']
+
+
+def fetch_run_range(oms_api,
+                    start_run: int,
+                    end_run: int,
+                    jobs: int = 1,
+                    shard_size: int = DEFAULT_SHARD_SIZE,
+) -> list[dict]:
+    """
+    splits [start_run, end_run] into shards of ``shard_size`` run numbers,
+    fetched concurrently by ``jobs`` threads sharing the session of ``oms_api``
+
+    :returns: the runs sorted by run number
+    """
+    shards = [(first, min(first + shard_size - 1, end_run)) for first in range(start_run, end_run + 1, shard_size)]
+
+    def fetch_shard(shard: tuple[int, int]) -> list[dict]:
+        first, last = shard
+        filters = [
+            {"attribute_name": "run_number", "value": first, "operator": "GE"},
+            {"attribute_name": "run_number", "value": last, "operator": "LE"},
+        ]
+        return fetch_runs(oms_api, filters)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # map keeps the order of the shards
+        return [each for shard_data in executor.map(fetch_shard, shards) for each in shard_data]
+
 
 def run(start_run: int,
         end_run: Optional[int] = None,
         output_dir: Optional[Path] = None,
+        jobs: int = 1,
+        shard_size: int = DEFAULT_SHARD_SIZE,
 ) -> None:
     if end_run is not None and start_run > end_run:
         raise RuntimeError(f"start_run(={end_run}) > end_run(={end_run})")
     output_dir = output_dir or Path.cwd()
 
     oms_api = load_oms_api()
-    query = oms_api.query("runs")
-    filters = [
-        {
-            "attribute_name": "run_number",
-            "value": start_run,
-            "operator": "GE"
-        }
-    ]
-    if end_run is not None:
-        filters.append({
-            "attribute_name": "run_number",
-            "value": end_run,
-            "operator": "LE"
-        })
-    query.filters(filters)
-    query.paginate(per_page=MAX_PER_PAGE)
-    response = query.data()
-    data = response.json()
+    if jobs > 1:
+        end_run = end_run or fetch_latest_run(oms_api)
+        data = {'data': fetch_run_range(oms_api, start_run, end_run, jobs, shard_size)}
+    else:
+        filters = [
+            {
+                "attribute_name": "run_number",
+                "value": start_run,
+                "operator": "GE"
+            }
+        ]
+        if end_run is not None:
+            filters.append({
+                "attribute_name": "run_number",
+                "value": end_run,
+                "operator": "LE"
+            })
+        data = {'data': fetch_runs(oms_api, filters)}
 
     end_run = end_run or data['data'][-1]['id']
     output_path = output_dir / f'runs_{start_run}_{end_run}.json'
@@ -42,6 +150,33 @@ def run(start_run: int,
         json.dump(data, json_file, indent=4)
 
 
+def sync(database: Path, table: str, start_run: int) -> None:
+    """
+    fetches the runs after the highest complete run of ``database`` and the
+    runs updated since its latest ``last_update``, and upserts them
+
+    :start_run: first run to fetch when ``database`` has no runs yet
+    """
+    connection = connect(database)
+    max_complete_run, max_last_update = get_sync_state(connection, table)
+
+    oms_api = load_oms_api()
+    if max_complete_run is None:
+        new_filter = {"attribute_name": "run_number", "value": start_run, "operator": "GE"}
+    else:
+        # the runs still ongoing at the last sync are fetched again
+        new_filter = {"attribute_name": "run_number", "value": max_complete_run, "operator": "GT"}
+    runs = {each['id']: each for each in fetch_runs(oms_api, [new_filter])}
+    if max_last_update is not None:
+        updated_filter = {"attribute_name": "last_update", "value": max_last_update, "operator": "GT"}
+        runs.update((each['id'], each) for each in fetch_runs(oms_api, [updated_filter]))
+
+    rows = [each['attributes'] for _, each in sorted(runs.items(), key=lambda item: int(item[0]))]
+    upsert_runs(connection, table, rows)
+    connection.close()
+    print(f'{len(rows)} runs upserted into {database}')
+
+
 def main():
     """TODO: Docstring for main.
 
@@ -54,11 +189,29 @@ def main():
                         help="start run. The default is the start of the Run2022A era.")
     parser.add_argument("-e", "--end-run", type=int, help="end run")
     parser.add_argument("-o", "--output-dir", type=Path, help="The default is the current working directory.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of shards of the run range fetched concurrently")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE,
+                        help="run numbers per shard, with --jobs larger than 1")
+    parser.add_argument("--sync", type=Path, metavar="DB",
+                        help=("update the runs database DB (e.g. written by convert-oms-json-to-sql.py) "
+                              "with the new and updated runs instead of writing a JSON file. "
+                              "--start-run is used only if DB has no runs yet."))
+    parser.add_argument("-t", "--table", default="runs", type=str, help="table name, with --sync")
     args = parser.parse_args()
 
-    run(start_run=args.start_run,
-        end_run=args.end_run,
-        output_dir=args.output_dir)
+    if args.sync is not None:
+        if args.end_run is not None:
+            parser.error("--end-run can not be used with --sync")
+        sync(database=args.sync,
+             table=args.table,
+             start_run=args.start_run)
+    else:
+        run(start_run=args.start_run,
+            end_run=args.end_run,
+            output_dir=args.output_dir,
+            jobs=args.jobs,
+            shard_size=args.shard_size)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,312 @@
+"""SQLite database of the OMS runs shared by ``fetch-runs.py`` and ``convert-oms-json-to-sql.py``.
+
+The table has one row per run with the attributes of the OMS ``runs``
+endpoint, keyed by ``run_number``. The subsystems listed in ``components``
+and ``components_out`` are stored as the bitmasks ``components_in`` and
+``components_out``, with the bit of each subsystem given by the dictionary
+table ``components``. A subsystem in neither mask was not listed for the run.
+The view ``<table>_components`` shows every subsystem as a column set to 1
+(in), 0 (out) or -1 (not listed). ``start_time``, ``end_time`` and
+``last_update`` are stored as seconds since the epoch, and an index covers
+the good-run selection of ``analysis/good-run-selection.py``:
+
+    WITH required AS (SELECT SUM(1 << bit) AS mask FROM components WHERE name IN ('GEM', 'CSC'))
+    SELECT run_number FROM runs, required WHERE components_in & required.mask = required.mask
+"""
+from __future__ import annotations
+import datetime
+from itertools import islice
+import json
+import re
+import sqlite3
+from typing import Any, Iterable, Iterator, Optional, Sequence, TextIO
+import numpy as np
+
+OMS_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+TIME_COLUMNS = ('start_time', 'end_time', 'last_update')
+# types of the columns used by the analyses. The other attributes get the type
+# of their first value.
+COLUMN_TYPES = {
+    'run_number': 'INTEGER PRIMARY KEY',
+    'start_time': 'INTEGER',
+    'end_time': 'INTEGER',
+    'last_update': 'INTEGER',
+    'duration': 'INTEGER',
+    'fill_number': 'INTEGER',
+    'tier0_transfer': 'INTEGER',
+    'cmssw_version': 'TEXT',
+    'components_in': 'INTEGER NOT NULL DEFAULT 0',
+    'components_out': 'INTEGER NOT NULL DEFAULT 0',
+}
+# the subsystems known when the database is created get the first bits, in
+# this order. The other ones are appended as OMS lists them.
+KNOWN_COMPONENTS = (
+    'BRIL', 'CASTOR', 'CSC', 'CTPPS', 'CTPPS_TOT', 'DAQ', 'DCS', 'DQM', 'DT', 'ECAL', 'ES',
+    'GEM', 'HCAL', 'HF', 'PIXEL', 'PIXEL_UP', 'RPC', 'SCAL', 'TCDS', 'TRACKER', 'TRG',
+)
+# bits of a signed 64-bit integer of SQLite, without the sign bit
+MAX_COMPONENTS = 63
+COMPONENTS_TABLE = 'components'
+# equality column first, then the range on duration. components_in and
+# end_time are included so that the good-run query is answered from the
+# index alone.
+GOOD_RUN_INDEX_COLUMNS = ('tier0_transfer', 'duration', 'components_in', 'end_time')
+DEFAULT_BATCH_SIZE = 1000 # runs
+_READ_SIZE = 1 << 16 # characters
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def iter_json_array(json_file: TextIO, key: str = 'data') -> Iterator[Any]:
+    """
+    yields the elements of the array ``key`` of a JSON object one by one,
+    reading ``json_file`` incrementally, e.g. the runs of a ``fetch-runs.py`` dump
+
+    :raises ValueError: if the file has no array ``key`` or is truncated
+    """
+    decoder = json.JSONDecoder()
+    pattern = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+    buffer = ''
+    match = None
+    while match is None:
+        chunk = json_file.read(_READ_SIZE)
+        if not chunk:
+            raise ValueError(f'no array "{key}" found')
+        # keep a tail long enough for a match split between two reads
+        buffer = buffer[-len(key) - 64:] + chunk
+        match = pattern.search(buffer)
+    buffer = buffer[match.end():]
+
+    eof = False
+    pos = 0
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            element, end = None, None
+        # an element ending the buffer may be a truncated number
+        if end is None or (end == len(buffer) and not eof):
+            if eof:
+                raise ValueError(f'truncated array "{key}"')
+            chunk = json_file.read(_READ_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield element
+        pos = end
+
+
+def batched(iterable: Iterable[Any], batch_size: int) -> Iterator[list[Any]]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def parse_oms_times(values: Sequence[Optional[str]]) -> np.ndarray:
+    """
+    :values: e.g. '2022-07-05T12:00:00Z' or None
+    :returns: datetime64[s] in UTC, NaT for None
+    """
+    # dropping the 'Z' as numpy does not parse time zones
+    return np.array([each[:-1] if each is not None else 'NaT' for each in values], dtype='datetime64[s]')
+
+
+def _to_sql_times(times: np.ndarray) -> list[Optional[int]]:
+    """
+    :returns: seconds since the epoch, None for NaT
+    """
+    return np.where(np.isnat(times), None, times.astype(np.int64).astype(object)).tolist()
+
+
+def _sql_type(values: Iterable[Any]) -> str:
+    """
+    :returns: the type of the first value that is not None, no type if all are None
+    """
+    for value in values:
+        if isinstance(value, (bool, int)):
+            return 'INTEGER'
+        elif isinstance(value, float):
+            return 'REAL'
+        elif isinstance(value, str):
+            return 'TEXT'
+        elif value is not None:
+            break
+    return ''
+
+
+def connect(path) -> sqlite3.Connection:
+    """
+    :returns: a connection in WAL mode, so that the analyses can read the
+        database while it is synchronised
+    """
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+
+def component_mask(component_bits: dict[str, int], names: Iterable[str]) -> int:
+    mask = 0
+    for each in names:
+        mask |= 1 << component_bits[each]
+    return mask
+
+
+def transform_row(row: dict[str, Any], component_bits: dict[str, int]) -> dict[str, Any]:
+    """
+    replaces the lists ``components`` and ``components_out`` by the bitmasks
+    ``components_in`` and ``components_out``. The timestamps are converted by
+    batch in ``insert_runs``.
+
+    :row: ``attributes`` of a run returned by OMS
+    :component_bits: component -> bit, containing every component of ``row``
+    """
+    row['components_in'] = component_mask(component_bits, row.pop('components', None) or [])
+    row['components_out'] = component_mask(component_bits, row.pop('components_out', None) or [])
+    return row
+
+
+def get_component_set(rows: Iterable[dict[str, Any]]) -> set[str]:
+    """
+    :rows: ``attributes`` of runs returned by OMS
+    """
+    return {each for row in rows for key in ('components', 'components_out') for each in row.get(key) or []}
+
+
+def load_component_bits(connection: sqlite3.Connection) -> dict[str, int]:
+    """
+    :returns: component -> bit, creating the ``components`` table with
+        ``KNOWN_COMPONENTS`` if it is missing
+    """
+    if len(table_columns(connection, COMPONENTS_TABLE)) == 0:
+        connection.execute(f'CREATE TABLE {COMPONENTS_TABLE} (bit INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+        connection.executemany(f'INSERT INTO {COMPONENTS_TABLE} (bit, name) VALUES (?, ?)',
+                               enumerate(KNOWN_COMPONENTS))
+    return {name: bit for bit, name in connection.execute(f'SELECT bit, name FROM {COMPONENTS_TABLE}')}
+
+
+def register_components(connection: sqlite3.Connection, names: Iterable[str]) -> dict[str, int]:
+    """
+    gives the next free bits to the components not in the ``components`` table yet
+
+    :returns: component -> bit of every registered component
+    :raises ValueError: if there are more than ``MAX_COMPONENTS`` components
+    """
+    component_bits = load_component_bits(connection)
+    for each in sorted(set(names) - set(component_bits)):
+        bit = max(component_bits.values(), default=-1) + 1
+        if bit >= MAX_COMPONENTS:
+            raise ValueError(f'no bit left for the component {each}')
+        connection.execute(f'INSERT INTO {COMPONENTS_TABLE} (bit, name) VALUES (?, ?)', (bit, each))
+        component_bits[each] = bit
+    return component_bits
+
+
+def table_columns(connection: sqlite3.Connection, table: str) -> list[str]:
+    """
+    :returns: the columns of ``table``, empty if it does not exist
+    """
+    return [row[1] for row in connection.execute(f'PRAGMA table_info({_quote(table)})')]
+
+
+def get_sync_state(connection: sqlite3.Connection, table: str) -> tuple[Optional[int], Optional[str]]:
+    """
+    :returns: the highest run with an ``end_time`` and the latest ``last_update``
+        as an OMS filter value, ``None`` when the table is empty or missing
+    """
+    columns = table_columns(connection, table)
+    if len(columns) == 0:
+        return None, None
+    if 'components_in' not in columns:
+        raise ValueError(f'{table} was written by an older convert-oms-json-to-sql.py, '
+                         'convert the JSON dump again with --if-exists replace')
+    max_complete_run, = connection.execute(
+        f'SELECT MAX(run_number) FROM {_quote(table)} WHERE end_time IS NOT NULL').fetchone()
+    max_last_update, = connection.execute(f'SELECT MAX(last_update) FROM {_quote(table)}').fetchone()
+    if max_last_update is not None:
+        max_last_update = datetime.datetime.fromtimestamp(max_last_update, datetime.timezone.utc).strftime(OMS_TIME_FORMAT)
+    return max_complete_run, max_last_update
+
+
+def insert_runs(connection: sqlite3.Connection,
+                table: str,
+                rows: Sequence[dict[str, Any]],
+                upsert: bool = False,
+) -> None:
+    """
+    inserts the runs without committing. The table is created if missing,
+    columns are added for new attributes and bits for new components. The
+    indexes and the view are created by ``create_indexes``.
+
+    :upsert: update the stored runs with the same ``run_number`` instead of failing
+    :rows: ``attributes`` of runs returned by OMS. They are transformed in place.
+        An attribute missing from a run, as OMS may leave out the optional
+        ones, is stored as NULL.
+    """
+    if len(rows) == 0:
+        return
+    component_bits = register_components(connection, get_component_set(rows))
+    rows = [transform_row(row, component_bits) for row in rows]
+    # every attribute of the batch, in the order they first appear
+    attributes = list(dict.fromkeys(key for row in rows for key in row))
+
+    def attribute_definition(name: str) -> str:
+        sql_type = COLUMN_TYPES.get(name) or _sql_type(row.get(name) for row in rows)
+        return f'{_quote(name)} {sql_type}'.rstrip()
+
+    columns = table_columns(connection, table)
+    if len(columns) == 0:
+        definitions = [attribute_definition(each) for each in attributes]
+        connection.execute(f'CREATE TABLE {_quote(table)} ({", ".join(definitions)})')
+        columns = attributes
+    else:
+        for each in attributes:
+            if each not in columns:
+                connection.execute(f'ALTER TABLE {_quote(table)} ADD COLUMN {attribute_definition(each)}')
+                columns.append(each)
+
+    times = {key: _to_sql_times(parse_oms_times([row.get(key) for row in rows])) for key in TIME_COLUMNS}
+    values = ([times[each][idx] if each in times else row.get(each) for each in columns] for idx, row in enumerate(rows))
+    column_list = ', '.join(map(_quote, columns))
+    placeholders = ', '.join('?' * len(columns))
+    statement = f'INSERT INTO {_quote(table)} ({column_list}) VALUES ({placeholders})'
+    if upsert:
+        assignments = ', '.join(f'{_quote(each)} = excluded.{_quote(each)}' for each in columns if each != 'run_number')
+        statement += f' ON CONFLICT (run_number) DO UPDATE SET {assignments}'
+    connection.executemany(statement, values)
+
+
+def upsert_runs(connection: sqlite3.Connection, table: str, rows: Sequence[dict[str, Any]]) -> None:
+    """
+    inserts the new runs and updates the stored ones in one transaction
+
+    :rows: ``attributes`` of runs returned by OMS. They are transformed in place.
+    """
+    with connection:
+        connection.execute('BEGIN')
+        insert_runs(connection, table, rows, upsert=True)
+        create_indexes(connection, table)
+
+
+def create_indexes(connection: sqlite3.Connection, table: str) -> None:
+    """
+    creates the index of the good-run selection if the table has all its
+    columns, and recreates the view ``<table>_components`` with a column per
+    registered component
+    """
+    columns = table_columns(connection, table)
+    if all(each in columns for each in GOOD_RUN_INDEX_COLUMNS):
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {_quote(table + "_good_runs")} '
+                           f'ON {_quote(table)} ({", ".join(map(_quote, GOOD_RUN_INDEX_COLUMNS))})')
+
+    view = _quote(table + '_components')
+    flags = [f'CASE WHEN components_in & {1 << bit} THEN 1 WHEN components_out & {1 << bit} THEN 0 ELSE -1 END AS {_quote(name)}'
+             for name, bit in sorted(load_component_bits(connection).items(), key=lambda item: item[1])]
+    connection.execute(f'DROP VIEW IF EXISTS {view}')
+    connection.execute(f'CREATE VIEW {view} AS SELECT run_number, {", ".join(flags)} FROM {_quote(table)}')
@@ -0,0 +1,161 @@
+"""Offline checks of the paginated and sharded fetching of ``fetch-runs.py``.
+
+``FakeOMSAPI`` answers the queries of the OMS API client in process, from a
+list of run numbers, with the filters, the sort and the pages applied by the
+``runs`` endpoint. The next answers can be replaced by HTTP errors or
+connection errors.
+"""
+from __future__ import annotations
+from collections import deque
+import json
+from pathlib import Path
+import threading
+from typing import Union
+import pytest
+
+requests = pytest.importorskip('requests')
+pytest.importorskip('gemdqm')
+
+OMS_DIR = Path(__file__).resolve().parents[1]
+# a gap every 7 runs, as for the runs never started
+RUNS = [run for run in range(355000, 355500) if run % 7 != 3]
+OPERATORS = {
+    'GE': lambda run, bound: run >= bound,
+    'LE': lambda run, bound: run <= bound,
+    'GT': lambda run, bound: run > bound,
+}
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int, body: bytes) -> None:
+        self.status_code = status_code
+        self.body = body
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} error', response=self)
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class FakeQuery:
+
+    def __init__(self, oms: FakeOMSAPI) -> None:
+        self.oms = oms
+        self.filter_list: list[dict] = []
+        self.ascending = True
+        self.page = 1
+        self.per_page = 10
+
+    def filters(self, filters: list[dict]) -> None:
+        self.filter_list += filters
+
+    def sort(self, attribute: str, asc: bool = True) -> None:
+        assert attribute == 'run_number'
+        self.ascending = asc
+
+    def paginate(self, page: int = 1, per_page: int = 10) -> None:
+        self.page = page
+        self.per_page = per_page
+
+    def data(self) -> FakeResponse:
+        with self.oms.lock:
+            self.oms.queries.append(self)
+            answer = self.oms.answers.popleft() if len(self.oms.answers) > 0 else None
+        if answer == 'disconnect':
+            raise requests.ConnectionError('connection reset')
+        elif answer is not None:
+            return FakeResponse(answer, b'{"errors": []}')
+
+        runs = self.oms.runs
+        for each in self.filter_list:
+            assert each['attribute_name'] == 'run_number'
+            runs = [run for run in runs if OPERATORS[each['operator']](run, each['value'])]
+        runs = sorted(runs, reverse=not self.ascending)
+        offset = (self.page - 1) * self.per_page
+        data = [{'id': str(run), 'attributes': {'run_number': run}} for run in runs[offset:offset + self.per_page]]
+        return FakeResponse(200, json.dumps({'data': data}).encode())
+
+
+class FakeOMSAPI:
+    """
+    :queries: every query sent
+    :answers: the next answers, an HTTP status or 'disconnect', before the data
+    """
+
+    def __init__(self, runs: list[int]) -> None:
+        self.runs = runs
+        self.queries: list[FakeQuery] = []
+        self.answers: deque[Union[int, str]] = deque()
+        self.lock = threading.Lock()
+
+    def query(self, resource: str) -> FakeQuery:
+        assert resource == 'runs'
+        return FakeQuery(self)
+
+
+@pytest.fixture
+def fetch_runs(load_script, monkeypatch):
+    module = load_script(OMS_DIR / 'fetch-runs.py')
+    monkeypatch.setattr(module.time, 'sleep', lambda delay: None)
+    return module
+
+
+@pytest.fixture
+def oms():
+    return FakeOMSAPI(RUNS)
+
+
+def run_numbers(data: list[dict]) -> list[int]:
+    return [each['attributes']['run_number'] for each in data]
+
+
+def test_fetch_runs_follows_pages(fetch_runs, oms):
+    filters = [{'attribute_name': 'run_number', 'value': 355010, 'operator': 'GE'},
+               {'attribute_name': 'run_number', 'value': 355100, 'operator': 'LE'}]
+    data = fetch_runs.fetch_runs(oms, filters, per_page=10)
+    expected = [run for run in RUNS if 355010 <= run <= 355100]
+    assert run_numbers(data) == expected
+    assert len(oms.queries) == len(expected) // 10 + 1
+
+
+def test_fetch_page_retries_with_backoff(fetch_runs, oms, monkeypatch):
+    delays = []
+    monkeypatch.setattr(fetch_runs.time, 'sleep', delays.append)
+    oms.answers.extend([503, 'disconnect', 429])
+    data = fetch_runs.fetch_page(oms, [], page=1, per_page=5)
+    assert run_numbers(data) == RUNS[:5]
+    backoff = fetch_runs.RETRY_BACKOFF
+    assert delays == [backoff, 2 * backoff, 4 * backoff]
+
+
+def test_fetch_page_gives_up(fetch_runs, oms):
+    oms.answers.extend([502] * (fetch_runs.NUM_RETRIES + 1))
+    with pytest.raises(RuntimeError, match='after 5 attempts'):
+        fetch_runs.fetch_page(oms, [], page=1)
+    assert len(oms.queries) == fetch_runs.NUM_RETRIES + 1
+
+
+@pytest.mark.parametrize('status', [400, 401, 403, 404])
+def test_fetch_page_does_not_retry_client_errors(fetch_runs, oms, monkeypatch, status):
+    delays = []
+    monkeypatch.setattr(fetch_runs.time, 'sleep', delays.append)
+    oms.answers.append(status)
+    with pytest.raises(requests.HTTPError):
+        fetch_runs.fetch_page(oms, [], page=1)
+    assert len(oms.queries) == 1
+    assert delays == []
+
+
+def test_fetch_latest_run(fetch_runs, oms):
+    assert fetch_runs.fetch_latest_run(oms) == RUNS[-1]
+
+
+def test_fetch_run_range_merges_shards_in_order(fetch_runs, oms):
+    oms.answers.extend([503, 'disconnect', 500])
+    data = fetch_runs.fetch_run_range(oms, 355003, 355480, jobs=4, shard_size=50)
+    assert run_numbers(data) == [run for run in RUNS if 355003 <= run <= 355480]
+    shard_starts = {query.filter_list[0]['value'] for query in oms.queries}
+    assert shard_starts == set(range(355003, 355481, 50))